@@ -11,6 +11,7 @@ import time
 
 import pytest
 import sdk_diag
+import sdk_install
 import sdk_repository
 import sdk_package_registry
 import sdk_utils
@@ -72,6 +73,21 @@ def configure_universe(tmpdir_factory):
         yield from sdk_repository.universe_session()
 
 
+@pytest.fixture(scope="session", autouse=True)
+def uninstall_reused_services(configure_universe):
+    """Uninstalls any services which were left installed for reuse, before the universe is torn down.
+    See sdk_install.SERVICE_REUSE_ENABLED."""
+    yield
+    sdk_install.uninstall_reused_services()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item: pytest.Item):
+    """Hook around the test function itself, excluding its fixtures."""
+    with sdk_install.running_test_body():
+        yield
+
+
 @pytest.hookimpl(tryfirst=True, hookwrapper=True)
 def pytest_runtest_makereport(item: pytest.Item, call):  # _pytest.runner.CallInfo
     """Hook to run after every test, before any other post-test hooks.
@@ -90,7 +106,7 @@ def pytest_runtest_makereport(item: pytest.Item, call):  # _pytest.runner.CallIn
         print("INTEGRATION_TEST_LOG_COLLECTION==False. Skipping log collection")
 
 
-def pytest_runtest_teardown(item: pytest.Item):
+def pytest_runtest_teardown(item: pytest.Item, nextitem):
     """Hook to run after every test."""
     # Inject footer at end of test, may be followed by additional teardown.
     # Don't do this when running in teamcity, where it's redundant.
@@ -107,6 +123,15 @@ def pytest_runtest_teardown(item: pytest.Item):
             )
         )
 
+    if INTEGRATION_TEST_LOG_COLLECTION:
+        sdk_diag.handle_test_teardown(item, nextitem)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    """Hook to run after the whole test run has finished."""
+    if INTEGRATION_TEST_LOG_COLLECTION:
+        sdk_diag.handle_session_finish()
+
 
 def pytest_runtest_setup(item: pytest.Item):
     """Hook to run before every test."""
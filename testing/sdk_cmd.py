@@ -43,6 +43,7 @@ def service_request(
     log_args=True,
     log_response=False,
     timeout_seconds=60,
+    session=None,
     **kwargs,
 ):
     """Used to query a service running on the cluster. See `cluster_request()` for arg meanings.
@@ -62,10 +63,21 @@ def service_request(
         log_args=log_args,
         log_response=log_response,
         timeout_seconds=timeout_seconds,
+        session=session,
         **kwargs,
     )
 
 
+def pooled_session(pool_size=10) -> requests.Session:
+    """Returns a session which can be passed to `cluster_request()` or `service_request()` to reuse
+    connections across requests, including concurrent requests from up to `pool_size` threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def cluster_request(
     method,
     cluster_path,
@@ -74,6 +86,7 @@ def cluster_request(
     log_args=True,
     log_response=False,
     timeout_seconds=60,
+    session=None,
     **kwargs,
 ):
     """Queries the provided cluster HTTP path using the provided method, with the following handy features:
@@ -89,6 +102,8 @@ def cluster_request(
     : param log_args: Whether to log the contents of `kwargs`. Can be disabled to reduce noise.
     : param log_response: Whether to always log the response content.
                           Otherwise responses are only logged if the response code is >= 400.
+    : param session: A `requests.Session` to send the request with, e.g. from `pooled_session()`.
+                    By default, the request is sent on a new connection.
     : param kwargs: Additional arguments to requests.request(), such as `json = {"example": "content"}`
                    or `params = {"example": "param"}`.
     : rtype: requests.Response
@@ -109,15 +124,17 @@ def cluster_request(
 
     auth = AuthHeader(sdk_utils.dcos_token())
 
+    request_fn = session.request if session is not None else requests.request
+
     def _cluster_request():
         start = time.time()
 
         # check if we have verify key already exists.
         if kwargs is not None and kwargs.get("verify") is not None:
             kwargs["verify"] = False
-            response = requests.request(method, url, auth=auth, timeout=timeout_seconds, **kwargs)
+            response = request_fn(method, url, auth=auth, timeout=timeout_seconds, **kwargs)
         else:
-            response = requests.request(
+            response = request_fn(
                 method, url, auth=auth, verify=False, timeout=timeout_seconds, **kwargs
             )
 
@@ -6,11 +6,15 @@ SHOULD ALSO BE APPLIED TO sdk_diag IN ANY OTHER PARTNER REPOS
 """
 
 import collections
+import concurrent.futures
+import functools
+import hashlib
 import json
 import logging
 import os.path
 import re
 import shutil
+import threading
 import time
 import inspect
 
@@ -22,6 +26,8 @@ import sdk_install
 import sdk_package_registry
 import sdk_plan
 import sdk_tasks
+import sdk_utils
+import sdk_waiter
 
 log = logging.getLogger(__name__)
 
@@ -30,6 +36,18 @@ log = logging.getLogger(__name__)
 # Ideally this should be scaled to the number of tasks that can be fetched within ~10min.
 _testlogs_task_id_limit = 250
 
+# The number of concurrent workers used to download task logs across all agents, and the maximum
+# number of those workers which may be downloading from the same agent at a time.
+_testlogs_download_concurrency = 8
+_testlogs_agent_download_concurrency = 2
+
+# The compression applied to downloaded log files while they're written, one of 'none', 'gzip' or
+# 'zstd'. Compressed files are written with the corresponding suffix, e.g. 'stdout.gz', so this is
+# off by default to keep the artifact names which are expected by anything reading the logs.
+_testlogs_compression = sdk_utils.resolve_compression(
+    os.environ.get("INTEGRATION_TEST__LOG_COMPRESSION", sdk_utils.COMPRESSION_NONE)
+)
+
 # Keep track of task ids to collect logs at the correct times. Example scenario:
 # 1 Test suite test_sanity_py starts with 2 tasks to ignore: [test_placement-0, test_placement-1]
 # 2 test_sanity_py.health_check passes, with 3 tasks created: [test-scheduler, pod-0-task, pod-1-task]
@@ -40,8 +58,10 @@ _testlogs_task_id_limit = 250
 # 5 test_sanity_py.restart_1 fails, with 1 new task: [pod-1-task-NEWUUID2]
 #   Upon failure, the following task logs should be collected: [pod-1-task-NEWUUID, pod-1-task-NEWUUID2]
 #   These are the tasks which were newly created following the prior failure.
-#   Previously-collected tasks are not collected again, even though they may have additional log content.
-#   In practice this is fine -- e.g. Scheduler would restart with a new task id if it was reconfigured anyway.
+#   In addition, the previously-collected tasks which were still active when they were collected
+#   [test-scheduler, pod-0-task-NEWUUID, ...] are collected again, but only the log content which
+#   was added since their prior collection is fetched. This content is appended to the files which
+#   were written by the prior collection, see _testlogs_file_offsets.
 
 # The name of current test suite (e.g. 'test_sanity_py'), or an empty string if no test suite has
 # started yet. This is used to determine when the test suite has changed in a test run.
@@ -54,6 +74,93 @@ _testlogs_current_test_suite = ""
 #   (ignore task ids which were already collected before, even if there's new content)
 _testlogs_ignored_task_ids = set([])
 
+# The ids of the tasks which were still active when their logs were last collected. These tasks are
+# collected again following any later failure, as they may have produced more log content since.
+_testlogs_active_task_ids = set([])
+
+# The log files which have been downloaded in this session, as (agent id, agent path) => (local path,
+# byte offset). When a file is collected again, only the content past the offset is fetched, and is
+# appended to the local file.
+_testlogs_file_offsets = {}
+_testlogs_file_offsets_lock = threading.Lock()
+
+# The maximum number of bytes to request per files/read call when fetching new log content.
+_testlogs_read_length = 1024 * 1024
+
+# Budgets for the task logs which are collected following a failure, per test and over the session.
+# Files are fetched in priority order, see _prioritize_tasks(). Files which don't fit in the remaining
+# byte budget are truncated to their head and tail, or are skipped if too little budget remains. Once
+# the time budget is used up, any files which haven't been fetched yet are skipped. What was truncated
+# or skipped for a test is listed in its log_manifest.json.
+_testlogs_test_byte_budget = int(
+    os.environ.get("INTEGRATION_TEST__LOG_BYTES_PER_TEST", 1024 * 1024 * 1024)
+)
+_testlogs_session_byte_budget = int(
+    os.environ.get("INTEGRATION_TEST__LOG_BYTES_PER_SESSION", 10 * 1024 * 1024 * 1024)
+)
+_testlogs_test_time_budget_seconds = int(
+    os.environ.get("INTEGRATION_TEST__LOG_SECONDS_PER_TEST", 15 * 60)
+)
+_testlogs_session_time_budget_seconds = int(
+    os.environ.get("INTEGRATION_TEST__LOG_SECONDS_PER_SESSION", 2 * 60 * 60)
+)
+
+# Files larger than this are always truncated to their head and tail, regardless of the budget.
+_testlogs_file_byte_limit = 64 * 1024 * 1024
+
+# When less than this remains of the byte budget, further files are skipped rather than truncated.
+_testlogs_min_truncated_bytes = 64 * 1024
+
+# The bytes and seconds which have been spent on collecting task logs in this session so far.
+_testlogs_session_bytes = 0
+_testlogs_session_seconds = 0
+
+# Post-failure collection runs in a single background worker, so that it doesn't delay the following
+# tests. With a single worker, collections run in failure order, and each one sees the file offsets
+# which were recorded by the one before it. Pending collections are waited for before the fixtures of
+# a test suite are torn down (see handle_test_teardown()), and at the end of the session.
+_testlogs_async_collection = os.environ.get(
+    "INTEGRATION_TEST__ASYNC_LOG_COLLECTION", "true"
+).lower() in ["true", "1"]
+_testlogs_collection_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="diag-collection"
+)
+
+# The collections which have been started but not yet waited for, as (test name, future).
+_testlogs_pending_collections = []
+
+# The collections which were incomplete in this session, as (test name, [failed parts]).
+_testlogs_failed_collections = []
+
+# The path of the DC/OS diagnostics bundle API, which is used to create and download bundles.
+_DIAGNOSTICS_BUNDLE_API = "/system/health/v1/report/diagnostics"
+
+# The maximum time to wait for the creation of a diagnostics bundle.
+_diagnostics_bundle_timeout_seconds = 10 * 60
+
+# When enabled, the creation of a diagnostics bundle is started following a failure, but the bundle is
+# only waited for and downloaded at the end of the session. The cluster can only create one bundle at a
+# time, so a failure which occurs while a prior bundle is still being created doesn't get its own.
+_diagnostics_bundle_deferred = os.environ.get(
+    "INTEGRATION_TEST__DEFERRED_DIAGNOSTICS_BUNDLE", "false"
+).lower() in ["true", "1"]
+
+# The test artifacts whose diagnostics bundles have been started but not yet downloaded.
+_diagnostics_bundles_pending = []
+
+# Mesos state dumps are stored once per test suite under its 'mesos_state/' directory, named by the
+# hash of their content, and each failed test's mesos_state.json references the dumps which were taken
+# for it. When delta encoding is enabled, a dump which is similar to the last full dump of the same
+# endpoint in the suite is stored as an RFC 6902 JSON Patch against that dump, which may be applied
+# with any JSON Patch implementation.
+_testlogs_mesos_state_deltas = os.environ.get(
+    "INTEGRATION_TEST__MESOS_STATE_DELTAS", "false"
+).lower() in ["true", "1"]
+
+# The last full dump of each Mesos state endpoint in the current test suite, as name => (path of the
+# dump, sha256 of the dump, parsed content). Only used when delta encoding is enabled.
+_testlogs_mesos_state_bases = {}
+
 # The index of the current test, which increases as tests are run, and resets when a new test suite
 # is started. This is used to sort test logs in the order that they were executed, and is useful
 # when tracing a chain of failed tests.
@@ -101,6 +208,7 @@ def handle_test_setup(item: pytest.Item):
         )
         # 2 Reset the test index.
         _testlogs_test_index = 0
+        _testlogs_mesos_state_bases.clear()
         # 3 Remove any prior logs for the test suite.
         test_log_dir = _test_suite_artifact_directory(item)
         if os.path.exists(test_log_dir):
@@ -110,6 +218,30 @@ def handle_test_setup(item: pytest.Item):
     # Increment the test index (to 1, if this is a new suite)
     _testlogs_test_index += 1
 
+    # Only record the plan timelines of waits which occur during this test.
+    sdk_plan.reset_plan_timelines()
+
+
+def handle_test_teardown(item: pytest.Item, nextitem=None):
+    """Writes the timelines of any plans which were waited on during the test, for use in tracking
+    deployment durations across runs. If this is the last test of its suite, also waits for any
+    post-failure collection which is still running, before the suite's fixtures tear down the
+    services which are being collected from.
+
+    This should be called in a pytest_runtest_teardown() hook, before the fixture teardown."""
+    if nextitem is None or get_test_suite_name(nextitem) != get_test_suite_name(item):
+        _wait_for_collections()
+
+    timelines = sdk_plan.get_plan_timelines()
+    if not timelines:
+        return
+    out_path = _setup_artifact_path(item, "plan_timelines.json")
+    out_content = json.dumps(timelines, indent=2)
+    log.info("=> Writing {} ({} bytes)".format(out_path, len(out_content)))
+    with open(out_path, "w") as f:
+        f.write(out_content)
+        f.write("\n")  # ... and a trailing newline
+
 
 def _task_whitelist_callback(item: pytest.Item):
     """Returns a callback configured by pytest marker diag_task_whitelist
@@ -141,14 +273,15 @@ def _task_whitelist_callback(item: pytest.Item):
 def handle_test_report(item: pytest.Item, result):  # _pytest.runner.TestReport
     """Collects information from the cluster following a failed test.
 
+    The state of the cluster is captured immediately, see _capture_cluster_state(), and the bulk
+    downloads then run in the background, see _testlogs_async_collection.
+
     This should be called in a hookimpl fixture.
     See also handle_test_setup() which must be called in a pytest_runtest_setup() hook."""
 
     if not result.failed or os.environ.get('DISABLE_DIAG'):
         return  # passed, nothing to do, or diagnostics collection disabled
 
-    # Fetch all state from all currently-installed services.
-    # We do this retrieval first in order to be closer to the actual test failure.
     # Services may still be installed when e.g. we're still in the middle of a test suite.
     service_names = list(
         filter(
@@ -156,6 +289,123 @@ def handle_test_report(item: pytest.Item, result):  # _pytest.runner.TestReport
             sdk_install.get_installed_service_names().union(_whitelisted_service_names(item)),
         )
     )
+
+    # Fetch all logs from tasks created since the last failure, or since the start of the suite.
+    global _testlogs_ignored_task_ids
+    global _testlogs_active_task_ids
+    # Only tasks launched since the ignored tasks were listed are queried, along with the active ones.
+    cluster_tasks = sdk_tasks.get_recent_tasks(
+        _testlogs_ignored_task_ids, _testlogs_active_task_ids, _testlogs_task_id_limit
+    )
+    new_task_ids = [task.id for task in cluster_tasks if task.id not in _testlogs_ignored_task_ids]
+    # Also fetch any new log content from tasks which were still active when last collected.
+    updated_task_ids = [task.id for task in cluster_tasks if task.id in _testlogs_active_task_ids]
+    _testlogs_ignored_task_ids = _testlogs_ignored_task_ids.union(new_task_ids)
+    # Enforce limit on how many tasks we will fetch logs from, to avoid unbounded log fetching.
+    if len(new_task_ids) > _testlogs_task_id_limit:
+        log.warning(
+            "Truncating list of {}+ new tasks to size {} to avoid fetching logs forever: {}".format(
+                len(new_task_ids), _testlogs_task_id_limit, new_task_ids
+            )
+        )
+        del new_task_ids[_testlogs_task_id_limit:]
+    collected_task_ids = set(new_task_ids + updated_task_ids)
+    _testlogs_active_task_ids = set(
+        task.id for task in cluster_tasks if task.id in collected_task_ids and not task.is_completed
+    )
+    # The tasks' agents and executors are taken from the same summary, rather than being looked up
+    # again by the collection.
+    task_entries = [
+        _TaskEntry.from_task(task) for task in cluster_tasks if task.id in collected_task_ids
+    ]
+
+    artifacts = _TestArtifacts(item)
+    # The state of the cluster is captured right away, in order to be close to the actual test failure.
+    # Only the bulk downloads are left to the collection which follows.
+    files, failures = _capture_cluster_state(
+        artifacts, service_names, new_task_ids, updated_task_ids, task_entries
+    )
+    collect = functools.partial(_collect_diagnostics, artifacts, files, failures)
+    if _testlogs_async_collection:
+        log.info("Starting post-failure collection for {} in the background".format(artifacts.name))
+        _testlogs_pending_collections.append(
+            (artifacts.name, _testlogs_collection_executor.submit(collect))
+        )
+    else:
+        failures = collect()
+        if failures:
+            _testlogs_failed_collections.append((artifacts.name, failures))
+
+
+def handle_session_finish():
+    """Waits for any post-failure collection which is still running, and then reports any collection
+    which was incomplete over the session.
+
+    This should be called in a pytest_sessionfinish() hook."""
+    _wait_for_collections()
+    _testlogs_collection_executor.shutdown()
+    while _diagnostics_bundles_pending:
+        artifacts = _diagnostics_bundles_pending.pop(0)
+        try:
+            _collect_diagnostics_bundle(artifacts)
+        except Exception:
+            log.exception("Diagnostics bundle collection failed")
+            _testlogs_failed_collections.append((artifacts.name, ["diagnostics bundle"]))
+    if _testlogs_failed_collections:
+        log.error(
+            "Post-failure collection was incomplete for {} tests:\n- {}".format(
+                len(_testlogs_failed_collections),
+                "\n- ".join(
+                    "{}: {}".format(name, ", ".join(failures))
+                    for name, failures in _testlogs_failed_collections
+                ),
+            )
+        )
+
+
+def _wait_for_collections():
+    """Waits for all of the pending post-failure collections to finish."""
+    if not _testlogs_pending_collections:
+        return
+    start = time.time()
+    log.info(
+        "Waiting for post-failure collection of {} tests: {}".format(
+            len(_testlogs_pending_collections),
+            ", ".join(name for name, _ in _testlogs_pending_collections),
+        )
+    )
+    while _testlogs_pending_collections:
+        name, future = _testlogs_pending_collections.pop(0)
+        try:
+            failures = future.result()
+        except Exception as e:
+            failures = ["collection ({})".format(e)]
+        if failures:
+            _testlogs_failed_collections.append((name, failures))
+    log.info(
+        "Waited {} for post-failure collection".format(
+            sdk_utils.pretty_duration(time.time() - start)
+        )
+    )
+
+
+def _capture_cluster_state(
+    artifacts,
+    service_names: list,
+    new_task_ids: list,
+    updated_task_ids: list,
+    task_entries: list,
+) -> tuple:
+    """Captures the state of the cluster following a failed test into its artifact directory: the
+    plans and threads of the installed services, the Mesos state, and the listing of the task log
+    files along with their current sizes. The creation of a cluster diagnostics bundle is started
+    too. Failures of the individual parts are logged, and don't prevent the other parts from
+    running. Returns the _AgentFiles to be downloaded, and the descriptions of the parts which
+    failed."""
+    start = time.time()
+    failures = []
+
+    # Fetch all state from all currently-installed services.
     if len(service_names) > 0:
         log.info(
             "Fetching plans for {} services that are currently installed: {}".format(
@@ -165,47 +415,77 @@ def handle_test_report(item: pytest.Item, result):  # _pytest.runner.TestReport
         for service_name in service_names:
             try:
                 # Skip thread retrieval if plan retrieval fails:
-                _dump_plans(item, service_name)
-                _dump_threads(item, service_name)
+                _dump_plans(artifacts, service_name)
+                _dump_threads(artifacts, service_name)
             except Exception:
                 log.exception("Plan/thread collection from service {} failed!".format(service_name))
+                failures.append("plans/threads of {}".format(service_name))
 
-    # Fetch all logs from tasks created since the last failure, or since the start of the suite.
-    global _testlogs_ignored_task_ids
-    new_task_ids = [
-        task.id
-        for task in sdk_tasks.get_summary(with_completed=True)
-        if task.id not in _testlogs_ignored_task_ids
-    ]
-    _testlogs_ignored_task_ids = _testlogs_ignored_task_ids.union(new_task_ids)
-    # Enforce limit on how many tasks we will fetch logs from, to avoid unbounded log fetching.
-    if len(new_task_ids) > _testlogs_task_id_limit:
-        log.warning(
-            "Truncating list of {} new tasks to size {} to avoid fetching logs forever: {}".format(
-                len(new_task_ids), _testlogs_task_id_limit, new_task_ids
-            )
-        )
-        del new_task_ids[_testlogs_task_id_limit:]
+    try:
+        log.info("Fetching mesos state:")
+        _dump_mesos_state(artifacts)
+    except Exception:
+        log.exception("Mesos state collection failed!")
+        failures.append("mesos state")
+
+    files = []
     try:
         log.info(
-            "Fetching logs for {} tasks launched in this suite since last failure: {}".format(
+            "Listing logs for {} tasks launched in this suite since last failure: {}".format(
                 len(new_task_ids), ", ".join(new_task_ids)
             )
         )
-        _dump_task_logs(item, new_task_ids)
+        if updated_task_ids:
+            log.info(
+                "Listing new log content for {} previously collected tasks: {}".format(
+                    len(updated_task_ids), ", ".join(updated_task_ids)
+                )
+            )
+        files = _list_task_log_files(artifacts, task_entries, service_names)
     except Exception:
-        log.exception("Task log collection failed!")
+        log.exception("Task log listing failed!")
+        failures.append("task logs")
     try:
-        log.info("Fetching mesos state:")
-        _dump_mesos_state(item)
+        log.info("Creating cluster diagnostics bundle:")
+        _start_diagnostics_bundle(artifacts)
     except Exception:
-        log.exception("Mesos state collection failed!")
+        log.exception("Diagnostics bundle creation failed")
+        failures.append("diagnostics bundle")
+    log.info(
+        "Captured cluster state for {} after {}".format(
+            artifacts.name, sdk_utils.pretty_duration(time.time() - start)
+        )
+    )
+    return files, failures
+
+
+def _collect_diagnostics(artifacts, files: list, failures: list) -> list:
+    """Downloads the task logs which were listed by _capture_cluster_state(), along with the cluster
+    diagnostics bundle which it started unless that is deferred, into the test's artifact directory.
+    Returns the descriptions of the parts which failed, including those which failed when the
+    cluster state was captured."""
+    start = time.time()
+    failures = list(failures)
     try:
-        log.info("Creating/fetching cluster diagnostics bundle:")
-        _dump_diagnostics_bundle(item)
+        _dump_task_logs(artifacts, files)
     except Exception:
-        log.exception("Diagnostics bundle creation failed")
-    log.info("Post-failure collection complete")
+        log.exception("Task log collection failed!")
+        failures.append("task logs")
+    if artifacts.diagnostics_bundle_started and not _diagnostics_bundle_deferred:
+        try:
+            log.info("Fetching cluster diagnostics bundle:")
+            _collect_diagnostics_bundle(artifacts)
+        except Exception:
+            log.exception("Diagnostics bundle collection failed")
+            failures.append("diagnostics bundle")
+    log.info(
+        "Post-failure collection for {} complete after {}{}".format(
+            artifacts.name,
+            sdk_utils.pretty_duration(time.time() - start),
+            " ({} failed)".format(", ".join(failures)) if failures else "",
+        )
+    )
+    return failures
 
 
 def _whitelisted_service_names(item: pytest.Item) -> set:
@@ -228,101 +508,417 @@ def _whitelisted_service_names(item: pytest.Item) -> set:
     return whitelisted_service_names
 
 
-def _dump_plans(item: pytest.Item, service_name: str):
+def _dump_plans(artifacts, service_name: str):
     """If the test had failed, writes the plan state(s) to log file(s)."""
 
     # Use brief timeouts, we just want a best-effort attempt here:
-    plan_names = sdk_plan.list_plans(service_name, 5)
-    for plan_name in plan_names:
-        plan = sdk_plan.get_plan(service_name, plan_name, 5)
+    snapshot = sdk_plan.get_all_plans(service_name, 5)
+    for plan_name, entry in snapshot["plans"].items():
+        if "plan" not in entry:
+            continue  # failure was already logged
         # Include service name in plan filename, but be careful about folders...
-        out_path = _setup_artifact_path(
-            item, "plan_{}_{}.json".format(service_name.replace("/", "_"), plan_name)
+        out_path = artifacts.path(
+            "plan_{}_{}.json".format(service_name.replace("/", "_"), plan_name)
         )
-        out_content = json.dumps(plan, indent=2)
+        out_content = json.dumps(entry["plan"], indent=2)
         log.info("=> Writing {} ({} bytes)".format(out_path, len(out_content)))
         with open(out_path, "w") as f:
             f.write(out_content)
             f.write("\n")  # ... and a trailing newline
 
 
-def _dump_threads(item: pytest.Item, service_name: str):
+def _dump_threads(artifacts, service_name: str):
     threads = sdk_cmd.service_request(
         "GET", service_name, "v1/debug/threads", timeout_seconds=5
     ).text
-    out_path = _setup_artifact_path(item, "threads_{}.txt".format(service_name.replace("/", "_")))
+    out_path = artifacts.path("threads_{}.txt".format(service_name.replace("/", "_")))
     log.info("=> Writing {} ({} bytes)".format(out_path, len(threads)))
     with open(out_path, "w") as f:
         f.write(threads)
         f.write("\n")  # ... and a trailing newline
 
 
-def _dump_diagnostics_bundle(item: pytest.Item):
-    """Creates and downloads a DC/OS diagnostics bundle, and saves it to the artifact path for this test."""
-    rc, _, _ = sdk_cmd.run_cli("node diagnostics create all")
-    if rc:
-        log.error("Diagnostics bundle creation failed.")
-        return
+def _start_diagnostics_bundle(artifacts):
+    """Starts the creation of a DC/OS diagnostics bundle for the test, and records it in the test's
+    artifacts. This is done when the cluster state is captured, such that the bundle reflects the
+    failure rather than the tests which run after it. The bundle is then downloaded by
+    _collect_diagnostics_bundle(), either by the collection which follows, or at the end of the
+    session if _diagnostics_bundle_deferred is enabled."""
+    response = sdk_cmd.cluster_request(
+        "POST", "{}/create".format(_DIAGNOSTICS_BUNDLE_API), retry=False, json={"nodes": ["all"]}
+    )
+    # Older versions of the API don't return the name, in which case it's taken from the status:
+    artifacts.diagnostics_bundle_name = (response.json().get("extra") or {}).get("bundle_name")
+    artifacts.diagnostics_bundle_started = True
+    if _diagnostics_bundle_deferred:
+        log.info(
+            "Started diagnostics bundle {}, which will be downloaded at the end of the session".format(
+                artifacts.diagnostics_bundle_name or ""
+            )
+        )
+        _diagnostics_bundles_pending.append(artifacts)
+    else:
+        log.info("Started diagnostics bundle {}".format(artifacts.diagnostics_bundle_name or ""))
+
+
+def _collect_diagnostics_bundle(artifacts):
+    """Waits for the creation of the test's diagnostics bundle to finish, and then downloads it."""
+    bundle_name = _wait_for_diagnostics_bundle(artifacts.diagnostics_bundle_name)
+    out_path = artifacts.path(bundle_name)
+    start = time.time()
+    byte_count = _download_diagnostics_bundle(bundle_name, out_path)
+    log.info(
+        "Downloaded diagnostics bundle {} ({} bytes) after {}".format(
+            out_path, byte_count, sdk_utils.pretty_duration(time.time() - start)
+        )
+    )
+
+
+def _wait_for_diagnostics_bundle(bundle_name) -> str:
+    """Polls the bundle creation status until it's finished, and returns the name of the bundle.
+    Polling backs off while the creation progress isn't changing."""
+    interval = sdk_waiter.AdaptiveInterval(
+        "Wait for diagnostics bundle {}".format(bundle_name or ""),
+        min_interval_ms=1000,
+        max_interval_ms=15000,
+    )
 
     @retrying.retry(
-        wait_fixed=5000,
-        stop_max_delay=10 * 60 * 1000,
+        wait_func=interval,
+        stop_max_delay=_diagnostics_bundle_timeout_seconds * 1000,
         retry_on_result=lambda result: result is None,
     )
-    def wait_for_bundle_file():
-        rc, stdout, stderr = sdk_cmd.run_cli("node diagnostics --status --json")
-        if rc:
-            return None
-
+    def fn():
+        response = sdk_cmd.cluster_request(
+            "GET", "{}/status/all".format(_DIAGNOSTICS_BUNDLE_API), retry=False
+        )
         # e.g. { "some-ip": { stuff we want } }
-        status = next(iter(json.loads(stdout).values()))
-        if status["job_progress_percentage"] != 100:
+        status = next(iter(response.json().values()))
+        interval.observe(status["job_progress_percentage"])
+        if status.get("is_running") or status["job_progress_percentage"] != 100:
             return None
 
         # e.g. "/var/lib/dcos/dcos-diagnostics/diag-bundles/bundle-2018-01-11-1515698691.zip"
-        return os.path.basename(status["last_bundle_dir"])
-
-    bundle_filename = wait_for_bundle_file()
-    if bundle_filename:
-        sdk_cmd.run_cli(
-            "node diagnostics download {} --location={}".format(
-                bundle_filename, _setup_artifact_path(item, bundle_filename)
-            )
-        )
-    else:
-        log.error("Diagnostics bundle didnt finish in time, giving up.")
+        return bundle_name or os.path.basename(status["last_bundle_dir"])
 
-
-def _dump_mesos_state(item: pytest.Item):
-    """Downloads state from the Mesos master and saves it to the artifact path for this test."""
+    try:
+        return fn()
+    finally:
+        interval.report()
+
+
+@retrying.retry(
+    wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5
+)
+def _download_diagnostics_bundle(bundle_name: str, out_path: str) -> int:
+    """Streams the bundle to the output path, and returns its size. If a prior attempt was
+    interrupted, the download is resumed from where that attempt left off."""
+    offset = _get_file_size(out_path)
+    response = sdk_cmd.cluster_request(
+        "GET",
+        "{}/serve/{}".format(_DIAGNOSTICS_BUNDLE_API, bundle_name),
+        retry=False,
+        raise_on_error=False,
+        stream=True,
+        headers={"Range": "bytes={}-".format(offset)} if offset else {},
+    )
+    if offset and response.status_code == 416:
+        return offset  # a prior attempt got the whole bundle
+    response.raise_for_status()
+    if offset and response.status_code != 206:
+        log.info("Range requests aren't supported, restarting the bundle download")
+        offset = 0
+    sdk_utils.write_response(response, out_path, mode="ab" if offset else "wb")
+    return _get_file_size(out_path)
+
+
+def _dump_mesos_state(artifacts):
+    """Downloads state from the Mesos master and saves it to the artifact path for this test.
+    See _testlogs_mesos_state_deltas for how the dumps are stored."""
+    references = collections.OrderedDict()
     for name in ["state.json", "slaves"]:
         r = sdk_cmd.cluster_request("GET", "/mesos/{}".format(name), raise_on_error=False)
         if r.ok:
             if name.endswith(".json"):
                 name = name[: -len(".json")]  # avoid duplicate '.json'
-            with open(_setup_artifact_path(item, "mesos_{}.json".format(name)), "w") as f:
-                f.write(r.text)
+            references[name] = _store_mesos_state(artifacts, name, r.content)
+    if references:
+        out_path = artifacts.path("mesos_state.json")
+        log.info("=> Writing {} ({})".format(out_path, ", ".join(references.keys())))
+        with open(out_path, "w") as f:
+            f.write(json.dumps(references, indent=2))
+            f.write("\n")  # ... and a trailing newline
+
 
+def _store_mesos_state(artifacts, name: str, content: bytes) -> collections.OrderedDict:
+    """Stores a Mesos state dump in the test suite's 'mesos_state/' directory, unless an identical
+    dump is already stored there. Returns a reference to the stored dump, with paths relative to the
+    test's artifact directory."""
+    start = time.time()
+    store_dir = os.path.join(os.path.dirname(artifacts.directory), "mesos_state")
+    os.makedirs(store_dir, exist_ok=True)
+    digest = hashlib.sha256(content).hexdigest()
+    suffix = sdk_utils.compression_suffix(_testlogs_compression)
+    reference = collections.OrderedDict([("sha256", digest), ("size", len(content))])
+
+    full_path = os.path.join(store_dir, "{}_{}.json{}".format(name, digest[:20], suffix))
+    patch_path = None
+    parsed = None
+    base = _testlogs_mesos_state_bases.get(name) if _testlogs_mesos_state_deltas else None
+    if os.path.exists(full_path):
+        outcome = "identical to a prior dump"
+    elif base is not None:
+        base_path, base_digest, base_content = base
+        patch_path = os.path.join(
+            store_dir, "{}_{}.patch-{}.json{}".format(name, digest[:20], base_digest[:8], suffix)
+        )
+        if os.path.exists(patch_path):
+            outcome = "identical to a prior dump"
+        else:
+            parsed = json.loads(content.decode("utf-8"))
+            patch = json.dumps(_json_patch(base_content, parsed)).encode("utf-8")
+            if len(patch) <= len(content) / 2:
+                with sdk_utils.open_compressed(patch_path, _testlogs_compression) as f:
+                    f.write(patch)
+                outcome = "stored as a {} byte patch".format(len(patch))
+            else:
+                patch_path = None  # too different: store in full, and use as the next base
+    if patch_path is not None:
+        reference["base"] = os.path.relpath(base_path, artifacts.directory)
+        reference["patch"] = os.path.relpath(patch_path, artifacts.directory)
+    else:
+        if not os.path.exists(full_path):
+            with sdk_utils.open_compressed(full_path, _testlogs_compression) as f:
+                f.write(content)
+            outcome = "stored in full"
+            if _testlogs_mesos_state_deltas:
+                if parsed is None:
+                    parsed = json.loads(content.decode("utf-8"))
+                _testlogs_mesos_state_bases[name] = (full_path, digest, parsed)
+        reference["path"] = os.path.relpath(full_path, artifacts.directory)
+    log.info(
+        "Mesos {} ({} bytes, sha256 {}): {} after {}".format(
+            name,
+            len(content),
+            digest[:20],
+            outcome,
+            sdk_utils.pretty_duration(time.time() - start),
+        )
+    )
+    return reference
+
+
+def _json_patch(old, new, path="") -> list:
+    """Returns RFC 6902 JSON Patch operations which turn the old JSON value into the new one. Objects
+    are compared by key and lists by index, so content which was appended to a list produces 'add'
+    operations, rather than replacing the list."""
+    if type(old) is not type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+    if isinstance(old, dict):
+        ops = []
+        for key, value in old.items():
+            key_path = "{}/{}".format(path, key.replace("~", "~0").replace("/", "~1"))
+            if key not in new:
+                ops.append({"op": "remove", "path": key_path})
+            else:
+                ops.extend(_json_patch(value, new[key], key_path))
+        for key, value in new.items():
+            if key not in old:
+                key_path = "{}/{}".format(path, key.replace("~", "~0").replace("/", "~1"))
+                ops.append({"op": "add", "path": key_path, "value": value})
+        return ops
+    if isinstance(old, list):
+        ops = []
+        for index in range(min(len(old), len(new))):
+            ops.extend(_json_patch(old[index], new[index], "{}/{}".format(path, index)))
+        for index in range(len(old), len(new)):
+            ops.append({"op": "add", "path": "{}/-".format(path), "value": new[index]})
+        # Remove from the end, such that the indexes of the remaining removals are unaffected:
+        for index in reversed(range(len(new), len(old))):
+            ops.append({"op": "remove", "path": "{}/{}".format(path, index)})
+        return ops
+    if old != new:
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+
+def _list_task_log_files(artifacts, task_entries: list, service_names: list) -> list:
+    """Returns _AgentFiles for the task, executor, and agent logs of all of the provided tasks, in the
+    order in which they should be downloaded. Their sizes are taken now, such that the download is
+    limited to the content which existed at the failure, even if it runs later."""
+    task_entries = _prioritize_tasks(task_entries, service_names)
+    task_ranks = dict((task_entry.task_id, rank) for rank, task_entry in enumerate(task_entries))
+    matching_tasks_by_agent = collections.OrderedDict()
+    for task_entry in task_entries:
+        matching_tasks_by_agent.setdefault(task_entry.agent_id, []).append(task_entry)
+
+    files = []
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=_testlogs_download_concurrency
+    ) as executor:
+        listings = [
+            (
+                agent_id,
+                executor.submit(
+                    _list_task_log_files_for_agent, artifacts, agent_id, agent_tasks, task_ranks
+                ),
+            )
+            for agent_id, agent_tasks in matching_tasks_by_agent.items()
+        ]
+        for agent_id, listing in listings:
+            try:
+                files.extend(listing.result())
+            except Exception:
+                log.exception("Failed to get logs for agent {}".format(agent_id))
+    files.sort(key=lambda agent_file: agent_file.rank)
+    return files
 
-def _dump_task_logs(item: pytest.Item, task_ids: list):
+
+def _dump_task_logs(artifacts, files: list):
     """
-    For all of the provided tasks, downloads their task, executor, and agent logs to the artifact path for this test.
+    Downloads the provided _AgentFiles, as listed by _list_task_log_files(), to the artifact path for this test.
     """
-    task_ids_set = set(task_ids)
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()
-    matching_tasks_by_agent = {}
-    for cluster_task in cluster_tasks["tasks"]:
-        task_entry = _TaskEntry(cluster_task)
-        if task_entry.task_id in task_ids_set:
-            agent_tasks = matching_tasks_by_agent.get(task_entry.agent_id, [])
-            agent_tasks.append(task_entry)
-            matching_tasks_by_agent[task_entry.agent_id] = agent_tasks
-
-    for agent_id, agent_tasks in matching_tasks_by_agent.items():
-        try:
-            _dump_task_logs_for_agent(item, agent_id, agent_tasks)
-        except Exception:
-            log.exception("Failed to get logs for agent {}".format(agent_id))
+    global _testlogs_session_bytes
+    global _testlogs_session_seconds
+    start = time.time()
+    byte_budget = max(
+        0, min(_testlogs_test_byte_budget, _testlogs_session_byte_budget - _testlogs_session_bytes)
+    )
+    time_budget_seconds = max(
+        0,
+        min(
+            _testlogs_test_time_budget_seconds,
+            _testlogs_session_time_budget_seconds - _testlogs_session_seconds,
+        ),
+    )
+    deadline = start + time_budget_seconds
+
+    files = _resolve_file_offsets(files)
+    stats = collections.OrderedDict((agent_file.agent_id, _AgentLogStats()) for agent_file in files)
+    # First allocate the byte budget across all of the files in priority order, and then download
+    # them. Each agent's files are downloaded by at most _testlogs_agent_download_concurrency workers
+    # at a time.
+    _apply_byte_budget(files, byte_budget)
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=_testlogs_download_concurrency
+    ) as executor:
+        queues = collections.OrderedDict()
+        for agent_file in files:
+            if agent_file.status is None:
+                queues.setdefault(agent_file.agent_id, collections.deque()).append(agent_file)
+        downloads = []
+        for agent_id, queue in queues.items():
+            for _ in range(min(_testlogs_agent_download_concurrency, len(queue))):
+                downloads.append(
+                    executor.submit(
+                        _download_agent_files, agent_id, queue, stats[agent_id], deadline
+                    )
+                )
+        concurrent.futures.wait(downloads)
+
+    for agent_id, agent_stats in stats.items():
+        log.info(
+            "Downloaded {} bytes ({} bytes written) in {} files from agent {} over {}".format(
+                agent_stats.byte_count,
+                agent_stats.written_count,
+                agent_stats.file_count,
+                agent_id,
+                sdk_utils.pretty_duration(agent_stats.duration()),
+            )
+        )
+    duration = time.time() - start
+    byte_count = sum(agent_stats.byte_count for agent_stats in stats.values())
+    _testlogs_session_bytes += byte_count
+    _testlogs_session_seconds += duration
+    statuses = collections.Counter(agent_file.status for agent_file in files)
+    log.info(
+        "Downloaded {} bytes of logs ({} bytes written, {}) from {} agents after {}: {}".format(
+            byte_count,
+            sum(agent_stats.written_count for agent_stats in stats.values()),
+            _testlogs_compression,
+            len(stats),
+            sdk_utils.pretty_duration(duration),
+            ", ".join("{} {}".format(count, status) for status, count in statuses.items()),
+        )
+    )
+    _write_log_manifest(
+        artifacts,
+        files,
+        collections.OrderedDict(
+            [
+                ("byte_budget", byte_budget),
+                ("time_budget_seconds", time_budget_seconds),
+                ("downloaded_bytes", byte_count),
+                ("duration_seconds", duration),
+                ("session_downloaded_bytes", _testlogs_session_bytes),
+                ("session_duration_seconds", _testlogs_session_seconds),
+            ]
+        ),
+    )
+
+
+def _prioritize_tasks(task_entries: list, service_names: list) -> list:
+    """Returns the tasks in the order in which their logs should be collected: Failed tasks first, then
+    tasks of the services under test, then any other tasks. Within each of these groups, the tasks
+    keep their original order, which is newest first as returned by sdk_tasks.get_summary()."""
+    try:
+        response = sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()
+        service_framework_ids = set(
+            fwk["id"]
+            for fwk in response["frameworks"] + response.get("completed_frameworks", [])
+            if fwk["name"] in service_names
+        )
+    except Exception:
+        log.exception("Failed to get frameworks, tasks of the services under test won't go first")
+        service_framework_ids = set()
+
+    def priority(task_entry):
+        if task_entry.state in sdk_tasks.FATAL_TERMINAL_TASK_STATES:
+            return 0
+        if task_entry.framework_id in service_framework_ids:
+            return 1
+        return 2
+
+    return sorted(task_entries, key=priority)
+
+
+def _apply_byte_budget(files: list, byte_budget: int) -> None:
+    """Limits the content to be fetched of each of the provided _AgentFiles, which are in priority
+    order, such that they fit in the byte budget. Files which don't fit at all are marked as skipped."""
+    remaining = byte_budget
+    for agent_file in files:
+        length = agent_file.size - agent_file.offset
+        limit = min(length, _testlogs_file_byte_limit, remaining)
+        if limit < length:
+            if limit < _testlogs_min_truncated_bytes:
+                agent_file.status = "skipped (byte budget)"
+                continue
+            agent_file.byte_limit = limit
+        remaining -= limit
+
+
+def _write_log_manifest(artifacts, files: list, summary: collections.OrderedDict) -> None:
+    """Writes the budgets and usage of the collection along with what was done with each file."""
+    summary["files"] = [
+        collections.OrderedDict(
+            [
+                ("agent_id", agent_file.agent_id),
+                ("path", agent_file.path),
+                ("out_path", agent_file.out_path),
+                ("size", agent_file.size),
+                ("offset", agent_file.offset),
+                ("fetched_bytes", agent_file.fetched_bytes),
+                ("status", agent_file.status),
+            ]
+        )
+        for agent_file in files
+    ]
+    out_path = artifacts.path("log_manifest.json")
+    out_content = json.dumps(summary, indent=2)
+    log.info("=> Writing {} ({} bytes)".format(out_path, len(out_content)))
+    with open(out_path, "w") as f:
+        f.write(out_content)
+        f.write("\n")  # ... and a trailing newline
 
 
 class _TaskEntry(object):
@@ -330,6 +926,20 @@ class _TaskEntry(object):
         self.task_id = cluster_task["id"]
         self.executor_id = cluster_task["executor_id"]
         self.agent_id = cluster_task["slave_id"]
+        self.framework_id = cluster_task.get("framework_id")
+        self.state = cluster_task.get("state")
+
+    @staticmethod
+    def from_task(task):  # sdk_tasks.Task
+        return _TaskEntry(
+            {
+                "id": task.id,
+                "executor_id": task.executor_id,
+                "slave_id": task.agent_id,
+                "framework_id": task.framework_id,
+                "state": task.state,
+            }
+        )
 
     def __repr__(self):
         return "Task[task_id={} executor_id={} agent_id={}]".format(
@@ -337,47 +947,264 @@ class _TaskEntry(object):
         )
 
 
-def _dump_task_logs_for_agent(item: pytest.Item, agent_id: str, agent_tasks: list):
+class _AgentLogStats(object):
+    """Download statistics for the logs of a single agent. Updated by multiple download workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.file_count = 0
+        self.byte_count = 0
+        self.written_count = 0
+        self._start = None
+        self._end = None
+
+    def add(self, start: float, end: float, byte_count: int, written_count: int) -> None:
+        with self._lock:
+            self.file_count += 1
+            self.byte_count += byte_count
+            self.written_count += written_count
+            self._start = start if self._start is None else min(self._start, start)
+            self._end = end if self._end is None else max(self._end, end)
+
+    def duration(self) -> float:
+        with self._lock:
+            return (self._end - self._start) if self._start is not None else 0
+
+
+class _AgentFile(object):
+    """A file to be fetched from an agent, up to its size when it was listed. If the offset is nonzero,
+    only the content past the offset is fetched and appended to the output path. If a byte limit is
+    set, only the head and tail of the content are fetched, up to the limit in total. Files with a
+    lower rank are fetched first."""
+
+    def __init__(self, agent_id: str, path: str, out_path: str, size: int, offset=0, rank=0):
+        self.agent_id = agent_id
+        self.path = path
+        self.out_path = out_path
+        self.size = size
+        self.offset = offset
+        self.rank = rank
+        self.byte_limit = None
+        self.fetched_bytes = 0
+        # Set once the file has been handled: 'complete', 'truncated', 'failed' or 'skipped (...)'
+        self.status = None
+
+
+def _list_task_log_files_for_agent(
+    artifacts, agent_id: str, agent_tasks: list, task_ranks: dict
+) -> list:
+    """Returns _AgentFiles for all of the log files to be fetched from the agent for the provided
+    tasks, along with the agent's own log. Which of them were fetched before is resolved when they're
+    downloaded, see _resolve_file_offsets(). Files are ranked by their task's rank, and the agent log
+    is ranked after all tasks."""
     agent_executor_paths = sdk_cmd.cluster_request(
         "GET", "/slave/{}/files/debug".format(agent_id)
     ).json()
-    task_byte_count = 0
+    executor_paths = _ExecutorPathIndex(agent_executor_paths)
+    files = []
     for task_entry in agent_tasks:
         try:
-            task_byte_count += _dump_task_logs_for_task(
-                item, agent_id, agent_executor_paths, task_entry
+            selected_file_infos = _select_task_log_files(
+                artifacts, agent_id, executor_paths, task_entry
             )
         except Exception:
             log.exception("Failed to get logs for task {}".format(task_entry))
-    log.info(
-        "Downloaded {} bytes of logs from {} tasks on agent {}".format(
-            task_byte_count, len(agent_tasks), agent_id
-        )
-    )
+            continue
+        for out_path, file_info in selected_file_infos.items():
+            files.append(
+                _AgentFile(
+                    agent_id,
+                    file_info["path"],
+                    out_path + sdk_utils.compression_suffix(_testlogs_compression),
+                    file_info["size"],
+                    rank=task_ranks[task_entry.task_id],
+                )
+            )
 
     # fetch agent log separately due to its totally different fetch semantics vs the task/executor logs
     if "/slave/log" in agent_executor_paths:
-        out_path = _setup_artifact_path(item, "agent_{}.log".format(agent_id))
-        stream = sdk_cmd.cluster_request(
-            "GET", "/slave/{}/files/download?path=/slave/log".format(agent_id), stream=True
+        try:
+            files.append(
+                _AgentFile(
+                    agent_id,
+                    "/slave/log",
+                    artifacts.path(
+                        "agent_{}.log{}".format(
+                            agent_id, sdk_utils.compression_suffix(_testlogs_compression)
+                        ),
+                    ),
+                    _get_agent_file_size(agent_id, "/slave/log"),
+                    rank=len(task_ranks),
+                )
+            )
+        except Exception:
+            log.exception("Failed to get the size of the log of agent {}".format(agent_id))
+    return files
+
+
+def _get_agent_file_size(agent_id: str, path: str) -> int:
+    """Returns the current size of a file which isn't listed by files/browse, such as the agent's own
+    log. A files/read call at offset -1 returns no content, only the size of the file."""
+    return sdk_cmd.cluster_request(
+        "GET", "/slave/{}/files/read".format(agent_id), params={"path": path, "offset": -1}
+    ).json()["offset"]
+
+
+def _resolve_file_offsets(files: list) -> list:
+    """Returns those of the provided _AgentFiles which weren't fully fetched before in this session.
+    Files which were fetched before, and have grown since, are appended to from their prior offset.
+
+    This is done right before the download, rather than when the files are listed, as the offsets
+    are recorded by the downloads of any prior collections, which may still have been running when
+    the files were listed."""
+    resolved = []
+    for agent_file in files:
+        with _testlogs_file_offsets_lock:
+            prior = _testlogs_file_offsets.get((agent_file.agent_id, agent_file.path))
+        if prior is None or not os.path.exists(prior[0]) or agent_file.size < prior[1]:
+            # Not fetched before, or the prior file is gone, or the file was since truncated:
+            resolved.append(agent_file)
+        elif agent_file.size > prior[1]:
+            agent_file.out_path, agent_file.offset = prior
+            resolved.append(agent_file)
+    return resolved
+
+
+def _download_agent_files(
+    agent_id: str, files: collections.deque, stats: _AgentLogStats, deadline: float
+) -> None:
+    """Fetches _AgentFiles from the agent until the provided queue is empty. Multiple workers may
+    share the same queue. Files which are still queued after the deadline are skipped."""
+    while True:
+        try:
+            agent_file = files.popleft()
+        except IndexError:
+            return
+        if time.time() >= deadline:
+            agent_file.status = "skipped (time budget)"
+            continue
+        start = time.time()
+        byte_count = 0
+        prior_size = _get_file_size(agent_file.out_path) if agent_file.offset else 0
+        try:
+            if agent_file.byte_limit is not None:
+                byte_count = _fetch_agent_file_head_and_tail(agent_id, agent_file)
+            elif agent_file.offset:
+                byte_count = _append_agent_file(agent_id, agent_file)
+            else:
+                stream = sdk_cmd.cluster_request(
+                    "GET",
+                    "/slave/{}/files/download?path={}".format(agent_id, agent_file.path),
+                    stream=True,
+                )
+                # The file may have grown since it was listed, e.g. the agent log.
+                byte_count = sdk_utils.write_response(
+                    stream, agent_file.out_path, _testlogs_compression, max_bytes=agent_file.size
+                )
+            if agent_file.byte_limit is None:
+                agent_file.status = "complete"
+                end_offset = agent_file.offset + byte_count
+            else:
+                # The omitted content is skipped for good, rather than being fetched later.
+                agent_file.status = "truncated"
+                end_offset = agent_file.size
+            with _testlogs_file_offsets_lock:
+                _testlogs_file_offsets[(agent_id, agent_file.path)] = (
+                    agent_file.out_path,
+                    end_offset,
+                )
+        except Exception:
+            log.exception("Failed to get file {} from agent {}".format(agent_file.path, agent_id))
+            agent_file.status = "failed"
+        agent_file.fetched_bytes = byte_count
+        stats.add(start, time.time(), byte_count, _get_file_size(agent_file.out_path) - prior_size)
+
+
+def _get_file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _append_agent_file(agent_id: str, agent_file: _AgentFile) -> int:
+    """Appends the content of the agent file past its offset, up to its listed size, to the output
+    path. Returns the number of bytes which were appended."""
+    with sdk_utils.open_compressed(agent_file.out_path, _testlogs_compression, "ab") as f:
+        byte_count = _read_agent_file(
+            agent_id, agent_file.path, agent_file.offset, agent_file.size, f
         )
-        with open(out_path, "wb") as f:
-            for chunk in stream.iter_content(chunk_size=8192):
-                f.write(chunk)
+    log.info(
+        "Appended {} new bytes of {} to {}".format(byte_count, agent_file.path, agent_file.out_path)
+    )
+    return byte_count
+
 
+def _fetch_agent_file_head_and_tail(agent_id: str, agent_file: _AgentFile) -> int:
+    """Writes the head and tail of the agent file's content past its offset, up to its byte limit in
+    total, with a marker line in place of the omitted content. Returns the number of bytes which
+    were fetched."""
+    head_end = agent_file.offset + agent_file.byte_limit // 2
+    tail_start = agent_file.size - (agent_file.byte_limit - agent_file.byte_limit // 2)
+    marker = "\n[... {} bytes omitted by log collection, see log_manifest.json ...]\n".format(
+        tail_start - head_end
+    )
+    mode = "ab" if agent_file.offset else "wb"
+    with sdk_utils.open_compressed(agent_file.out_path, _testlogs_compression, mode) as f:
+        byte_count = _read_agent_file(agent_id, agent_file.path, agent_file.offset, head_end, f)
+        f.write(marker.encode("utf-8"))
+        byte_count += _read_agent_file(agent_id, agent_file.path, tail_start, agent_file.size, f)
+    log.info(
+        "Fetched the head and tail of {} ({} of {} bytes) to {}".format(
+            agent_file.path, byte_count, agent_file.size - agent_file.offset, agent_file.out_path
+        )
+    )
+    return byte_count
 
-def _dump_task_logs_for_task(
-    item: pytest.Item, agent_id: str, agent_executor_paths: dict, task_entry: _TaskEntry
-) -> int:
-    executor_browse_path = _find_matching_executor_path(agent_executor_paths, task_entry)
+
+def _read_agent_file(agent_id: str, path: str, offset: int, end: int, f) -> int:
+    """Writes the content of the agent file between the offsets to the provided file, using as many
+    files/read calls as needed. Returns the number of bytes of the agent file which were read.
+
+    The agent returns the content as a JSON string, whose re-encoded length needn't match the number
+    of bytes it was read from (e.g. invalid UTF-8 is decoded to replacement characters). The offset
+    therefore advances by the requested length whenever a full response was returned, and only a
+    short response at the end of the file is measured by its own length."""
+    start = offset
+    while offset < end:
+        length = min(_testlogs_read_length, end - offset)
+        data = (
+            sdk_cmd.cluster_request(
+                "GET",
+                "/slave/{}/files/read".format(agent_id),
+                params={"path": path, "offset": offset, "length": length},
+            )
+            .json()["data"]
+            .encode("utf-8")
+        )
+        if not data:
+            break
+        f.write(data)
+        if len(data) < length:
+            # Short read: the file ended before the listed size, e.g. it was since truncated.
+            offset += len(data)
+            break
+        offset += length
+    return offset - start
+
+
+def _select_task_log_files(
+    artifacts, agent_id: str, executor_paths, task_entry: _TaskEntry
+) -> collections.OrderedDict:
+    """Returns the file infos of the task's log files, keyed by the output path to download them to.
+    The task's executor directory is looked up in the agent's _ExecutorPathIndex."""
+    selected_file_infos = collections.OrderedDict()
+    executor_browse_path = executor_paths.find(task_entry)
     if not executor_browse_path:
         # Expected executor path was not found on this agent. Did Mesos move their files around again?
         log.warning(
             "Unable to find any paths matching task {} in agent {}:\n  {}".format(
-                task_entry, agent_id, "\n  ".join(sorted(agent_executor_paths.keys()))
+                task_entry, agent_id, "\n  ".join(sorted(executor_paths.paths))
             )
         )
-        return 0
+        return selected_file_infos
 
     # Fetch paths under the executor.
     executor_file_infos = sdk_cmd.cluster_request(
@@ -401,25 +1228,28 @@ def _dump_task_logs_for_task(
                     log.exception("Failed to fetch task sandbox from presumed default executor")
 
     # Select all log files to be fetched from the above list.
-    selected_file_infos = collections.OrderedDict()
     if task_file_infos:
         # Include 'task' and 'executor' annotations in filenames to differentiate between them:
         _select_log_files(
-            item, task_entry.task_id, executor_file_infos, "executor.", selected_file_infos
+            artifacts, task_entry.task_id, executor_file_infos, "executor.", selected_file_infos
+        )
+        _select_log_files(
+            artifacts, task_entry.task_id, task_file_infos, "task.", selected_file_infos
         )
-        _select_log_files(item, task_entry.task_id, task_file_infos, "task.", selected_file_infos)
     else:
         # No annotation needed:
-        _select_log_files(item, task_entry.task_id, executor_file_infos, "", selected_file_infos)
+        _select_log_files(
+            artifacts, task_entry.task_id, executor_file_infos, "", selected_file_infos
+        )
     if not selected_file_infos:
         log.warning(
             "Unable to find any stdout/stderr files in above paths for task {}".format(task_entry)
         )
-        return 0
+        return selected_file_infos
 
     byte_count = sum([f["size"] for f in selected_file_infos.values()])
     log.info(
-        "Downloading {} files ({} bytes) for task {}:{}".format(
+        "Found {} log files ({} bytes) for task {}:{}".format(
             len(selected_file_infos),
             byte_count,
             task_entry,
@@ -433,25 +1263,18 @@ def _dump_task_logs_for_task(
             ),
         )
     )
-
-    # Fetch files
-    for out_path, file_info in selected_file_infos.items():
-        try:
-            stream = sdk_cmd.cluster_request(
-                "GET",
-                "/slave/{}/files/download?path={}".format(agent_id, file_info["path"]),
-                stream=True,
-            )
-            with open(out_path, "wb") as f:
-                for chunk in stream.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        except Exception:
-            log.exception("Failed to get file for task {}: {}".format(task_entry, file_info))
-    return byte_count
+    return selected_file_infos
 
 
 def _find_matching_executor_path(agent_executor_paths: dict, task_entry: _TaskEntry) -> str:
-    """Finds and returns the executor directory for the provided task on the agent.
+    """Finds and returns the executor directory for the provided task on the agent. When looking up
+    multiple tasks on the same agent, use an _ExecutorPathIndex instead."""
+    return _ExecutorPathIndex(agent_executor_paths).find(task_entry)
+
+
+class _ExecutorPathIndex(object):
+    """An index of the executor directories which are listed in an agent's files/debug response, for
+    looking up the executor directory of each task on the agent.
 
     Mesos has changed its schema for executor directories with each DC/OS release:
     - 1.9: There are only '/var/lib/mesos/...' paths. There are no '/runs/latest' paths, only '/runs/<UUID>'.
@@ -468,48 +1291,74 @@ def _find_matching_executor_path(agent_executor_paths: dict, task_entry: _TaskEn
                        file(s) at the advertised directory.
     - Default executor: 'executor id' + 'task id' are both used. Executor logs are at the advertised directory,
                         while task logs are under 'tasks/<task_id>/' relative to the advertised directory.
-    """
 
-    # When executor_id is empty (as in Marathon/Metronome tasks), we use the task_id:
-    path_id = task_entry.executor_id if task_entry.executor_id else task_entry.task_id
+    Each path is parsed once into its framework id, executor id and run (container) id. For each
+    executor id, the index keeps the path of the most preferred schema, in the order listed below.
+    Lookups are then a single dict access, rather than a scan over all of the agent's paths.
+    """
 
     # - 1.11: '/frameworks/.../executors/<executor_id>/runs/latest'
     # Metronome: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0000/executors/test_cassandra_delete-data-retry_20180125024336zu3iM.8a893b4a-0179-11e8-ba9e-ee0228673934/runs/latest
     # Marathon: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0001/executors/test_integration_cassandra.57705baf-0176-11e8-94e4-ee0228673934/runs/latest
     # Default Executor: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0002/executors/node__bfa9751b-b7c4-45ae-b6d3-efdb9f851ca7/runs/latest
     #                   (executor logs here. tasks are then under .../tasks/<task_id>/)
-    frameworks_latest_pattern = re.compile(
-        "^/frameworks/.*/executors/{}/runs/latest$".format(path_id)
-    )
-    for browse_path in agent_executor_paths.keys():
-        if frameworks_latest_pattern.match(browse_path):
-            return browse_path
+    FRAMEWORKS_LATEST = 0
     # - 1.10: '/var/lib/mesos/.../executors/<executor_id>/runs/latest'
     # Marathon: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0001/executors/hello-world.a80b075e-02d3-11e8-aceb-e2e215e145ce/runs/latest
     # Default Executor: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0002/executors/hello__090b3ef4-27c3-44c7-a39a-bad65620b982/runs/latest
     #                   (executor logs here. tasks are then under .../tasks/<task_id>/)
-    varlib_latest_pattern = re.compile(
-        "^/var/lib/mesos/.*/executors/{}/runs/latest$".format(path_id)
-    )
-    for browse_path in agent_executor_paths.keys():
-        if varlib_latest_pattern.match(browse_path):
-            return browse_path
+    VARLIB_LATEST = 1
     # - 1.9: '/var/lib/mesos/.../executors/<executor_id>/runs/<some_uuid>'
     # Marathon: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0000/executors/hello-world.bb47e080-02c6-11e8-88f6-760584c8e399/runs/f8de4bc4-620b-4687-a032-3e34c378708f
     # Custom Executor: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0002/executors/hello__22a1ee97-23cf-407f-a1d1-7d6a0e325774/runs/5b6831b0-a9b1-482e-8595-8f800c32bdf6
     #                  (tasks share stdout/stderr with the executor)
-    varlib_uuid_pattern = re.compile(
-        "^/var/lib/mesos/.*/executors/{}/runs/[a-f0-9-]+$".format(path_id)
+    VARLIB_UUID = 2
+
+    _PATH_PATTERN = re.compile(
+        r"^(?P<root>/frameworks/|/var/lib/mesos/)(?:.*/)?(?P<framework_id>[^/]+)"
+        r"/executors/(?P<executor_id>[^/]+)/runs/(?P<container_id>[^/]+)$"
     )
-    for browse_path in agent_executor_paths.keys():
-        if varlib_uuid_pattern.match(browse_path):
-            return browse_path
+    _UUID_PATTERN = re.compile(r"^[a-f0-9-]+$")
+
+    def __init__(self, agent_executor_paths: dict) -> None:
+        self.paths = agent_executor_paths.keys()
+        # executor id => (schema, path, framework id, container id)
+        self._executors = {}
+        for browse_path in agent_executor_paths.keys():
+            match = self._PATH_PATTERN.match(browse_path)
+            if not match:
+                continue
+            if match.group("container_id") == "latest":
+                if match.group("root") == "/frameworks/":
+                    schema = self.FRAMEWORKS_LATEST
+                else:
+                    schema = self.VARLIB_LATEST
+            elif match.group("root") != "/frameworks/" and self._UUID_PATTERN.match(
+                match.group("container_id")
+            ):
+                schema = self.VARLIB_UUID
+            else:
+                continue
+            executor_id = match.group("executor_id")
+            prior = self._executors.get(executor_id)
+            if prior is None or schema < prior[0]:
+                self._executors[executor_id] = (
+                    schema,
+                    browse_path,
+                    match.group("framework_id"),
+                    match.group("container_id"),
+                )
 
-    return ""
+    def find(self, task_entry: _TaskEntry) -> str:
+        """Returns the executor directory for the provided task, or an empty string if none exists."""
+        # When executor_id is empty (as in Marathon/Metronome tasks), we use the task_id:
+        path_id = task_entry.executor_id if task_entry.executor_id else task_entry.task_id
+        entry = self._executors.get(path_id)
+        return entry[1] if entry else ""
 
 
 def _select_log_files(
-    item: pytest.Item,
+    artifacts,
     task_id: str,
     file_infos: list,
     source: str,
@@ -533,12 +1382,36 @@ def _select_log_files(
             source,
             os.path.basename(file_info["path"]),
         )
-        selected[_setup_artifact_path(item, out_filename)] = file_info
+        selected[artifacts.path(out_filename)] = file_info
 
 
 def _setup_artifact_path(item: pytest.Item, artifact_name: str):
     """Given the pytest item and an artifact_name,
     Returns the path to write an artifact with that name."""
+    return _TestArtifacts(item).path(artifact_name)
+
+
+class _TestArtifacts(object):
+    """The artifact directory of a test. The directory is determined when this is created, such that
+    collection which runs after later tests have started still writes to the directory of the test
+    which failed."""
+
+    def __init__(self, item: pytest.Item):
+        self.name = "{}::{}".format(get_test_suite_name(item), item.name)
+        self.directory = _test_artifact_directory(item)
+        # Set once the creation of a diagnostics bundle was started for the test. The name is None
+        # with older versions of the bundle API, see _start_diagnostics_bundle().
+        self.diagnostics_bundle_started = False
+        self.diagnostics_bundle_name = None
+
+    def path(self, artifact_name: str) -> str:
+        """Returns the path to write an artifact with the provided name."""
+        # may be called concurrently by log download workers:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, artifact_name)
+
+
+def _test_artifact_directory(item: pytest.Item) -> str:
 
     # full item.listchain() is e.g.:
     # - ['build', 'frameworks/template/tests/test_sanity.py', 'test_install']
@@ -551,11 +1424,7 @@ def _setup_artifact_path(item: pytest.Item, artifact_name: str):
         # test_index is not defined: fall back to just "test_placement_rules"
         test_name = item.name
 
-    output_dir = os.path.join(_test_suite_artifact_directory(item), test_name)
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
-
-    return os.path.join(output_dir, artifact_name)
+    return os.path.join(_test_suite_artifact_directory(item), test_name)
 
 
 def _test_suite_artifact_directory(item: pytest.Item):
@@ -0,0 +1,562 @@
+"""Utilities relating to following cluster event streams, so that waits may complete as soon as a
+relevant change is reported instead of on their next poll.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_events IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import abc
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import sdk_cmd
+
+log = logging.getLogger(__name__)
+
+# Event streams may be turned off, e.g. when running against a cluster which doesn't support them.
+# Waits then fall back to plain polling.
+EVENT_STREAMS_ENABLED = os.environ.get("INTEGRATION_TEST__EVENT_STREAMS", "true").lower() in (
+    "true",
+    "1",
+)
+
+# While a stream is connected, waiters still re-check their condition at this interval as a safety
+# net against missed events.
+CONNECTED_POLL_INTERVAL_SECONDS = 10
+
+# The stream is considered dead if nothing (not even a heartbeat) is received within this duration.
+STREAM_READ_TIMEOUT_SECONDS = 60
+
+# Backoff between reconnection attempts, and the number of consecutive failed attempts after which
+# the subscriber goes idle. Waits keep working via polling either way, and an idle subscriber makes
+# a new attempt (at most once per _RECONNECT_MAX_SECONDS) when a wait next calls mark().
+_RECONNECT_MIN_SECONDS = 1
+_RECONNECT_MAX_SECONDS = 30
+_MAX_FAILED_CONNECTS = 5
+
+
+class _EventSubscriber(threading.Thread, abc.ABC):
+    """Base class for a background thread which follows an HTTP event stream.
+
+    Subclasses implement _open_stream() and _handle_stream(). Any state derived from the stream must
+    be updated while holding self._cond, followed by a call to _notify().
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name=name, daemon=True)
+        self._cond = threading.Condition()
+        # Incremented on every change. Waiters compare against the value they last observed.
+        self._generation = 0
+        # The last generation which affected a given key (e.g. a framework name), allowing waiters
+        # to ignore unrelated changes.
+        self.key_generations = {}
+        # The last generation in which the connection state changed. Waiters are always woken by this.
+        self._connection_generation = 0
+        self._connected = False
+        self._stopped = False
+        self._response = None
+        # Set while the subscriber is waiting for resume() after repeated connection failures.
+        self._idle_since = None
+        self._listeners = []
+
+    def is_connected(self) -> bool:
+        with self._cond:
+            return self._connected
+
+    def connected_since(self, generation: int) -> bool:
+        """Returns whether the stream has been connected without interruption since `generation`
+        was observed, i.e. whether every event since then has been received."""
+        with self._cond:
+            return self._connected and self._connection_generation <= generation
+
+    def generation(self, key=None) -> int:
+        """Returns a value which changes whenever an event affecting `key` (or any event, if `key`
+        is None) is received, or whenever the stream connects or disconnects."""
+        with self._cond:
+            return self._generation_locked(key)
+
+    def wait_for_change(self, generation: int, timeout_seconds: float, key=None) -> bool:
+        """Blocks until generation(key) no longer matches `generation`, or until the timeout
+        expires. Returns whether a change was observed."""
+        deadline = time.time() + timeout_seconds
+        with self._cond:
+            while self._generation_locked(key) == generation and not self._stopped:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return self._generation_locked(key) != generation
+
+    def add_listener(self, callback) -> None:
+        """Registers a callback which is invoked with the keys affected by every change, or with None
+        when the stream connects or disconnects. Callbacks are invoked while holding the subscriber's
+        lock, so they must return quickly and must not call back into the subscriber."""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def resume(self) -> None:
+        """Wakes a subscriber which went idle after repeated connection failures, so that it makes
+        another connection attempt. Does nothing if the subscriber went idle only recently."""
+        with self._cond:
+            if self._idle_since is None:
+                return
+            if time.time() - self._idle_since < _RECONNECT_MAX_SECONDS:
+                return
+            self._idle_since = None
+            self._cond.notify_all()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def run(self) -> None:
+        delay = _RECONNECT_MIN_SECONDS
+        failures = 0
+        while not self._stopped:
+            try:
+                self._response = self._open_stream()
+                self._handle_stream(self._response)
+                log.info("%s event stream ended", self.name)
+            except Exception as e:
+                if not self._stopped:
+                    log.info("%s event stream failed: %s", self.name, e)
+            finally:
+                if self.is_connected():
+                    # We had a working stream: Start over with a short delay.
+                    delay = _RECONNECT_MIN_SECONDS
+                    failures = 0
+                else:
+                    failures += 1
+                self._set_connected(False)
+                self._response = None
+
+            if failures >= _MAX_FAILED_CONNECTS:
+                log.warning(
+                    "Pausing %s event stream after %d failed attempts, waits will poll instead",
+                    self.name,
+                    failures,
+                )
+                self._wait_for_resume()
+                # Make a single attempt when resumed, going idle again if it fails.
+                failures = _MAX_FAILED_CONNECTS - 1
+                delay = _RECONNECT_MIN_SECONDS
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, _RECONNECT_MAX_SECONDS)
+
+    @abc.abstractmethod
+    def _open_stream(self):
+        """Returns a streaming response for the event stream."""
+
+    @abc.abstractmethod
+    def _handle_stream(self, response) -> None:
+        """Consumes events from the response until the stream ends or the subscriber is stopped."""
+
+    def _wait_for_resume(self) -> None:
+        with self._cond:
+            self._idle_since = time.time()
+            while self._idle_since is not None and not self._stopped:
+                self._cond.wait()
+
+    def _set_connected(self, connected: bool) -> None:
+        with self._cond:
+            if self._connected == connected:
+                return
+            self._connected = connected
+            self._generation += 1
+            self._connection_generation = self._generation
+            self._cond.notify_all()
+            for listener in self._listeners:
+                listener(None)
+        log.info("%s event stream %s", self.name, "connected" if connected else "disconnected")
+
+    def _notify(self, keys=()) -> None:
+        """Records a change affecting the provided keys and wakes any waiters. Must be called while
+        holding self._cond."""
+        self._generation += 1
+        for key in keys:
+            self.key_generations[key] = self._generation
+        self._cond.notify_all()
+        for listener in self._listeners:
+            listener(keys)
+
+    def _generation_locked(self, key) -> int:
+        if key is None:
+            return self._generation
+        return max(self.key_generations.get(key, 0), self._connection_generation)
+
+
+def _iter_recordio(chunks):
+    """Splits a RecordIO byte stream ("<length>\\n<json record>...") into decoded JSON records."""
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            newline = buf.find(b"\n")
+            if newline < 0:
+                break
+            length = int(buf[:newline])
+            if len(buf) < newline + 1 + length:
+                break
+            record = buf[newline + 1 : newline + 1 + length]
+            buf = buf[newline + 1 + length :]
+            yield json.loads(record.decode("utf-8"))
+
+
+class MesosEventSubscriber(_EventSubscriber):
+    """Follows the Mesos master's operator API SUBSCRIBE stream, keeping an in-memory table of all
+    tasks and frameworks known to the master.
+
+    Waits may be keyed by framework name, in which case they're only woken by events for tasks of
+    that framework.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("mesos-master")
+        # task id => task entry, in the same form as the entries returned by /mesos/tasks
+        self._tasks = {}
+        # framework id => {'id', 'name', 'active'}
+        self._frameworks = {}
+
+    def get_tasks(self) -> list:
+        """Returns all known task entries, including completed tasks."""
+        with self._cond:
+            return [dict(t) for t in self._tasks.values()]
+
+    def get_frameworks(self) -> list:
+        """Returns all known frameworks, including inactive ones."""
+        with self._cond:
+            return [dict(f) for f in self._frameworks.values()]
+
+    def _open_stream(self):
+        return sdk_cmd.cluster_request(
+            "POST",
+            "/mesos/api/v1",
+            retry=False,
+            json={"type": "SUBSCRIBE"},
+            headers={"Accept": "application/json"},
+            stream=True,
+            timeout_seconds=STREAM_READ_TIMEOUT_SECONDS,
+        )
+
+    def _handle_stream(self, response) -> None:
+        for event in _iter_recordio(response.iter_content(chunk_size=None)):
+            if self._stopped:
+                return
+            event_type = event.get("type")
+            if event_type == "SUBSCRIBED":
+                self._handle_subscribed(event["subscribed"])
+            elif event_type == "TASK_ADDED":
+                self._handle_task(event["task_added"]["task"])
+            elif event_type == "TASK_UPDATED":
+                self._handle_task_updated(event["task_updated"])
+            elif event_type in ("FRAMEWORK_ADDED", "FRAMEWORK_UPDATED"):
+                key = event_type.lower()
+                self._handle_framework(event[key]["framework"])
+            elif event_type == "FRAMEWORK_REMOVED":
+                self._handle_framework_removed(event["framework_removed"]["framework_info"])
+
+    def _handle_subscribed(self, subscribed: dict) -> None:
+        # Full resync: Replace any state left over from a prior connection.
+        state = subscribed.get("get_state", {})
+        tasks = state.get("get_tasks", {})
+        frameworks = state.get("get_frameworks", {})
+        with self._cond:
+            self._frameworks = {}
+            for framework in frameworks.get("frameworks", []):
+                entry = _to_framework_entry(framework)
+                self._frameworks[entry["id"]] = entry
+            self._tasks = {}
+            for field in ("completed_tasks", "tasks"):
+                for task in tasks.get(field, []):
+                    entry = _to_task_entry(task)
+                    self._tasks[entry["id"]] = entry
+            self._notify([f["name"] for f in self._frameworks.values()])
+        log.info(
+            "Subscribed to Mesos master events: %d frameworks, %d tasks",
+            len(self._frameworks),
+            len(self._tasks),
+        )
+        self._set_connected(True)
+
+    def _handle_task(self, task: dict) -> None:
+        entry = _to_task_entry(task)
+        with self._cond:
+            self._tasks[entry["id"]] = entry
+            self._notify(self._framework_names_locked(entry["framework_id"]))
+
+    def _handle_task_updated(self, task_updated: dict) -> None:
+        framework_id = task_updated["framework_id"]["value"]
+        status = task_updated["status"]
+        task_id = status["task_id"]["value"]
+        with self._cond:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                # Shouldn't happen (TASK_ADDED comes first), but avoid losing the update.
+                entry = {
+                    "id": task_id,
+                    "name": "",
+                    "framework_id": framework_id,
+                    "executor_id": "",
+                    "slave_id": status.get("agent_id", {}).get("value", ""),
+                    "resources": {},
+                }
+                self._tasks[task_id] = entry
+            entry["state"] = task_updated["state"]
+            self._notify(self._framework_names_locked(framework_id))
+
+    def _handle_framework(self, framework: dict) -> None:
+        entry = _to_framework_entry(framework)
+        with self._cond:
+            self._frameworks[entry["id"]] = entry
+            self._notify([entry["name"]])
+
+    def _handle_framework_removed(self, framework_info: dict) -> None:
+        framework_id = framework_info["id"]["value"]
+        with self._cond:
+            removed = self._frameworks.pop(framework_id, None)
+            self._notify([removed["name"]] if removed else [])
+
+    def _framework_names_locked(self, framework_id: str) -> list:
+        framework = self._frameworks.get(framework_id)
+        return [framework["name"]] if framework else []
+
+
+def _to_framework_entry(framework: dict) -> dict:
+    info = framework["framework_info"]
+    return {
+        "id": info["id"]["value"],
+        "name": info["name"],
+        "active": framework.get("active", False),
+    }
+
+
+def _to_task_entry(task: dict) -> dict:
+    """Converts a v1 operator API task to the flat form returned by /mesos/tasks and /mesos/frameworks."""
+    resources = {}
+    for resource in task.get("resources", []):
+        if resource.get("type") == "SCALAR":
+            resources[resource["name"]] = (
+                resources.get(resource["name"], 0) + resource["scalar"]["value"]
+            )
+    return {
+        "id": task["task_id"]["value"],
+        "name": task["name"],
+        "state": task.get("state", "TASK_STAGING"),
+        "framework_id": task["framework_id"]["value"],
+        "executor_id": task.get("executor_id", {}).get("value", ""),
+        "slave_id": task["agent_id"]["value"],
+        "resources": resources,
+    }
+
+
+def _iter_sse(lines):
+    """Splits a server-sent events stream into (event type, data) tuples."""
+    event_type = None
+    data = []
+    for line in lines:
+        if not line:
+            # Blank line: Dispatch the event collected so far, if any.
+            if data:
+                yield event_type or "message", "\n".join(data)
+            event_type = None
+            data = []
+        elif line.startswith(":"):
+            continue  # comment/keepalive
+        elif line.startswith("event:"):
+            event_type = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:") :].lstrip())
+
+
+def _marathon_app_id(app_id: str) -> str:
+    """Normalizes Marathon app ids, which may be provided with or without a leading slash."""
+    return "/" + app_id.lstrip("/")
+
+
+class MarathonEventSubscriber(_EventSubscriber):
+    """Follows Marathon's /v2/events SSE stream, tracking the outcome of deployments.
+
+    Waits may be keyed by app id, in which case they're only woken by status
+    updates, health changes, app changes and deployments involving that app.
+    """
+
+    # The number of finished deployments to remember.
+    _MAX_FINISHED_DEPLOYMENTS = 1000
+
+    def __init__(self) -> None:
+        super().__init__("marathon")
+        # deployment id => 'deployment_success' or 'deployment_failed', in completion order
+        self._finished_deployments = collections.OrderedDict()
+
+    def get_deployment_result(self, deployment_id: str):
+        """Returns 'deployment_success' or 'deployment_failed' if the deployment has finished since
+        the stream was connected, or None otherwise."""
+        with self._cond:
+            return self._finished_deployments.get(deployment_id)
+
+    def _open_stream(self):
+        return sdk_cmd.cluster_request(
+            "GET",
+            "/marathon/v2/events",
+            retry=False,
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout_seconds=STREAM_READ_TIMEOUT_SECONDS,
+        )
+
+    def _handle_stream(self, response) -> None:
+        # Marathon only sends events which happen after the stream is attached. Any waiter which
+        # was relying on polling is woken by the connection and re-polls to resync.
+        self._set_connected(True)
+        lines = response.iter_lines(chunk_size=None, decode_unicode=True)
+        for event_type, data in _iter_sse(lines):
+            if self._stopped:
+                return
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if event_type in ("deployment_success", "deployment_failed"):
+                self._handle_deployment_finished(event_type, event)
+            elif event_type in (
+                "status_update_event",
+                "health_status_changed_event",
+                "instance_health_changed_event",
+                "app_terminated_event",
+            ):
+                self._handle_app_event(event.get("appId"))
+            elif event_type == "api_post_event":
+                self._handle_app_event(event.get("appDefinition", {}).get("id"))
+            elif event_type == "deployment_info":
+                self._handle_app_event(*_deployment_app_ids(event.get("plan", {})))
+
+    def _handle_deployment_finished(self, event_type: str, event: dict) -> None:
+        deployment_id = event.get("id") or event.get("plan", {}).get("id")
+        with self._cond:
+            self._finished_deployments[deployment_id] = event_type
+            while len(self._finished_deployments) > self._MAX_FINISHED_DEPLOYMENTS:
+                self._finished_deployments.popitem(last=False)
+            self._notify(_deployment_app_ids(event.get("plan", {})))
+
+    def _handle_app_event(self, *app_ids) -> None:
+        with self._cond:
+            self._notify([_marathon_app_id(a) for a in app_ids if a])
+
+
+def _deployment_app_ids(plan: dict) -> list:
+    """Returns the (normalized) ids of all apps affected by a Marathon deployment plan."""
+    app_ids = set()
+    for step in plan.get("steps", []):
+        for action in step.get("actions", []):
+            if action.get("app"):
+                app_ids.add(_marathon_app_id(action["app"]))
+    return list(app_ids)
+
+
+class EventWait(object):
+    """A `wait_func` for retrying loops which wakes as soon as a subscriber reports a relevant
+    change, falling back to a regular polling interval whenever the stream isn't connected.
+
+    Call mark() at the start of every check, before reading any state, so that changes which arrive
+    while the check is running aren't missed:
+
+        wait = sdk_events.mesos_wait(key=service_name)
+
+        @retrying.retry(wait_func=wait, ...)
+        def fn():
+            wait.mark()
+            if wait.connected(): ... use wait.subscriber ...
+            else: ... poll ...
+    """
+
+    def __init__(self, subscriber, fallback, key=None) -> None:
+        """
+        : param subscriber: The subscriber to follow, or None if event streams are disabled.
+        : param fallback: Polling interval in milliseconds, or a `wait_func` to delegate to, for
+                          when the subscriber isn't connected.
+        : param key: Only wake on events affecting this key, e.g. a framework name.
+        """
+        self.subscriber = subscriber
+        self.key = key
+        self._fallback = fallback
+        self._generation = None
+        self._start_generation = subscriber.generation() if subscriber is not None else None
+
+    def connected(self) -> bool:
+        return self.subscriber is not None and self.subscriber.is_connected()
+
+    def reliable(self) -> bool:
+        """Returns whether the subscriber has been connected since this wait was created, i.e.
+        whether any events triggered by actions taken after that point will have been received."""
+        return self.subscriber is not None and self.subscriber.connected_since(
+            self._start_generation
+        )
+
+    def mark(self) -> None:
+        if self.subscriber is not None:
+            self.subscriber.resume()
+            self._generation = self.subscriber.generation(self.key)
+
+    def __call__(self, attempt_number: int, delay_since_first_attempt_ms: int) -> int:
+        if self._generation is not None and self.connected():
+            self.subscriber.wait_for_change(
+                self._generation, CONNECTED_POLL_INTERVAL_SECONDS, key=self.key
+            )
+            return 0
+        if callable(self._fallback):
+            return self._fallback(attempt_number, delay_since_first_attempt_ms)
+        return self._fallback
+
+
+_subscribers_lock = threading.Lock()
+_mesos_subscriber = None
+_marathon_subscriber = None
+
+
+def get_mesos_subscriber():
+    """Returns the shared Mesos master subscriber, starting it on first use.
+    Returns None if event streams are disabled."""
+    if not EVENT_STREAMS_ENABLED:
+        return None
+    global _mesos_subscriber
+    with _subscribers_lock:
+        if _mesos_subscriber is None:
+            _mesos_subscriber = MesosEventSubscriber()
+            _mesos_subscriber.start()
+        return _mesos_subscriber
+
+
+def mesos_wait(fallback=1000, key=None) -> EventWait:
+    """Returns a wait_func which is woken by Mesos task and framework events. See EventWait."""
+    return EventWait(get_mesos_subscriber(), fallback, key)
+
+
+def get_marathon_subscriber():
+    """Returns the shared Marathon subscriber, starting it on first use.
+    Returns None if event streams are disabled."""
+    if not EVENT_STREAMS_ENABLED:
+        return None
+    global _marathon_subscriber
+    with _subscribers_lock:
+        if _marathon_subscriber is None:
+            _marathon_subscriber = MarathonEventSubscriber()
+            _marathon_subscriber.start()
+        return _marathon_subscriber
+
+
+def marathon_wait(fallback=2000, app_id=None) -> EventWait:
+    """Returns a wait_func which is woken by Marathon events for the specified app, or for any app
+    if `app_id` is None. See EventWait."""
+    return EventWait(
+        get_marathon_subscriber(), fallback, _marathon_app_id(app_id) if app_id else None
+    )
@@ -5,8 +5,14 @@ FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
 SHOULD ALSO BE APPLIED TO sdk_install IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
+import collections
+import contextlib
+import functools
+import hashlib
 import json
 import logging
+import os
+import threading
 import time
 import retrying
 import tempfile
@@ -17,25 +23,57 @@ import sdk_marathon
 import sdk_plan
 import sdk_tasks
 import sdk_utils
+import sdk_waiter
 
 log = logging.getLogger(__name__)
 
 TIMEOUT_SECONDS = 15 * 60
 
+# Whether services may be left installed across test modules, to be reused by later install() calls
+# with identical parameters. When enabled, uninstall() of a reusable service from a fixture is
+# deferred to the end of the session, see uninstall_reused_services().
+SERVICE_REUSE_ENABLED = os.environ.get("INTEGRATION_TEST__REUSE_SERVICES", "false").lower() in (
+    "true",
+    "1",
+)
+
 """List of services which are currently installed via install().
 Used by post - test diagnostics to retrieve stuff from currently running services."""
 _installed_service_names = set([])
 
+"""Timings of the installs in this session, see get_install_timings()."""
+_install_timings = []
+
 """List of dead agents which should be ignored when checking for orphaned resources.
 Used by uninstall when validating that an uninstall completed successfully."""
 _dead_agent_hosts = set([])
 
+"""Serializes package install commands. The CLI installs package subcommands into a shared directory,
+which isn't safe to do concurrently when several services are installed by install_many()."""
+_install_cmd_lock = threading.Lock()
+
+
+"""Services which were installed while service reuse was enabled, keyed by service name. Each entry
+has the package name, a fingerprint of the install parameters, and the Marathon app version as of the
+end of the install."""
+_reusable_services = {}
+
+"""Whether a test function is currently running, as opposed to its fixtures.
+See running_test_body()."""
+_in_test_body = False
+
 
 def get_installed_service_names() -> set:
     """Returns the a set of service names which had been installed via sdk_install in this session."""
     return _installed_service_names
 
 
+def get_install_timings() -> list:
+    """Returns the timings of each install() in this session, including how long the install command
+    took, and how many seconds after it each readiness condition was first met."""
+    return list(_install_timings)
+
+
 class PackageVersion(Enum):
     STUB_UNIVERSE = "stub-universe"
     LATEST_UNIVERSE = ""
@@ -43,13 +81,7 @@ class PackageVersion(Enum):
 
 @retrying.retry(stop_max_attempt_number=3, retry_on_exception=lambda e: isinstance(e, Exception))
 def _retried_install_impl(
-    package_name: str,
-    service_name: str,
-    expected_running_tasks: int,
-    package_version: str,
-    options: dict,
-    timeout_seconds: int,
-    wait_for_all_conditions: bool,
+    package_name: str, service_name: str, package_version: str, options: dict
 ) -> None:
     log.info(
         "Installing package={} service={} with options={} version={}".format(
@@ -78,15 +110,95 @@ def _retried_install_impl(
         options_file.flush()  # ensure content is available for the CLI to read below
         install_cmd.append("--options={}".format(options_file.name))
 
-    sdk_cmd.run_cli(" ".join(install_cmd), check=True)
+    with _install_cmd_lock:
+        sdk_cmd.run_cli(" ".join(install_cmd), check=True)
+
+
+def _wait_for_readiness(
+    service_name: str,
+    expected_running_tasks: int,
+    wait_for_app: bool,
+    wait_for_plan: bool,
+    timeout_seconds: int,
+) -> dict:
+    """Waits for all of the following readiness conditions to be met at the same time, checking all
+    of them against a single fetch of each underlying source per tick:
+    - tasks: At least the expected number of tasks are running (skipped if 0 are expected)
+    - app: The Marathon deployment of the scheduler has completed (if wait_for_app)
+    - plan: The deploy plan has completed (if wait_for_plan)
+
+    Returns the number of seconds after which each condition was first met, keyed by condition.
+    """
+    conditions = collections.OrderedDict()
+    if expected_running_tasks > 0:
+        conditions["tasks"] = (
+            sdk_waiter.tasks_source(),
+            lambda frameworks: len(sdk_waiter.running_task_names(frameworks, service_name))
+            >= expected_running_tasks,
+        )
+    if wait_for_app:
+        conditions["app"] = (
+            sdk_waiter.app_source(service_name),
+            lambda app: app is not None and sdk_marathon.get_deployment_status(app)[0],
+        )
+    if wait_for_plan:
+        progress = sdk_plan.PlanProgressLogger(
+            service_name, "deploy", None, "Waiting for COMPLETE deploy plan"
+        )
+        # The scheduler's API is unavailable until it has started:
+        conditions["plan"] = (
+            sdk_waiter.optional_source(sdk_waiter.plan_source(service_name, "deploy")),
+            lambda plan: plan is not None and progress.record(plan).status == "COMPLETE",
+        )
+    if not conditions:
+        return {}
+
+    start = time.time()
+    met = collections.OrderedDict()
+    failures = (
+        sdk_tasks.watch_failed_tasks(service_name, sdk_plan.MAX_NEW_TASK_FAILURES)
+        if wait_for_plan
+        else None
+    )
 
-    # Wait for expected tasks to come up
-    if expected_running_tasks > 0 and wait_for_all_conditions:
-        sdk_tasks.check_running(service_name, expected_running_tasks, timeout_seconds)
+    def predicate(*data):
+        if failures is not None and failures.exceeded():
+            raise sdk_plan.TaskFailuresExceededException(
+                "Service not recoverable: {} ({} task failures during install)".format(
+                    service_name, failures.new_failures()
+                )
+            )
+        ready = True
+        for (name, (_, check)), value in zip(conditions.items(), data):
+            if not check(value):
+                ready = False
+            elif name not in met:
+                met[name] = time.time() - start
+                log.info(
+                    "{} readiness: {} condition met after {}".format(
+                        service_name, name, sdk_utils.pretty_duration(met[name])
+                    )
+                )
+        return ready
 
-    # Wait for completed marathon deployment
-    if wait_for_all_conditions:
-        sdk_marathon.wait_for_deployment(service_name, timeout_seconds, None)
+    try:
+        sdk_waiter.wait_for(
+            "{} to be ready ({})".format(service_name, ", ".join(conditions.keys())),
+            [source for source, _ in conditions.values()],
+            predicate,
+            timeout_seconds,
+        )
+    except Exception:
+        log.error(
+            "{} readiness failed, conditions met: {}, unmet: {}".format(
+                service_name, dict(met), [name for name in conditions if name not in met]
+            )
+        )
+        raise
+    finally:
+        if failures is not None:
+            failures.close()
+    return met
 
 
 def install(
@@ -102,10 +214,6 @@ def install(
 ) -> None:
     start = time.time()
 
-    # If the package is already installed at this point, fail immediately.
-    if sdk_marathon.app_exists(service_name):
-        raise Exception("Service is already installed: {}".format(service_name))
-
     if insert_strict_options and sdk_utils.is_strict_mode():
         # strict mode requires correct principal and secret to perform install.
         # see also: sdk_security.py
@@ -131,40 +239,143 @@ def install(
         },
         options,
     )
+    package_version = (
+        package_version.value if isinstance(package_version, PackageVersion) else package_version
+    )
+
+    if SERVICE_REUSE_ENABLED:
+        fingerprint = _get_install_fingerprint(package_name, package_version, service_name, options)
+        if _reuse_installed_service(service_name, fingerprint, expected_running_tasks):
+            _installed_service_names.add(service_name)
+            return
+
+    # If the package is already installed at this point, fail immediately.
+    if sdk_marathon.app_exists(service_name):
+        raise Exception("Service is already installed: {}".format(service_name))
 
-    # 1. Install package, wait for tasks, wait for marathon deployment
-    _retried_install_impl(
-        package_name,
+    # 1. Install package
+    _retried_install_impl(package_name, service_name, package_version, options)
+    install_cmd_seconds = time.time() - start
+
+    # 2. Wait for tasks and marathon deployment, along with the scheduler to be idle (as implied by
+    # deploy plan completion and suppressed bit). The deploy plan check should be skipped ONLY when
+    # it's known that the scheduler will be stuck in an incomplete state, or if the thing being
+    # installed doesn't have a deployment plan (e.g. standalone app)
+    # This can take a while, default is 15 minutes. for example with HDFS, we can hit the expected
+    # total task count via FINISHED tasks, without actually completing deployment
+    log.info("Waiting for package={} service={} to be ready...".format(package_name, service_name))
+    readiness_seconds = _wait_for_readiness(
         service_name,
-        expected_running_tasks,
-        package_version.value if isinstance(package_version, PackageVersion) else package_version,
-        options,
+        expected_running_tasks if wait_for_all_conditions else 0,
+        wait_for_all_conditions,
+        wait_for_deployment,
         timeout_seconds,
-        wait_for_all_conditions
     )
 
-    # 2. Wait for the scheduler to be idle (as implied by deploy plan completion and suppressed bit)
-    # This should be skipped ONLY when it's known that the scheduler will be stuck in an incomplete
-    # state, or if the thing being installed doesn't have a deployment plan (e.g. standalone app)
-    if wait_for_deployment:
-        # this can take a while, default is 15 minutes. for example with HDFS, we can hit the expected
-        # total task count via FINISHED tasks, without actually completing deployment
-        log.info(
-            "Waiting for package={} service={} to finish deployment plan...".format(
-                package_name, service_name
-            )
-        )
-        sdk_plan.wait_for_completed_deployment(service_name, timeout_seconds)
-
+    total_seconds = time.time() - start
+    _install_timings.append(
+        {
+            "package_name": package_name,
+            "service_name": service_name,
+            "install_command_seconds": install_cmd_seconds,
+            "readiness_seconds": readiness_seconds,
+            "total_seconds": total_seconds,
+        }
+    )
     log.info(
-        "Installed package={} service={} after {}".format(
-            package_name, service_name, sdk_utils.pretty_duration(time.time() - start)
+        "Installed package={} service={} after {} (install command: {}{})".format(
+            package_name,
+            service_name,
+            sdk_utils.pretty_duration(total_seconds),
+            sdk_utils.pretty_duration(install_cmd_seconds),
+            "".join(
+                ", {}: +{}".format(name, sdk_utils.pretty_duration(seconds))
+                for name, seconds in readiness_seconds.items()
+            ),
         )
     )
 
-    global _installed_service_names
     _installed_service_names.add(service_name)
 
+    # Only services which were fully deployed are known to be in a reusable state:
+    if SERVICE_REUSE_ENABLED and wait_for_deployment and wait_for_all_conditions:
+        app = sdk_waiter.app_source(service_name).fetch()
+        _reusable_services[service_name] = {
+            "package_name": package_name,
+            "fingerprint": fingerprint,
+            "app_version": app["version"] if app else None,
+        }
+
+
+def _get_install_fingerprint(
+    package_name: str, package_version: str, service_name: str, options: dict
+) -> str:
+    content = json.dumps([package_name, package_version, service_name, options], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _reuse_installed_service(
+    service_name: str, fingerprint: str, expected_running_tasks: int
+) -> bool:
+    """Returns whether a previously installed instance of the service can be reused in place of a
+    new install. A previous instance which can't be reused is uninstalled."""
+    reusable = _reusable_services.get(service_name)
+    if reusable is None:
+        return False
+
+    if reusable["fingerprint"] != fingerprint:
+        reason = "installed with different parameters"
+    else:
+        reason = _get_reuse_blocker(service_name, reusable, expected_running_tasks)
+    if reason:
+        log.info("Not reusing installed service {}: {}".format(service_name, reason))
+        _uninstall(reusable["package_name"], service_name)
+        return False
+
+    log.info("Reusing installed service {} with identical parameters".format(service_name))
+    return True
+
+
+def _get_reuse_blocker(service_name: str, reusable: dict, expected_running_tasks: int):
+    """Returns a reason why the previously installed service isn't in a reusable state, or None if
+    it's healthy and unmodified since it was installed."""
+    try:
+        app = sdk_waiter.app_source(service_name).fetch()
+        if app is None:
+            return "Marathon app no longer exists"
+        if app["version"] != reusable["app_version"]:
+            return "Marathon app was modified since install"
+        for plan_name in ["deploy", "recovery"]:
+            plan = sdk_plan.get_plan_once(service_name, plan_name)
+            if not isinstance(plan, dict) or plan["status"] != "COMPLETE":
+                return "{} plan is not complete".format(plan_name)
+        running_tasks = [
+            t for t in sdk_tasks.get_service_tasks(service_name) if t.state == "TASK_RUNNING"
+        ]
+        if len(running_tasks) < expected_running_tasks:
+            return "{} tasks are running, expected {}".format(
+                len(running_tasks), expected_running_tasks
+            )
+    except Exception as e:
+        return "health check failed: {}".format(e)
+    return None
+
+
+def install_many(specs: list, max_concurrency: int = sdk_utils.DEFAULT_CONCURRENCY) -> None:
+    """Installs several services concurrently, returning once all of them have been installed.
+
+    : param specs: A list of dicts, each containing the keyword arguments for an install() call.
+    : param max_concurrency: The maximum number of services to be installing at the same time.
+    : raises sdk_utils.ConcurrentTasksException: If any of the installs failed, once all have finished.
+    """
+    sdk_utils.run_concurrently(
+        "Install of {} services".format(len(specs)),
+        collections.OrderedDict(
+            (spec["service_name"], functools.partial(install, **spec)) for spec in specs
+        ),
+        max_concurrency,
+    )
+
 
 @retrying.retry(
     stop_max_attempt_number=5,
@@ -204,27 +415,35 @@ def _retried_uninstall_package_and_wait(package_name, service_name):
 
         # Wait on the app no longer being listed in Marathon, at which point it is uninstalled.
         # At the same time, log the deploy plan state as we wait for the app to finish uninstalling.
+        interval = sdk_waiter.AdaptiveInterval("Wait for {} removal".format(service_name))
+
         @retrying.retry(
             stop_max_delay=TIMEOUT_SECONDS * 1000,
-            wait_fixed=5000,
+            wait_func=interval,
             retry_on_result=lambda result: not result,
         )
         def wait_for_removal_log_deploy_plan():
             if not sdk_marathon.app_exists(service_name):
+                interval.observe(None)
                 return True
 
             # App still exists, print the deploy plan. Best effort: It is expected for the scheduler
             # to become unavailable once uninstall completes.
             try:
-                log.info(
-                    sdk_plan.plan_string("deploy", sdk_plan.get_plan_once(service_name, "deploy"))
+                plan_str = sdk_plan.plan_string(
+                    "deploy", sdk_plan.get_plan_once(service_name, "deploy")
                 )
+                interval.observe(plan_str)
+                log.info(plan_str)
             except Exception:
-                pass  # best effort attempt at logging plan content
+                interval.observe("unavailable")  # best effort attempt at logging plan content
             return False
 
         log.info("Waiting for {} to be removed".format(service_name))
-        wait_for_removal_log_deploy_plan()
+        try:
+            wait_for_removal_log_deploy_plan()
+        finally:
+            interval.report()
     else:
         log.info(
             'Skipping uninstall of package {}/service {}: App named "{}" doesn\'t exist'.format(
@@ -233,72 +452,191 @@ def _retried_uninstall_package_and_wait(package_name, service_name):
         )
 
 
-def _verify_completed_uninstall(service_name):
-    state_summary = sdk_cmd.cluster_request("GET", "/mesos/state-summary").json()
-
-    # There should be no orphaned resources in the state summary (DCOS-30314)
-    orphaned_resources = 0
-    ignored_orphaned_resources = 0
-    service_role = sdk_utils.get_role(service_name)
-    for agent in state_summary["slaves"]:
-        # resources should be grouped by role. check for any resources in our expected role:
-        matching_reserved_resources = agent["reserved_resources"].get(service_role)
-        if matching_reserved_resources:
-            global _dead_agent_hosts
-            if agent["hostname"] in _dead_agent_hosts:
-                # The test told us ahead of time to expect orphaned resources on this host.
-                log.info(
-                    "Ignoring orphaned resources on agent {}/{}: {}".format(
-                        agent["id"], agent["hostname"], matching_reserved_resources
+def _get_state_summary() -> dict:
+    return sdk_cmd.cluster_request("GET", "/mesos/state-summary").json()
+
+
+class _UninstallVerifier(object):
+    """Tracks any reserved resources and frameworks which were left behind by the uninstall of one
+    or more services, across successive polls of the cluster state.
+
+    The first poll indexes the reservations of every agent for the roles of the uninstalled services.
+    Later polls only re-check the agents which still had such reservations, as reservations for
+    a role aren't created once its framework has been uninstalled.
+    """
+
+    def __init__(self, service_names: list) -> None:
+        self._service_names = list(service_names)
+        self._role_services = dict((sdk_utils.get_role(name), name) for name in service_names)
+        # agent id => (hostname, {role: reserved resources}), for agents with matching reservations
+        self._agents = None
+        # service name => frameworks with that name
+        self._frameworks = {}
+        self.checked_agents = 0
+
+    def update(self, state_summary: dict) -> None:
+        agents = {}
+        for agent in state_summary["slaves"]:
+            if self._agents is not None and agent["id"] not in self._agents:
+                continue  # had no matching reservations as of the previous poll
+            self.checked_agents += 1
+            reservations = dict(
+                (role, resources)
+                for role, resources in agent["reserved_resources"].items()
+                if role in self._role_services and resources
+            )
+            if reservations:
+                agents[agent["id"]] = (agent["hostname"], reservations)
+        self._agents = agents
+
+        self._frameworks = {}
+        for fwk in state_summary["frameworks"]:
+            if fwk["name"] in self._service_names:
+                self._frameworks.setdefault(fwk["name"], []).append(fwk)
+
+    def get_orphans(self, service_name: str) -> tuple:
+        """Returns (blocking, ignored) lists of (agent_id, hostname, resources) tuples for the
+        reservations of the service, where reservations on dead agents are ignored."""
+        role = sdk_utils.get_role(service_name)
+        blocking = []
+        ignored = []
+        for agent_id, (hostname, reservations) in self._agents.items():
+            if role in reservations:
+                orphan = (agent_id, hostname, reservations[role])
+                (ignored if hostname in _dead_agent_hosts else blocking).append(orphan)
+        return blocking, ignored
+
+    def get_orphaned_frameworks(self, service_name: str) -> list:
+        return self._frameworks.get(service_name, [])
+
+    def is_clean(self) -> bool:
+        """Returns whether nothing is left behind, other than resources on dead agents."""
+        return not self._frameworks and not any(
+            self.get_orphans(name)[0] for name in self._service_names
+        )
+
+    def describe_blockers(self) -> str:
+        lines = []
+        for name in self._service_names:
+            for agent_id, hostname, resources in self.get_orphans(name)[0]:
+                lines.append(
+                    "- {}: agent {}/{} has reserved {}".format(
+                        name, agent_id, hostname, _resources_string(resources)
                     )
                 )
-                ignored_orphaned_resources += len(matching_reserved_resources)
-            else:
-                log.error(
-                    "Orphaned resources on agent {}/{}: {}".format(
-                        agent["id"], agent["hostname"], matching_reserved_resources
+            for fwk in self.get_orphaned_frameworks(name):
+                lines.append(
+                    "- {}: framework {} (active={}) is still registered".format(
+                        name, fwk.get("id"), fwk.get("active")
                     )
                 )
-                orphaned_resources += len(matching_reserved_resources)
-    if orphaned_resources:
-        log.error(
-            "{} orphaned resources (plus {} ignored) after uninstall of {}".format(
-                orphaned_resources, ignored_orphaned_resources, service_name
+        return "\n".join(lines)
+
+
+def _resources_string(resources: dict) -> str:
+    return ", ".join("{}={}".format(name, value) for name, value in sorted(resources.items()))
+
+
+# How long to wait for reserved resources and frameworks to be cleaned up, following an uninstall.
+# By default, leftovers are checked once and fail the uninstall immediately (DCOS-30314, DCOS-29474).
+ORPHAN_CLEANUP_TIMEOUT_SECONDS = int(
+    os.environ.get("INTEGRATION_TEST__ORPHAN_CLEANUP_TIMEOUT_SECONDS", "0")
+)
+
+
+def _verify_completed_uninstall(service_name, state_summary=None):
+    """Checks the cluster state for any resources or frameworks left behind by the uninstall of the
+    service, raising an exception if any are found. A state summary which was fetched after the
+    uninstall completed may be provided."""
+    errors = _verify_completed_uninstalls([service_name], state_summary)
+    if errors:
+        raise errors[service_name]
+
+
+def _verify_completed_uninstalls(service_names: list, state_summary=None) -> dict:
+    """Checks the cluster state for any resources or frameworks left behind by the uninstall of the
+    services. If ORPHAN_CLEANUP_TIMEOUT_SECONDS is set, leftovers are given that long to be cleaned
+    up, re-checking only the agents which still had them.
+
+    Returns an exception for each service which still had leftovers, keyed by service name."""
+    verifier = _UninstallVerifier(service_names)
+    verifier.update(state_summary if state_summary is not None else _get_state_summary())
+    deadline = time.time() + ORPHAN_CLEANUP_TIMEOUT_SECONDS
+    while not verifier.is_clean() and time.time() < deadline:
+        log.info(
+            "Waiting for uninstall leftovers to be cleaned up:\n{}".format(
+                verifier.describe_blockers()
             )
         )
-        log.error(state_summary)
-        raise Exception(
-            "Found {} orphaned resources (plus {} ignored) after uninstall of {}".format(
-                orphaned_resources, ignored_orphaned_resources, service_name
-            )
+        time.sleep(5)
+        verifier.update(_get_state_summary())
+    log.info(
+        "Checked {} agent reservation entries for leftovers of {}".format(
+            verifier.checked_agents, service_names
         )
-    elif ignored_orphaned_resources:
-        log.info(
-            "Ignoring {} orphaned resources after uninstall of {}".format(
-                ignored_orphaned_resources, service_name
+    )
+
+    errors = collections.OrderedDict()
+    for service_name in service_names:
+        # There should be no orphaned resources in the state summary (DCOS-30314)
+        blocking, ignored = verifier.get_orphans(service_name)
+        for agent_id, hostname, resources in ignored:
+            # The test told us ahead of time to expect orphaned resources on this host.
+            log.info(
+                "Ignoring orphaned resources on agent {}/{}: {}".format(
+                    agent_id, hostname, _resources_string(resources)
+                )
+            )
+        for agent_id, hostname, resources in blocking:
+            log.error(
+                "Orphaned resources on agent {}/{}: {}".format(
+                    agent_id, hostname, _resources_string(resources)
+                )
+            )
+        if blocking:
+            errors[service_name] = Exception(
+                "Found orphaned resources on {} agents (plus {} ignored) after uninstall of {}: {}".format(
+                    len(blocking),
+                    len(ignored),
+                    service_name,
+                    ", ".join(
+                        "{}/{}".format(agent_id, hostname) for agent_id, hostname, _ in blocking
+                    ),
+                )
+            )
+            continue
+        if ignored:
+            log.info(
+                "Ignoring orphaned resources on {} agents after uninstall of {}".format(
+                    len(ignored), service_name
+                )
+            )
+        else:
+            log.info(
+                "No orphaned resources for role {} were found".format(
+                    sdk_utils.get_role(service_name)
+                )
             )
-        )
-        log.info(state_summary)
-    else:
-        log.info("No orphaned resources for role {} were found".format(service_role))
 
-    # There should be no framework entry for this service in the state summary (DCOS-29474)
-    orphaned_frameworks = [
-        fwk for fwk in state_summary["frameworks"] if fwk["name"] == service_name
-    ]
-    if orphaned_frameworks:
-        log.error(
-            "{} orphaned frameworks named {} after uninstall of {}: {}".format(
-                len(orphaned_frameworks), service_name, service_name, orphaned_frameworks
+        # There should be no framework entry for this service in the state summary (DCOS-29474)
+        orphaned_frameworks = verifier.get_orphaned_frameworks(service_name)
+        if orphaned_frameworks:
+            log.error(
+                "{} orphaned frameworks named {} after uninstall of {}: {}".format(
+                    len(orphaned_frameworks), service_name, service_name, orphaned_frameworks
+                )
             )
-        )
-        log.error(state_summary)
-        raise Exception(
-            "Found {} orphaned frameworks named {} after uninstall of {}: {}".format(
-                len(orphaned_frameworks), service_name, service_name, orphaned_frameworks
+            errors[service_name] = Exception(
+                "Found {} orphaned frameworks named {} after uninstall of {}: {}".format(
+                    len(orphaned_frameworks),
+                    service_name,
+                    service_name,
+                    [fwk.get("id") for fwk in orphaned_frameworks],
+                )
             )
-        )
-    log.info("No orphaned frameworks for service {} were found".format(service_name))
+            continue
+        log.info("No orphaned frameworks for service {} were found".format(service_name))
+    return errors
 
 
 def ignore_dead_agent(agent_host):
@@ -319,7 +657,110 @@ def uninstall(package_name, service_name):
     framework were correctly cleaned up after the uninstall has completed. Any agents which are
     expected to have orphaned resources (e.g. due to being shut down) should be passed to
     ignore_dead_agent() before triggering the uninstall.
+
+    If service reuse is enabled and the service was installed by install(), an uninstall from a
+    fixture is deferred to uninstall_reused_services() so that the service may be reused. Uninstalls
+    made by the test itself always take effect immediately.
     """
+    if _defer_uninstall(service_name):
+        return
+    _uninstall(package_name, service_name)
+
+
+def uninstall_many(services: list, max_concurrency: int = sdk_utils.DEFAULT_CONCURRENCY) -> None:
+    """Uninstalls several services concurrently. Once all the uninstalls have finished, the cleanup of
+    all services is verified against a single fetch of the cluster state. See also uninstall().
+
+    : param services: A list of (package_name, service_name) tuples.
+    : param max_concurrency: The maximum number of services to be uninstalling at the same time.
+    : raises sdk_utils.ConcurrentTasksException: If any of the uninstalls or verifications failed.
+    """
+    _uninstall_many(
+        [
+            (package_name, service_name)
+            for package_name, service_name in services
+            if not _defer_uninstall(service_name)
+        ],
+        max_concurrency,
+    )
+
+
+def uninstall_reused_services():
+    """Uninstalls any services whose uninstall was deferred for reuse, raising an exception if any of
+    them fail to uninstall or leave anything behind. This should be called at the end of the test
+    session."""
+    _uninstall_many(
+        [(reusable["package_name"], name) for name, reusable in _reusable_services.items()]
+    )
+
+
+@contextlib.contextmanager
+def running_test_body():
+    """Marks the test function as running, so that any uninstall() which it makes isn't deferred for
+    service reuse. This should wrap the pytest_runtest_call() hook."""
+    global _in_test_body
+    _in_test_body = True
+    try:
+        yield
+    finally:
+        _in_test_body = False
+
+
+def _defer_uninstall(service_name) -> bool:
+    if SERVICE_REUSE_ENABLED and not _in_test_body and service_name in _reusable_services:
+        log.info("Deferring uninstall of {} to the end of the session".format(service_name))
+        return True
+    return False
+
+
+def _uninstall(package_name, service_name):
+    _uninstall_package(package_name, service_name)
+
+    # Sanity check: Verify that all resources and the framework have been successfully cleaned up,
+    # and throw an exception if anything is left over (uninstall bug?)
+    _verify_completed_uninstall(service_name)
+    _remove_installed_service_name(service_name)
+
+
+def _uninstall_many(services: list, max_concurrency: int = sdk_utils.DEFAULT_CONCURRENCY) -> None:
+    if not services:
+        return
+    description = "Uninstall of {} services".format(len(services))
+    errors = collections.OrderedDict()
+    try:
+        sdk_utils.run_concurrently(
+            description,
+            collections.OrderedDict(
+                (service_name, functools.partial(_uninstall_package, package_name, service_name))
+                for package_name, service_name in services
+            ),
+            max_concurrency,
+        )
+    except sdk_utils.ConcurrentTasksException as e:
+        errors.update(e.errors)
+
+    # Verify all the completed uninstalls against the same cluster state:
+    uninstalled = [service_name for _, service_name in services if service_name not in errors]
+    if uninstalled:
+        errors.update(_verify_completed_uninstalls(uninstalled))
+    for service_name in uninstalled:
+        if service_name not in errors:
+            _remove_installed_service_name(service_name)
+    if errors:
+        raise sdk_utils.ConcurrentTasksException(description, errors)
+
+
+def _remove_installed_service_name(service_name):
+    # Remove the service from the installed list (used by sdk_diag)
+    try:
+        _installed_service_names.remove(service_name)
+    except KeyError:
+        pass  # Expected when tests preemptively uninstall at start of test
+
+
+def _uninstall_package(package_name, service_name):
+    """Uninstalls the service and runs any cleanup, without verifying the result."""
+    _reusable_services.pop(service_name, None)
     start = time.time()
 
     log.info("Uninstalling {}".format(service_name))
@@ -355,14 +796,3 @@ def uninstall(package_name, service_name):
             sdk_utils.pretty_duration(finish - start),
         )
     )
-
-    # Sanity check: Verify that all resources and the framework have been successfully cleaned up,
-    # and throw an exception if anything is left over (uninstall bug?)
-    _verify_completed_uninstall(service_name)
-
-    # Finally, remove the service from the installed list (used by sdk_diag)
-    global _installed_service_names
-    try:
-        _installed_service_names.remove(service_name)
-    except KeyError:
-        pass  # Expected when tests preemptively uninstall at start of test
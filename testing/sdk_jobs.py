@@ -8,9 +8,8 @@ SHOULD ALSO BE APPLIED TO sdk_jobs IN ANY OTHER PARTNER REPOS
 import json
 import logging
 
-import retrying
-
 import sdk_cmd
+import sdk_waiter
 
 log = logging.getLogger(__name__)
 
@@ -78,20 +77,11 @@ def run_job(job_dict, timeout_seconds=600, raise_on_failure=True):
     log.info("Started job {}: run id {}".format(job_name, run_id))
 
     # Wait for run to succeed, throw if run fails:
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
-    )
-    def wait():
+    def check(job):
         # Note: We COULD directly query the run here via /v1/jobs/<job_name>/runs/<run_id>, but that
         # only works for active runs -- for whatever reason the run will disappear after it's done.
         # Therefore we have to query the full run history from the parent job and find our run_id there.
-        run_history = sdk_cmd.service_request(
-            "GET",
-            "metronome",
-            "/v1/jobs/{}".format(job_name),
-            retry=False,
-            params={"embed": "history"},
-        ).json()["history"]
+        run_history = job["history"]
 
         successful_run_ids = [run["id"] for run in run_history["successfulFinishedRuns"]]
         failed_run_ids = [run["id"] for run in run_history["failedFinishedRuns"]]
@@ -109,7 +99,12 @@ def run_job(job_dict, timeout_seconds=600, raise_on_failure=True):
 
         return run_id in successful_run_ids
 
-    wait()
+    sdk_waiter.wait_for(
+        "job {} run {} to succeed".format(job_name, run_id),
+        [sdk_waiter.job_source(job_name)],
+        check,
+        timeout_seconds,
+    )
 
     return run_id
 
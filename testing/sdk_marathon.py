@@ -11,7 +11,9 @@ import requests
 import typing
 
 import sdk_cmd
+import sdk_events
 import sdk_tasks
+import sdk_waiter
 
 TIMEOUT_SECONDS = 15 * 60
 
@@ -52,6 +54,10 @@ def get_config(app_name, timeout=TIMEOUT_SECONDS):
     return config
 
 
+class DeploymentFailedException(Exception):
+    pass
+
+
 class MarathonDeploymentResponse:
     class App:
         def __init__(self, version: str, deployment_id: str) -> None:
@@ -106,62 +112,13 @@ class MarathonDeploymentsResponse(MarathonDeploymentResponse):
 
 
 def wait_for_deployment(app_name: str, timeout: int, expected_version: str) -> None:
-    @retrying.retry(
-        stop_max_delay=timeout * 1000, wait_fixed=2000, retry_on_result=lambda result: not result
-    )
-    def _wait_for_deployment() -> bool:
-        app = _get_config(app_name)
-
-        if expected_version:
-            # Specific version expected: Check version in addition to other checks
-            # This avoids a race when reconfiguring a marathon app, where it may initially look
-            # healthy/deployed BEFORE the deployment has started.
-            version = app.get("version", "")
-            log_extra = ", version={}/{}".format(version, expected_version)
-            extra_check = expected_version == version
-        else:
-            # No expected version: Just check deployments + health
-            # This should ONLY be used when installing a new app, NOT when reconfiguring an existing app.
-            log_extra = ""
-            extra_check = True
-
-        running = app.get("tasksRunning", 0)
-        healthy = app.get("tasksHealthy", 0)
-        expect_instances = app.get("instances", 1)
-
-        if app.get("healthChecks", []) or app.get("readinessChecks", []):
-            # App defines health or readiness check.
-            # Use the healthy count to determine when the app has finished.
-            log_running = running
-            log_healthy = "{}/{}+".format(healthy, expect_instances)
-            instances_check = healthy >= expect_instances
-        else:
-            # No health checks, just check 'running'
-            log_running = "{}/{}+".format(running, expect_instances)
-            log_healthy = healthy
-            instances_check = running >= expect_instances
-
-        staged = app.get("tasksStaged", 0)
-        unhealthy = app.get("tasksUnhealthy", 0)
-        deployments = app.get("deployments", [])
-
-        log.info(
-            "%s: staged=%s/0, running=%s, unhealthy=%s/0, healthy=%s, deployments=%s/0%s",
-            app.get("id", "???"),
-            staged,
-            log_running,
-            unhealthy,
-            log_healthy,
-            len(deployments),
-            log_extra,
-        )
-        return (
-            staged == 0
-            and unhealthy == 0
-            and len(deployments) == 0
-            and instances_check
-            and extra_check
-        )
+    def _check_deployed(app) -> bool:
+        if app is None:
+            log.info("{}: app not found".format(app_name))
+            return False
+        deployed, status = get_deployment_status(app, expected_version)
+        log.info(status)
+        return deployed
 
     if expected_version:
         log.info(
@@ -169,7 +126,71 @@ def wait_for_deployment(app_name: str, timeout: int, expected_version: str) -> N
         )
     else:
         log.info("Waiting for {} to be deployed with any version...".format(app_name))
-    _wait_for_deployment()
+    # Re-check as soon as Marathon reports a change to the app, rather than on the next poll.
+    sdk_waiter.wait_for(
+        "{} to be deployed".format(app_name),
+        [sdk_waiter.app_source(app_name)],
+        _check_deployed,
+        timeout,
+        interval=2000,
+        events=sdk_events.marathon_wait(app_id=app_name),
+    )
+
+
+def get_deployment_status(app: dict, expected_version: str = None) -> tuple:
+    """Returns whether the provided Marathon app has finished deploying with all its instances
+    running (or healthy, if the app has health checks), along with a description of its status.
+
+    If an expected version is provided, the app must also have that version. This should be provided
+    when reconfiguring an existing app, where it may initially look deployed before the deployment
+    has started.
+    """
+    if expected_version:
+        # Specific version expected: Check version in addition to other checks
+        # This avoids a race when reconfiguring a marathon app, where it may initially look
+        # healthy/deployed BEFORE the deployment has started.
+        version = app.get("version", "")
+        log_extra = ", version={}/{}".format(version, expected_version)
+        extra_check = expected_version == version
+    else:
+        # No expected version: Just check deployments + health
+        # This should ONLY be used when installing a new app, NOT when reconfiguring an existing app.
+        log_extra = ""
+        extra_check = True
+
+    running = app.get("tasksRunning", 0)
+    healthy = app.get("tasksHealthy", 0)
+    expect_instances = app.get("instances", 1)
+
+    if app.get("healthChecks", []) or app.get("readinessChecks", []):
+        # App defines health or readiness check.
+        # Use the healthy count to determine when the app has finished.
+        log_running = running
+        log_healthy = "{}/{}+".format(healthy, expect_instances)
+        instances_check = healthy >= expect_instances
+    else:
+        # No health checks, just check 'running'
+        log_running = "{}/{}+".format(running, expect_instances)
+        log_healthy = healthy
+        instances_check = running >= expect_instances
+
+    staged = app.get("tasksStaged", 0)
+    unhealthy = app.get("tasksUnhealthy", 0)
+    deployments = app.get("deployments", [])
+
+    status = "%s: staged=%s/0, running=%s, unhealthy=%s/0, healthy=%s, deployments=%s/0%s" % (
+        app.get("id", "???"),
+        staged,
+        log_running,
+        unhealthy,
+        log_healthy,
+        len(deployments),
+        log_extra,
+    )
+    deployed = (
+        staged == 0 and unhealthy == 0 and len(deployments) == 0 and instances_check and extra_check
+    )
+    return deployed, status
 
 
 def install_app(app_definition: dict, timeout=TIMEOUT_SECONDS) -> None:
@@ -204,6 +225,80 @@ def install_app(app_definition: dict, timeout=TIMEOUT_SECONDS) -> None:
     wait_for_deployment(app_name, timeout, result.get_version())
 
 
+def install_apps(app_definitions: list, timeout=TIMEOUT_SECONDS) -> None:
+    """
+    Installs several marathon apps with a single request, so that they're all deployed
+    concurrently as part of one Marathon deployment. Returns once the deployment has finished and
+    all the apps are deployed and healthy.
+
+    Any apps which already exist, e.g. left over from a previous run, are destroyed first, as with
+    install_app(). This ensures that the apps are created with exactly the provided definitions, as
+    a PUT to /v2/apps would otherwise only apply a partial update to existing apps, keeping any of
+    their fields which are missing from the new definitions.
+
+    Args:
+        app_definitions: The definitions of the apps to pass to marathon.
+    """
+    app_names = [app_definition["id"] for app_definition in app_definitions]
+    log.info("Installing {} apps: {}".format(len(app_names), ", ".join(app_names)))
+
+    for app_name in app_names:
+        if app_exists(app_name, timeout):
+            log.info("App {} exists already, left over from previous run?".format(app_name))
+            destroy_app(app_name, timeout=timeout)
+
+    # Created before the PUT is issued, so that the stream is known to include its outcome:
+    events = sdk_events.marathon_wait()
+
+    @retrying.retry(stop_max_delay=timeout * 1000, wait_fixed=2000)
+    def _install() -> MarathonDeploymentResponse:
+        response = sdk_cmd.cluster_request(
+            "PUT", _api_url("apps"), json=app_definitions, log_args=False, raise_on_error=False
+        )
+        return MarathonDeploymentResponse(response)
+
+    deployment_id = _install().get_apps()[0].get_deployment_id()
+    _wait_for_deployment_id(deployment_id, events, timeout)
+
+    # The deployment only finishes once its apps are healthy, so these should pass immediately:
+    for app_name in app_names:
+        wait_for_deployment(app_name, timeout, None)
+
+
+def _wait_for_deployment_id(deployment_id: str, events: sdk_events.EventWait, timeout: int) -> None:
+    """Waits for the specified deployment to no longer be listed by Marathon. If the event stream
+    has been connected since `events` was created, a failed deployment is raised as an exception."""
+
+    def _get_result():
+        if events.reliable():
+            return events.subscriber.get_deployment_result(deployment_id)
+        deployments_response = MarathonDeploymentsResponse(
+            sdk_cmd.cluster_request("GET", _api_url("deployments"), retry=False)
+        )
+        if deployment_id in [a.get_deployment_id() for a in deployments_response.get_apps()]:
+            return None
+        return "deployment_finished"
+
+    def _check_finished(result) -> bool:
+        if result is None:
+            return False
+        if result == "deployment_failed":
+            raise DeploymentFailedException(
+                "Deployment {} reported {}".format(deployment_id, result)
+            )
+        return True
+
+    log.info("Waiting for deployment {} to finish...".format(deployment_id))
+    sdk_waiter.wait_for(
+        "deployment {} to finish".format(deployment_id),
+        [sdk_waiter.Source("deployment:{}".format(deployment_id), _get_result)],
+        _check_finished,
+        timeout,
+        interval=2000,
+        events=events,
+    )
+
+
 def update_app(
     config: dict, timeout=TIMEOUT_SECONDS, wait_for_completed_deployment=True, force=True
 ) -> None:
@@ -236,6 +331,9 @@ def update_app(
 
 
 def destroy_app(app_name: str, timeout=TIMEOUT_SECONDS) -> None:
+    # Created before the DELETE is issued, so that the stream is known to include its outcome:
+    events = sdk_events.marathon_wait(app_id=app_name)
+
     @retrying.retry(stop_max_delay=timeout * 1000, wait_fixed=2000)
     def _destroy() -> MarathonDeploymentResponse:
         response = sdk_cmd.cluster_request(
@@ -249,9 +347,19 @@ def destroy_app(app_name: str, timeout=TIMEOUT_SECONDS) -> None:
     # This check is different from the other deployment checks.
     # When it's complete, the app is gone entirely.
     @retrying.retry(
-        stop_max_delay=timeout * 1000, wait_fixed=2000, retry_on_result=lambda result: not result
+        stop_max_delay=timeout * 1000, wait_func=events, retry_on_result=lambda result: not result
     )
     def _wait_for_app_destroyed():
+        events.mark()
+        if events.reliable():
+            # The stream has been up since before the DELETE: Rely on it to report the outcome.
+            result = events.subscriber.get_deployment_result(deployment_id)
+            if result is None:
+                return False
+            if result == "deployment_success":
+                return True
+            log.info("Deployment {} for {} reported {}".format(deployment_id, app_name, result))
+            # Fall through to check the current state directly
         if app_exists(app_name, timeout):
             return False
         deployments_response = MarathonDeploymentsResponse(
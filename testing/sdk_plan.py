@@ -6,12 +6,18 @@ SHOULD ALSO BE APPLIED TO sdk_plan IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
 
+import collections
+import concurrent.futures
 import datetime
 import logging
 import retrying
+import threading
+import time
 
 import sdk_cmd
 import sdk_tasks
+import sdk_utils
+import sdk_waiter
 
 TIMEOUT_SECONDS = 15 * 60
 SHORT_TIMEOUT_SECONDS = 30
@@ -37,23 +43,25 @@ def get_decommission_plan(service_name, timeout_seconds=TIMEOUT_SECONDS):
     return get_plan(service_name, "decommission", timeout_seconds)
 
 
-def list_plans(service_name, timeout_seconds=TIMEOUT_SECONDS, multiservice_name=None):
+def list_plans(service_name, timeout_seconds=TIMEOUT_SECONDS, multiservice_name=None, session=None):
     if multiservice_name is None:
         path = "/v1/plans"
     else:
         path = "/v1/service/{}/plans".format(multiservice_name)
     return sdk_cmd.service_request(
-        "GET", service_name, path, timeout_seconds=timeout_seconds
+        "GET", service_name, path, timeout_seconds=timeout_seconds, session=session
     ).json()
 
 
-def get_plan_once(service_name, plan, multiservice_name=None):
+def get_plan_once(service_name, plan, multiservice_name=None, session=None):
     if multiservice_name is None:
         path = "/v1/plans/{}".format(plan)
     else:
         path = "/v1/service/{}/plans/{}".format(multiservice_name, plan)
 
-    response = sdk_cmd.service_request("GET", service_name, path, retry=False, raise_on_error=False)
+    response = sdk_cmd.service_request(
+        "GET", service_name, path, retry=False, raise_on_error=False, session=session
+    )
     if response.status_code == 417:
         return response  # Plan has errors: Avoid throwing an exception, return plan as-is.
     response.raise_for_status()
@@ -68,6 +76,52 @@ def get_plan(service_name, plan, timeout_seconds=TIMEOUT_SECONDS, multiservice_n
     return wait_for_plan()
 
 
+def get_all_plans(service_name, timeout_seconds=SHORT_TIMEOUT_SECONDS, multiservice_name=None):
+    """Fetches the content of all of a service's plans. The plan list is fetched first, followed by
+    all the plans concurrently over a shared connection pool, so that the plans are fetched within
+    a single round trip of each other.
+
+    Returns a snapshot of the form:
+    {
+        "service": "hello-world",
+        "started": 1550000000.0,   # time.time() when the fetch started...
+        "finished": 1550000000.2,  # ... and when it finished
+        "plans": {
+            "deploy": {"fetched": 1550000000.1, "plan": {...}},
+            "recovery": {"fetched": 1550000000.1, "error": "..."},  # a plan which failed to fetch
+        },
+    }
+    Plans with errors (HTTP 417) are included as-is. Failures to fetch the plan list are raised.
+    """
+    started = time.time()
+    with sdk_cmd.pooled_session() as session:
+        plan_names = list_plans(service_name, timeout_seconds, multiservice_name, session=session)
+
+        def fetch(plan_name):
+            @retrying.retry(wait_fixed=1000, stop_max_delay=timeout_seconds * 1000)
+            def fetch_plan():
+                return get_plan_once(service_name, plan_name, multiservice_name, session=session)
+
+            try:
+                plan = fetch_plan()
+                if not isinstance(plan, dict):
+                    plan = plan.json()  # plan with errors (HTTP 417)
+                return {"fetched": time.time(), "plan": plan}
+            except Exception as e:
+                log.exception("Failed to fetch {} plan of {}".format(plan_name, service_name))
+                return {"fetched": time.time(), "error": str(e)}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(plan_names))) as executor:
+            plans = collections.OrderedDict(zip(plan_names, executor.map(fetch, plan_names)))
+
+    return {
+        "service": service_name,
+        "started": started,
+        "finished": time.time(),
+        "plans": plans,
+    }
+
+
 def start_plan(service_name, plan, parameters=None):
     sdk_cmd.service_request(
         "POST",
@@ -139,90 +193,210 @@ def wait_for_plan_status(
     service_name, plan_name, status, timeout_seconds=TIMEOUT_SECONDS, multiservice_name=None
 ):
     """Wait for a plan to have one of the specified statuses"""
-    if isinstance(status, str):
-        statuses = [status]
-    else:
-        statuses = status
+    return _PlanStatusWait(
+        service_name, plan_name, status, timeout_seconds, multiservice_name
+    ).join()
+
+
+class _PlanStatusWait(object):
+    """A wait for a plan to have one of the specified statuses, which is registered with the shared
+    wait engine on creation. join() must be called to wait for its result and release its
+    resources."""
+
+    def __init__(
+        self, service_name, plan_name, status, timeout_seconds, multiservice_name=None
+    ) -> None:
+        self._service_name = service_name
+        self._plan_name = plan_name
+        if isinstance(status, str):
+            self._statuses = [status]
+        else:
+            self._statuses = status
 
-    initial_failures = sdk_tasks.get_failed_task_count(service_name, retry=True)
-    wait_start = datetime.datetime.utcnow()
+        # Failure counts are refreshed in the background, so that polls only need to fetch the plan.
+        self._failures = sdk_tasks.watch_failed_tasks(service_name, MAX_NEW_TASK_FAILURES)
+        self._wait_start = datetime.datetime.utcnow()
+        self._interval = sdk_waiter.AdaptiveInterval(
+            "Wait for {} {} plan {}".format(service_name, plan_name, self._statuses)
+        )
+        self._progress = PlanProgressLogger(
+            service_name,
+            plan_name,
+            multiservice_name,
+            "Waiting for {} {} plan".format(status, plan_name),
+        )
+        self._waiter = sdk_waiter.get_engine().start(
+            "{} {} plan {}".format(service_name, plan_name, self._statuses),
+            [
+                sdk_waiter.optional_source(
+                    sdk_waiter.plan_source(service_name, plan_name, multiservice_name)
+                )
+            ],
+            self._check,
+            timeout_seconds,
+            interval=self._interval,
+        )
 
-    @retrying.retry(
-        wait_fixed=1000,
-        stop_max_delay=timeout_seconds * 1000,
-        retry_on_result=lambda res: not res,
-        retry_on_exception=lambda e: not isinstance(e, TaskFailuresExceededException),
-    )
-    def fn():
-        failures = sdk_tasks.get_failed_task_count(service_name)
-        if failures - initial_failures > MAX_NEW_TASK_FAILURES:
+    def join(self):
+        """Blocks until the plan has one of the specified statuses, returning the plan."""
+        try:
+            return sdk_waiter.get_engine().join(self._waiter)
+        except Exception:
+            self._progress.log_last_plan()
+            raise
+        finally:
+            self._failures.close()
+            self._interval.report()
+
+    def duration_seconds(self) -> float:
+        return self._waiter.report()["duration_seconds"]
+
+    def _check(self, plan):
+        if self._failures.exceeded():
             log.error(
                 "Tasks in service %s failed %d times since starting %ds ago to wait for %s to reach %s, aborting.",
-                service_name,
-                MAX_NEW_TASK_FAILURES,
-                (datetime.datetime.utcnow() - wait_start).total_seconds(),
-                plan_name,
-                statuses,
+                self._service_name,
+                self._failures.new_failures(),
+                (datetime.datetime.utcnow() - self._wait_start).total_seconds(),
+                self._plan_name,
+                self._statuses,
             )
-            raise TaskFailuresExceededException("Service not recoverable: {}".format(service_name))
+            raise TaskFailuresExceededException(
+                "Service not recoverable: {}".format(self._service_name)
+            )
+        if plan is None:
+            return False  # The scheduler is unavailable: Check the failure budget again later.
 
-        plan = get_plan(
-            service_name,
-            plan_name,
-            timeout_seconds=SHORT_TIMEOUT_SECONDS,
-            multiservice_name=multiservice_name,
-        )
-        log.info("Waiting for %s %s plan:\n%s", status, plan_name, plan_string(plan_name, plan))
-        if plan and plan["status"] in statuses:
+        parsed = self._progress.record(plan)
+        self._interval.observe(parsed)
+        if isinstance(plan, dict) and parsed.status in self._statuses:
             return plan
         else:
             return False
 
-    return fn()
+
+def wait_for_plans(plans: list, timeout_seconds=TIMEOUT_SECONDS) -> dict:
+    """Waits for several plans to each reach one of their specified statuses. All of the plans are
+    checked by the shared wait engine at the same time, so that the total wait is that of the
+    slowest plan. A combined timing report is logged at the end.
+
+    : param plans: A list of (service_name, plan_name, status) tuples, or of (service_name,
+                   plan_name, status, multiservice_name) tuples for plans of a multi-service
+                   scheduler. The status may be a single status or a list of statuses, as with
+                   wait_for_plan_status().
+    : return: The final content of each plan, keyed by (service_name, plan_name), or by
+              (service_name, plan_name, multiservice_name) for plans of a multi-service scheduler.
+    : raises ValueError: If the same plan is listed more than once.
+    : raises sdk_utils.ConcurrentTasksException: If any of the waits failed, once all have finished.
+    """
+    keyed_plans = collections.OrderedDict()
+    for plan in plans:
+        service_name, plan_name, status = plan[:3]
+        multiservice_name = plan[3] if len(plan) > 3 else None
+        key = (service_name, plan_name) + ((multiservice_name,) if multiservice_name else ())
+        if key in keyed_plans:
+            raise ValueError("Plan {} is listed more than once in {}".format(key, plans))
+        keyed_plans[key] = (service_name, plan_name, status, multiservice_name)
+
+    description = "Wait for {} plans".format(len(keyed_plans))
+    start = time.time()
+    waits = collections.OrderedDict()
+    results = collections.OrderedDict()
+    errors = collections.OrderedDict()
+    for key, (service_name, plan_name, status, multiservice_name) in keyed_plans.items():
+        try:
+            waits[key] = _PlanStatusWait(
+                service_name, plan_name, status, timeout_seconds, multiservice_name
+            )
+        except Exception as e:
+            log.exception("{}: {} failed".format(description, key))
+            errors[key] = e
+    for key, wait in waits.items():
+        try:
+            results[key] = wait.join()
+        except Exception as e:
+            log.exception("{}: {} failed".format(description, key))
+            errors[key] = e
+
+    log.info(
+        "{} finished after {}:\n{}".format(
+            description,
+            sdk_utils.pretty_duration(time.time() - start),
+            "\n".join(
+                "- {}: {}{}".format(
+                    key,
+                    "FAILED" if key in errors else "succeeded",
+                    (
+                        " after {}".format(sdk_utils.pretty_duration(waits[key].duration_seconds()))
+                        if key in waits
+                        else ""
+                    ),
+                )
+                for key in keyed_plans.keys()
+            ),
+        )
+    )
+    if errors:
+        raise sdk_utils.ConcurrentTasksException(description, errors)
+    return results
 
 
 def wait_for_phase_status(
     service_name, plan_name, phase_name, status, timeout_seconds=TIMEOUT_SECONDS
 ):
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+    progress = PlanProgressLogger(
+        service_name,
+        plan_name,
+        None,
+        "Waiting for {} {}.{} phase".format(status, plan_name, phase_name),
     )
-    def fn():
-        plan = get_plan(service_name, plan_name, SHORT_TIMEOUT_SECONDS)
-        phase = get_phase(plan, phase_name)
-        log.info(
-            "Waiting for {} {}.{} phase:\n{}".format(
-                status, plan_name, phase_name, plan_string(plan_name, plan)
-            )
-        )
+
+    def check(plan):
+        phase = progress.record(plan).get_phase(phase_name)
         if phase and phase["status"] == status:
             return plan
         else:
             return False
 
-    return fn()
+    try:
+        return sdk_waiter.wait_for(
+            "{} {}.{} phase {}".format(service_name, plan_name, phase_name, status),
+            [sdk_waiter.plan_source(service_name, plan_name)],
+            check,
+            timeout_seconds,
+        )
+    except Exception:
+        progress.log_last_plan()
+        raise
 
 
 def wait_for_step_status(
     service_name, plan_name, phase_name, step_name, status, timeout_seconds=TIMEOUT_SECONDS
 ):
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+    progress = PlanProgressLogger(
+        service_name,
+        plan_name,
+        None,
+        "Waiting for {} {}.{}.{} step".format(status, plan_name, phase_name, step_name),
     )
-    def fn():
-        plan = get_plan(service_name, plan_name, SHORT_TIMEOUT_SECONDS)
-        step = get_step(get_phase(plan, phase_name), step_name)
-        log.info(
-            "Waiting for {} {}.{}.{} step:\n{}".format(
-                status, plan_name, phase_name, step_name, plan_string(plan_name, plan)
-            )
-        )
+
+    def check(plan):
+        step = progress.record(plan).get_step(phase_name, step_name)
         if step and step["status"] == status:
             return plan
         else:
             return False
 
-    return fn()
+    try:
+        return sdk_waiter.wait_for(
+            "{} {}.{}.{} step {}".format(service_name, plan_name, phase_name, step_name, status),
+            [sdk_waiter.plan_source(service_name, plan_name)],
+            check,
+            timeout_seconds,
+        )
+    except Exception:
+        progress.log_last_plan()
+        raise
 
 
 def recovery_plan_is_empty(service_name):
@@ -257,6 +431,8 @@ def get_child(parent, children_field, name):
 def plan_string(plan_name, plan):
     if plan is None:
         return "{}=NULL!".format(plan_name)
+    if isinstance(plan, Plan):
+        plan = plan.content
 
     def phase_string(phase):
         """ Formats the phase output as follows:
@@ -278,3 +454,182 @@ def plan_string(plan_name, plan):
     if plan.get("errors", []):
         plan_str += "\n- errors: {}".format(", ".join(plan["errors"]))
     return plan_str
+
+
+class Plan(object):
+    """A parsed snapshot of a plan, with constant-time lookup of its phases and steps.
+
+    Phases are indexed by name and by id, and steps are indexed by (phase name, step name) and by id.
+    The raw plan content is available as `content`. Two snapshots are equal when the statuses of the
+    plan and all of its phases and steps match, along with the plan's errors.
+    """
+
+    def __init__(self, name: str, content: dict) -> None:
+        self.name = name
+        self.content = content
+        self.status = content["status"]
+        self.errors = content.get("errors", [])
+        self.phases = collections.OrderedDict()
+        self.step_counts = collections.Counter()
+        self._phases_by_id = {}
+        self._steps = {}
+        self._steps_by_id = {}
+        # (phase name, step name) => status, for the plan (None, None) and its phases (name, None):
+        self._statuses = collections.OrderedDict([((None, None), self.status)])
+        for phase in content["phases"]:
+            phase_name = phase["name"]
+            self.phases[phase_name] = phase
+            self._phases_by_id[phase.get("id")] = phase
+            self._statuses[(phase_name, None)] = phase["status"]
+            for step in phase["steps"]:
+                key = (phase_name, step["name"])
+                self._steps[key] = step
+                self._steps_by_id[step.get("id")] = step
+                self._statuses[key] = step["status"]
+                self.step_counts[step["status"]] += 1
+
+    def get_phase(self, phase_name: str):
+        return self.phases.get(phase_name)
+
+    def get_phase_by_id(self, phase_id: str):
+        return self._phases_by_id.get(phase_id)
+
+    def get_step(self, phase_name: str, step_name: str):
+        return self._steps.get((phase_name, step_name))
+
+    def get_step_by_id(self, step_id: str):
+        return self._steps_by_id.get(step_id)
+
+    def diff(self, previous) -> list:
+        """Returns (path, previous status, current status) for each element of this plan whose status
+        differs from the provided previous snapshot, which may be None. Elements which are new
+        in this snapshot have a previous status of None."""
+        previous_statuses = previous._statuses if previous is not None else {}
+        return [
+            (self._path(key), previous_statuses.get(key), status)
+            for key, status in self._statuses.items()
+            if previous_statuses.get(key) != status
+        ]
+
+    def _path(self, key) -> str:
+        return "/".join([self.name] + [name for name in key if name is not None])
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Plan)
+            and self._statuses == other._statuses
+            and self.errors == other.errors
+        )
+
+    def __hash__(self):
+        return hash(tuple(self._statuses.items()))
+
+    def __str__(self):
+        return plan_string(self.name, self.content)
+
+
+def parse_plan(plan_name: str, plan):
+    """Returns a Plan for the provided plan content, or None if the plan is None. Plans with errors
+    as returned by get_plan_once() (HTTP 417 responses) are also accepted."""
+    if plan is None or isinstance(plan, Plan):
+        return plan
+    if not isinstance(plan, dict):
+        plan = plan.json()  # plan with errors (HTTP 417)
+    return Plan(plan_name, plan)
+
+
+class PlanTimeline(object):
+    """Records the times at which a plan and each of its phases and steps were first seen in each
+    status, across successive snapshots of the plan.
+
+    Elements are identified by their path within the plan, e.g. "deploy", "deploy/node-deploy", and
+    "deploy/node-deploy/node-0:[server]".
+    """
+
+    def __init__(self, service_name: str, plan_name: str, multiservice_name=None) -> None:
+        self.service_name = service_name
+        self.plan_name = plan_name
+        self.multiservice_name = multiservice_name
+        self.transition_count = 0
+        self._last_plan = None
+        self._times = collections.OrderedDict()
+
+    def update(self, plan) -> list:
+        """Records a snapshot of the plan, returning descriptions of any status transitions since
+        the previous snapshot."""
+        plan = parse_plan(self.plan_name, plan)
+        if plan is None or plan == self._last_plan:
+            return []
+        now = round(time.time(), 3)
+        transitions = []
+        for path, previous, status in plan.diff(self._last_plan):
+            self._times.setdefault(path, collections.OrderedDict()).setdefault(status, now)
+            transitions.append("{}: {} => {}".format(path, previous or "(new)", status))
+        self._last_plan = plan
+        self.transition_count += len(transitions)
+        return transitions
+
+    def to_dict(self) -> dict:
+        return {
+            "service": self.service_name,
+            "multiservice": self.multiservice_name,
+            "plan": self.plan_name,
+            "elements": self._times,
+        }
+
+
+# Timelines of the plans which have been waited on since the last reset, keyed by
+# (service_name, multiservice_name, plan_name). Timelines are kept across waits so that
+# e.g. a wait for a kicked off plan followed by a wait for its completion form a single timeline.
+_plan_timelines = collections.OrderedDict()
+_plan_timelines_lock = threading.Lock()
+
+
+def _get_plan_timeline(service_name, plan_name, multiservice_name=None) -> PlanTimeline:
+    key = (service_name, multiservice_name, plan_name)
+    with _plan_timelines_lock:
+        timeline = _plan_timelines.get(key)
+        if timeline is None:
+            timeline = PlanTimeline(service_name, plan_name, multiservice_name)
+            _plan_timelines[key] = timeline
+        return timeline
+
+
+def get_plan_timelines() -> list:
+    """Returns the timelines of all plans which were waited on since the last reset."""
+    with _plan_timelines_lock:
+        return [timeline.to_dict() for timeline in _plan_timelines.values()]
+
+
+def reset_plan_timelines() -> None:
+    with _plan_timelines_lock:
+        _plan_timelines.clear()
+
+
+class PlanProgressLogger(object):
+    """Logs the progress of a plan wait. The full plan is logged on the first poll, followed only by
+    the status transitions which were seen on later polls. If the wait fails, the last plan which
+    was seen is logged in full."""
+
+    def __init__(self, service_name, plan_name, multiservice_name, description: str) -> None:
+        self._timeline = _get_plan_timeline(service_name, plan_name, multiservice_name)
+        self._plan_name = plan_name
+        self._description = description
+        self._last_plan = None
+        self._polls = 0
+
+    def record(self, plan):
+        """Records a polled plan, returning it as a parsed Plan (or None if the plan is None)."""
+        plan = parse_plan(self._plan_name, plan)
+        transitions = self._timeline.update(plan)
+        if self._polls == 0:
+            log.info("%s:\n%s", self._description, plan_string(self._plan_name, plan))
+        elif transitions:
+            log.info("%s:\n- %s", self._description, "\n- ".join(transitions))
+        self._polls += 1
+        self._last_plan = plan
+        return plan
+
+    def log_last_plan(self) -> None:
+        if self._polls > 0:
+            log.info("%s failed, last plan:\n%s", self._description, self._last_plan)
@@ -7,11 +7,14 @@ SHOULD ALSO BE APPLIED TO sdk_tasks IN ANY OTHER PARTNER REPOS
 """
 import logging
 import retrying
+import threading
 
 import sdk_agents
 import sdk_cmd
+import sdk_events
 import sdk_package_registry
 import sdk_plan
+import sdk_waiter
 
 
 DEFAULT_TIMEOUT_SECONDS = 30 * 60
@@ -33,6 +36,12 @@ COMPLETED_TASK_STATES = set(
     ]
 )
 
+# How often the failure watcher refreshes the failure counts of watched services.
+FAILURE_WATCH_INTERVAL_SECONDS = 5
+
+# The number of tasks to request per /mesos/tasks query. This is also the endpoint's default limit.
+_TASKS_PAGE_SIZE = 100
+
 
 log = logging.getLogger(__name__)
 
@@ -41,12 +50,12 @@ def check_running(
     service_name, expected_task_count, timeout_seconds=DEFAULT_TIMEOUT_SECONDS, allow_more=True
 ):
     agentid_to_hostname = _get_agentid_to_hostname()
-
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+    interval = sdk_waiter.AdaptiveInterval(
+        "Wait for {} running tasks in {}".format(expected_task_count, service_name)
     )
-    def _check_running():
-        tasks = _get_service_tasks(service_name, agentid_to_hostname)
+
+    def _check_running(frameworks):
+        tasks = _get_service_tasks(service_name, agentid_to_hostname, frameworks=frameworks)
         running_task_names = []
         other_tasks = []
         for t in tasks:
@@ -54,6 +63,7 @@ def check_running(
                 running_task_names.append(t.name)
             else:
                 other_tasks.append("{}={}".format(t.name, t.state))
+        interval.observe(sorted((t.id, t.state) for t in tasks))
         log.info(
             "Waiting for {} {} running task{} in {}, got {} running/{} total:\n- running: [{}]\n- other: [{}]".format(
                 "at least" if allow_more else "exactly",
@@ -71,7 +81,19 @@ def check_running(
         else:
             return len(running_task_names) == expected_task_count
 
-    _check_running()
+    try:
+        sdk_waiter.wait_for(
+            "{} {} running tasks in {}".format(
+                "at least" if allow_more else "exactly", expected_task_count, service_name
+            ),
+            [sdk_waiter.tasks_source()],
+            _check_running,
+            timeout_seconds,
+            interval=interval,
+            events=sdk_events.mesos_wait(key=service_name),
+        )
+    finally:
+        interval.report()
 
 
 class Task(object):
@@ -113,16 +135,36 @@ class Task(object):
         )
 
 
-def get_all_status_history(task_name: str, with_completed_tasks=True) -> list:
+def get_all_status_history(task_name: str, with_completed_tasks=True, service_name=None) -> list:
     """Returns a list of task status values(of the form 'TASK_STARTING', 'TASK_KILLED', etc) for
     all instances of a given task. The returned values are ordered chronologically from first to
     last.
 
     : param task_name: The name of the task whose history should be retrieved.
     : param with_completed_tasks: Whether to include the status history of previous versions of the task which had since exited. Unlike with get_service_tasks(), this may include tasks from previous versions of the service.
+    : param service_name: If provided, only tasks of frameworks with this name are queried.
+
+    The current tasks of all frameworks are listed by a single query. When completed tasks are
+    included, they're paged from /mesos/tasks across all of the service's frameworks if a service
+    name is provided, or otherwise from only the most recent page of cluster tasks.
     """
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()["tasks"]
     statuses = []
+    if with_completed_tasks:
+        framework_ids = _get_framework_ids(service_name) if service_name else [None]
+        cluster_tasks = (
+            task
+            for framework_id in framework_ids
+            for task in iter_cluster_tasks(
+                framework_id=framework_id, max_pages=None if framework_id else 1
+            )
+        )
+    else:
+        cluster_tasks = (
+            task
+            for fwk in get_frameworks()
+            if not service_name or fwk["name"] == service_name
+            for task in fwk["tasks"]
+        )
     for cluster_task in cluster_tasks:
         if cluster_task["name"] != task_name:
             # Skip task: wrong name
@@ -140,12 +182,93 @@ def get_all_status_history(task_name: str, with_completed_tasks=True) -> list:
     return history
 
 
+def iter_cluster_tasks(framework_id=None, task_id=None, order="des", max_pages=None):
+    """Yields task entries from /mesos/tasks, including completed tasks, fetching one page at a
+    time so that callers may stop as soon as they've found what they need. By default, the most
+    recently launched tasks are returned first: `order` is passed to the master, which accepts "des"
+    or "asc". If `max_pages` is provided, at most that many pages are fetched.
+
+    Filtering by framework id and task id is done by the master where it supports doing so, and is
+    repeated here for masters which ignore these parameters.
+    """
+    params = {"limit": _TASKS_PAGE_SIZE, "order": order}
+    if framework_id:
+        params["framework_id"] = framework_id
+    if task_id:
+        params["task_id"] = task_id
+    offset = 0
+    pages = 0
+    seen_task_ids = set()
+    while max_pages is None or pages < max_pages:
+        pages += 1
+        params["offset"] = offset
+        page = sdk_cmd.cluster_request("GET", "/mesos/tasks", params=params).json()["tasks"]
+        for task in page:
+            # Tasks launched while paging shift older entries into the next page: skip repeats.
+            if task["id"] in seen_task_ids:
+                continue
+            seen_task_ids.add(task["id"])
+            if framework_id and task["framework_id"] != framework_id:
+                continue
+            if task_id and task["id"] != task_id:
+                continue
+            yield task
+        if len(page) < _TASKS_PAGE_SIZE:
+            return
+        offset += len(page)
+
+
+def _get_framework_ids(service_name: str, include_completed=True) -> list:
+    """Returns the ids of all current (and optionally completed) frameworks with the provided name."""
+    response = sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()
+    frameworks = response["frameworks"]
+    if include_completed:
+        frameworks = frameworks + response.get("completed_frameworks", [])
+    return [fwk["id"] for fwk in frameworks if fwk["name"] == service_name]
+
+
+def get_recent_tasks(known_task_ids: set, tracked_task_ids=(), max_new_tasks=None) -> list:
+    """Returns the tasks which were launched since `known_task_ids` were listed, newest first,
+    followed by the current state of any `tracked_task_ids` which weren't among them.
+
+    /mesos/tasks is paged newest first until a known task is reached, or until more than
+    `max_new_tasks` new tasks were found, so that the query scales with the number of new tasks
+    rather than with the cluster's history. Tracked tasks are looked up in /mesos/frameworks, which
+    lists the current and recently completed tasks of every framework.
+
+    Returns a list of Task objects.
+    """
+    cluster_tasks = []
+    for task in iter_cluster_tasks():
+        if task["id"] in known_task_ids:
+            break
+        cluster_tasks.append(task)
+        if max_new_tasks is not None and len(cluster_tasks) > max_new_tasks:
+            break
+    remaining_ids = set(tracked_task_ids).difference(task["id"] for task in cluster_tasks)
+    if remaining_ids:
+        for fwk in get_frameworks():
+            for task in fwk["tasks"] + fwk.get("completed_tasks", []):
+                if task["id"] in remaining_ids:
+                    cluster_tasks.append(task)
+                    remaining_ids.remove(task["id"])
+    agentid_to_hostname = _get_agentid_to_hostname()
+    return [Task.parse(entry, agentid_to_hostname) for entry in cluster_tasks]
+
+
 def get_failed_task_count(service_name: str, retry: bool = False) -> int:
+    return _count_failed_tasks(_get_task_history(retry), service_name)
+
+
+def _get_task_history(retry: bool = False) -> dict:
     history_response = sdk_cmd.cluster_request(
         "GET", "/dcos-history-service/history/last", retry=retry
     )
     history_response.raise_for_status()
-    history = history_response.json()
+    return history_response.json()
+
+
+def _count_failed_tasks(history: dict, service_name: str) -> int:
     service_history = [h for h in history["frameworks"] if h.get("name") == service_name]
     if not service_history:
         return 0
@@ -155,6 +278,92 @@ def get_failed_task_count(service_name: str, retry: bool = False) -> int:
     return sum(service_history[0].get(status, 0) for status in FATAL_TERMINAL_TASK_STATES)
 
 
+class FailureWatch(object):
+    """A service whose task failures are being tracked by the FailureWatcher, relative to the
+    failure count when the watch was started."""
+
+    def __init__(self, watcher, service_name: str, max_new_failures: int, initial_failures: int):
+        self.service_name = service_name
+        self.max_new_failures = max_new_failures
+        self.initial_failures = initial_failures
+        self.failures = initial_failures
+        self._watcher = watcher
+
+    def new_failures(self) -> int:
+        return self.failures - self.initial_failures
+
+    def exceeded(self) -> bool:
+        """Returns whether more than the allowed number of tasks have failed since the watch was
+        started, as of the watcher's latest refresh. This doesn't make any requests."""
+        return self.new_failures() > self.max_new_failures
+
+    def close(self) -> None:
+        self._watcher.unwatch(self)
+
+
+class FailureWatcher(object):
+    """Tracks the task failure counts of any number of services from a background thread.
+
+    While there are open watches, the thread refreshes the counts of all watched services with a
+    single fetch of the task history, at its own interval. Waits can then check their failure budget
+    on every poll without making any additional requests.
+    """
+
+    def __init__(self, interval_seconds=FAILURE_WATCH_INTERVAL_SECONDS) -> None:
+        self._interval_seconds = interval_seconds
+        self._cond = threading.Condition()
+        self._watches = []
+        self._thread = None
+
+    def watch(self, service_name: str, max_new_failures: int) -> FailureWatch:
+        """Starts tracking the failures of the specified service. The baseline failure count is
+        fetched immediately, so that failures which occurred before the watch was started aren't
+        counted against it. The returned watch must be closed once it's no longer needed."""
+        watch = FailureWatch(
+            self, service_name, max_new_failures, get_failed_task_count(service_name, retry=True)
+        )
+        with self._cond:
+            self._watches.append(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="failure-watcher", daemon=True
+                )
+                self._thread.start()
+        return watch
+
+    def unwatch(self, watch: FailureWatch) -> None:
+        with self._cond:
+            if watch in self._watches:
+                self._watches.remove(watch)
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._watches:
+                    self._thread = None
+                    return
+                self._cond.wait(self._interval_seconds)
+                watches = list(self._watches)
+            if not watches:
+                continue
+            try:
+                history = _get_task_history()
+            except Exception as e:
+                log.info("Failed to refresh task failure counts, will retry: {}".format(e))
+                continue
+            for watch in watches:
+                watch.failures = _count_failed_tasks(history, watch.service_name)
+
+
+_failure_watcher = FailureWatcher()
+
+
+def watch_failed_tasks(service_name: str, max_new_failures: int) -> FailureWatch:
+    """Starts tracking the failures of a service using the shared FailureWatcher."""
+    return _failure_watcher.watch(service_name, max_new_failures)
+
+
 def check_task_count(service_name: str, expected_task_count: int) -> list:
     """Verifies that the service contains exactly the expected number of tasks.
     Returns the task entries as produced by get_service_tasks().
@@ -193,15 +402,22 @@ def get_service_tasks(service_name: str, task_prefix="", with_completed_tasks=Fa
 
 
 def _get_service_tasks(
-    service_name: str, agentid_to_hostname: dict, task_prefix="", with_completed_tasks=False
+    service_name: str,
+    agentid_to_hostname: dict,
+    task_prefix="",
+    with_completed_tasks=False,
+    frameworks: list = None,
 ) -> list:
     """Returns a summary of all tasks in the specified Mesos framework.
+    If framework entries as returned by get_frameworks() are provided, they're used instead of
+    querying the master.
 
     Returns a list of Task objects.
     """
-    cluster_frameworks = sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
+    if frameworks is None:
+        frameworks = get_frameworks()
     service_tasks = []
-    for fwk in cluster_frameworks:
+    for fwk in frameworks:
         if not fwk["name"] == service_name or not fwk["active"]:
             continue
         service_tasks += [Task.parse(entry, agentid_to_hostname) for entry in fwk["tasks"]]
@@ -214,13 +430,83 @@ def _get_service_tasks(
     return service_tasks
 
 
-def get_summary(with_completed=False, task_name=None) -> list:
+def get_frameworks(subscriber: sdk_events.MesosEventSubscriber = None, retry=True) -> list:
+    """Returns all frameworks known to the master along with their tasks, in the form returned by
+    /mesos/frameworks. If a connected event subscriber is provided, its task table is used instead
+    of querying the master."""
+    if subscriber is not None and subscriber.is_connected():
+        return _get_frameworks_from_events(subscriber)
+    return sdk_cmd.cluster_request("GET", "/mesos/frameworks", retry=retry).json()["frameworks"]
+
+
+def _get_frameworks_from_events(subscriber: sdk_events.MesosEventSubscriber) -> list:
+    """Returns framework entries in the form returned by /mesos/frameworks, built from the task
+    table of the provided event subscriber."""
+    frameworks = {}
+    for framework in subscriber.get_frameworks():
+        frameworks[framework["id"]] = dict(framework, tasks=[], completed_tasks=[])
+    for task in subscriber.get_tasks():
+        framework = frameworks.get(task["framework_id"])
+        if framework is None:
+            continue
+        if task["state"] in COMPLETED_TASK_STATES:
+            framework["completed_tasks"].append(task)
+        else:
+            framework["tasks"].append(task)
+    return list(frameworks.values())
+
+
+def get_summary(with_completed=False, task_name=None, service_name=None) -> list:
     """Returns a summary of all cluster tasks in the cluster, or just a specified task.
     This may be used instead of invoking 'dcos task [--all]' directly.
 
+    : param service_name: If provided, only tasks of (current or past) frameworks with this name are
+                          queried.
+
+    The current tasks of all frameworks are listed by a single query. When completed tasks are
+    included, they're paged from /mesos/tasks across all of the service's frameworks if a service
+    name is provided, or otherwise from only the most recent page of cluster tasks.
+
     Returns a list of Task objects.
     """
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()["tasks"]
+    framework_ids = (
+        _get_framework_ids(service_name, include_completed=with_completed) if service_name else None
+    )
+    return _get_summary(with_completed, task_name, framework_ids=framework_ids)
+
+
+def _get_summary(
+    with_completed=False,
+    task_name=None,
+    events: sdk_events.EventWait = None,
+    framework_ids=None,
+    until_task_id=None,
+) -> list:
+    """See get_summary(). Additional arguments:
+
+    : param events: If connected, the event stream's task table is used instead of querying the master.
+    : param framework_ids: Only query tasks of these frameworks.
+    : param until_task_id: Stop querying once this task is found, skipping any older tasks.
+    """
+    if events is not None and events.connected():
+        cluster_tasks = events.subscriber.get_tasks()
+    elif not with_completed:
+        cluster_tasks = [
+            task
+            for fwk in get_frameworks()
+            if framework_ids is None or fwk["id"] in framework_ids
+            for task in fwk["tasks"]
+        ]
+    else:
+        cluster_tasks = []
+        for framework_id in framework_ids if framework_ids is not None else [None]:
+            # Without a framework to scope the query, only the most recent tasks are listed.
+            for task in iter_cluster_tasks(
+                framework_id=framework_id, max_pages=None if framework_id else 1
+            ):
+                cluster_tasks.append(task)
+                if task["id"] == until_task_id:
+                    break
     agentid_to_hostname = _get_agentid_to_hostname()
     all_tasks = [Task.parse(entry, agentid_to_hostname) for entry in cluster_tasks]
     output = (
@@ -254,7 +540,7 @@ def get_tasks_avoiding_scheduler(service_name, task_name_pattern) -> list:
     skip_tasks = {sdk_package_registry.PACKAGE_REGISTRY_SERVICE_NAME}
     server_tasks = [
         task
-        for task in get_summary()
+        for task in get_summary(service_name=service_name)
         if task.name not in skip_tasks and task_name_pattern.match(task.name)
     ]
 
@@ -303,13 +589,25 @@ def check_task_relaunched(
         )
     )
 
+    # The replacement is launched by the same framework as the old task, and after it. Only query
+    # that framework's tasks, and stop at the old task. Otherwise only recent tasks are queried.
+    framework_ids = _find_task_framework_ids(old_task_id)
+    events = sdk_events.mesos_wait()
+
     @retrying.retry(
-        wait_fixed=1000,
+        wait_func=events,
         stop_max_delay=timeout_seconds * 1000,
         retry_on_exception=lambda e: isinstance(e, Exception),
     )
     def _check_task_relaunched():
-        tasks = get_summary(with_completed=True, task_name=task_name)
+        events.mark()
+        tasks = _get_summary(
+            with_completed=True,
+            task_name=task_name,
+            events=events,
+            framework_ids=framework_ids,
+            until_task_id=old_task_id,
+        )
         assert len(tasks) > 0, "No tasks were found with the given task name {}".format(task_name)
         assert (
             len(list(filter(lambda t: t.is_completed and t.id == old_task_id, tasks))) > 0
@@ -332,6 +630,17 @@ def check_task_relaunched(
     _check_task_relaunched()
 
 
+def _find_task_framework_ids(task_id: str):
+    """Returns a list with the id of the framework which launched the specified task, or None if the
+    task isn't current or recently completed, or among the most recent cluster tasks."""
+    for fwk in get_frameworks():
+        for task in fwk["tasks"] + fwk.get("completed_tasks", []):
+            if task["id"] == task_id:
+                return [fwk["id"]]
+    task = next(iter_cluster_tasks(task_id=task_id, max_pages=1), None)
+    return [task["framework_id"]] if task else None
+
+
 def check_scheduler_relaunched(
     service_name: str, old_scheduler_task_id: str, timeout_seconds=DEFAULT_TIMEOUT_SECONDS
 ):
@@ -362,7 +671,13 @@ def check_task_not_relaunched(
     sdk_plan.wait_for_completed_deployment(service_name, multiservice_name=multiservice_name)
     sdk_plan.wait_for_completed_recovery(service_name, multiservice_name=multiservice_name)
 
-    task_ids = set([t.id for t in get_summary(with_completed) if t.name == task_name])
+    task_ids = set(
+        [
+            t.id
+            for t in get_summary(with_completed, service_name=service_name)
+            if t.name == task_name
+        ]
+    )
     assert old_task_id in task_ids, "Old task id {} was not found in task_ids {}".format(
         old_task_id, task_ids
     )
@@ -378,11 +693,15 @@ def check_tasks_updated(
     if prefix:
         prefix_clause = ' starting with "{}"'.format(prefix)
 
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
-    )
-    def _check_tasks_updated():
-        task_ids = get_task_ids(service_name, prefix)
+    agentid_to_hostname = _get_agentid_to_hostname()
+
+    def _check_tasks_updated(frameworks):
+        task_ids = [
+            t.id
+            for t in _get_service_tasks(
+                service_name, agentid_to_hostname, task_prefix=prefix, frameworks=frameworks
+            )
+        ]
 
         old_set = set(old_task_ids)
         new_set = set(task_ids)
@@ -420,7 +739,13 @@ def check_tasks_updated(
     log.info(
         "Waiting for tasks%s to have updated ids:\n" "- Old tasks: %s", prefix_clause, old_task_ids
     )
-    _check_tasks_updated()
+    sdk_waiter.wait_for(
+        "tasks{} in {} to have updated ids".format(prefix_clause, service_name),
+        [sdk_waiter.tasks_source()],
+        _check_tasks_updated,
+        timeout_seconds,
+        events=sdk_events.mesos_wait(key=service_name),
+    )
 
 
 def check_tasks_not_updated(service_name, prefix, old_task_ids):
@@ -441,13 +766,10 @@ def wait_for_active_framework(service_name, timeout_seconds=DEFAULT_TIMEOUT_SECO
     Waits until a framework with name `framework_name` is found and is active
     """
     log.info("Waiting until [{}] is active".format(service_name))
-
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+    sdk_waiter.wait_for(
+        "{} framework to be active".format(service_name),
+        [sdk_waiter.tasks_source()],
+        lambda frameworks: any(fwk["name"] == service_name and fwk["active"] for fwk in frameworks),
+        timeout_seconds,
+        events=sdk_events.mesos_wait(key=service_name),
     )
-    def _wait_for_active_framework():
-        return len(list(filter(
-            lambda fwk: fwk["name"] == service_name and fwk["active"],
-            sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
-        ))) > 0
-    _wait_for_active_framework()
@@ -16,6 +16,7 @@ import sdk_plan
 import sdk_repository
 import sdk_tasks
 import sdk_utils
+import sdk_waiter
 
 log = logging.getLogger(__name__)
 
@@ -118,22 +119,39 @@ def soak_upgrade_downgrade(
     )
 
 
-@retrying.retry(
-    stop_max_attempt_number=15, wait_fixed=10000, retry_on_result=lambda result: result is None
-)
 def get_config(package_name, service_name):
     """Return the active config for the current service.
-    This is retried 15 times, waiting 10s between retries."""
+    This is retried for up to 140s, the time spent waiting between the 15 attempts which were made
+    before, starting with quick retries while the output is changing and backing off to 10s between
+    retries."""
+    interval = sdk_waiter.AdaptiveInterval(
+        "Fetch target config for {}".format(service_name),
+        min_interval_ms=250,
+        max_interval_ms=10000,
+        fast_window_seconds=2,
+    )
+
+    @retrying.retry(
+        stop_max_delay=14 * 10000, wait_func=interval, retry_on_result=lambda result: result is None
+    )
+    def _get_config():
+        try:
+            # Refrain from dumping the full ServiceSpec to stdout
+            rc, stdout, _ = sdk_cmd.svc_cli(
+                package_name, service_name, "debug config target", print_output=False
+            )
+            # A change in the output, e.g. from one error to another, restarts the quick retries:
+            interval.observe((rc, stdout))
+            assert rc == 0, "Target config fetch failed"
+            return json.loads(stdout)
+        except Exception as e:
+            log.error("Could not determine target config: %s", str(e))
+            return None
+
     try:
-        # Refrain from dumping the full ServiceSpec to stdout
-        rc, stdout, _ = sdk_cmd.svc_cli(
-            package_name, service_name, "debug config target", print_output=False
-        )
-        assert rc == 0, "Target config fetch failed"
-        return json.loads(stdout)
-    except Exception as e:
-        log.error("Could not determine target config: %s", str(e))
-        return None
+        return _get_config()
+    finally:
+        interval.report()
 
 
 def update_or_upgrade_or_downgrade(
@@ -5,18 +5,26 @@ SHOULD ALSO BE APPLIED TO sdk_utils IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
 import collections
+import concurrent.futures
 import functools
+import gzip
 import logging
 import os
 import os.path
 import pytest
 import random
 import string
+import time
 
 import sdk_cmd
 
 from distutils.version import LooseVersion
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd compression is unavailable, see resolve_compression()
+
 log = logging.getLogger(__name__)
 
 
@@ -190,3 +198,177 @@ def merge_dictionaries(dict1, dict2):
         else:
             ret[k] = dict2[k]
     return ret
+
+
+###
+# Concurrency
+###
+
+# The default number of concurrent operations in run_concurrently(), e.g. concurrent installs.
+DEFAULT_CONCURRENCY = 4
+
+
+class ConcurrentTasksException(Exception):
+    """Thrown by run_concurrently() once all tasks have finished, if any of them failed."""
+
+    def __init__(self, description: str, errors: dict) -> None:
+        super().__init__(
+            "{} failed for {} of its tasks: {}".format(
+                description,
+                len(errors),
+                ", ".join("{}: {}".format(name, e) for name, e in errors.items()),
+            )
+        )
+        self.errors = errors
+
+
+def run_concurrently(description: str, tasks: dict, max_workers: int = DEFAULT_CONCURRENCY) -> dict:
+    """Runs the provided callables in a bounded thread pool and waits for all of them to finish,
+    even if some of them fail. A combined timing report is logged at the end.
+
+    : param description: A description of the overall operation, for logging.
+    : param tasks: Callables which take no arguments, keyed by a unique name for each task.
+    : param max_workers: The maximum number of tasks to run at the same time.
+    : return: The results of the callables, keyed by task name.
+    : raises ConcurrentTasksException: If any of the tasks failed, with the errors by task name.
+    """
+    start = time.time()
+    durations = {}
+
+    def timed(name, fn):
+        task_start = time.time()
+        try:
+            return fn()
+        finally:
+            durations[name] = time.time() - task_start
+
+    results = collections.OrderedDict()
+    errors = collections.OrderedDict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [(name, executor.submit(timed, name, fn)) for name, fn in tasks.items()]
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                log.exception("{}: {} failed".format(description, name))
+                errors[name] = e
+
+    total = time.time() - start
+    log.info(
+        "{} finished after {} (sum of task durations: {}):\n{}".format(
+            description,
+            pretty_duration(total),
+            pretty_duration(sum(durations.values())),
+            "\n".join(
+                "- {}: {} after {}".format(
+                    name,
+                    "FAILED" if name in errors else "succeeded",
+                    pretty_duration(durations[name]),
+                )
+                for name in tasks.keys()
+            ),
+        )
+    )
+    if errors:
+        raise ConcurrentTasksException(description, errors)
+    return results
+
+
+###
+# Compressed downloads
+###
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+
+_COMPRESSION_SUFFIXES = {COMPRESSION_NONE: "", COMPRESSION_GZIP: ".gz", COMPRESSION_ZSTD: ".zst"}
+
+# Compression levels which favor throughput: downloaded logs are highly compressible, so higher
+# levels save little additional space while making compression the bottleneck of the download.
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+
+# Bounds of the chunk size used when streaming a download to disk, see adaptive_chunk_size().
+MIN_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def resolve_compression(compression: str) -> str:
+    """Returns the provided compression mode if it's available, or the closest available mode.
+    zstd requires the optional 'zstandard' module, and falls back to gzip when it's missing."""
+    compression = (compression or COMPRESSION_NONE).lower()
+    if compression not in _COMPRESSION_SUFFIXES:
+        raise ValueError(
+            "Unsupported compression '{}', expected one of: {}".format(
+                compression, ", ".join(_COMPRESSION_SUFFIXES.keys())
+            )
+        )
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        log.warning("zstd compression requires the 'zstandard' module, using gzip instead")
+        return COMPRESSION_GZIP
+    return compression
+
+
+def compression_suffix(compression: str) -> str:
+    """Returns the file suffix for the compression mode, e.g. '.gz' for gzip."""
+    return _COMPRESSION_SUFFIXES[compression]
+
+
+def open_compressed(path: str, compression: str, mode: str = "wb"):
+    """Opens a binary file for writing, which compresses everything written to it.
+
+    Appending with mode 'ab' adds a new gzip member or zstd frame to the end of the file. The result
+    is still a valid file, and decompresses to the concatenation of all the written content.
+    """
+    if compression == COMPRESSION_GZIP:
+        return gzip.open(path, mode, compresslevel=GZIP_COMPRESSION_LEVEL)
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).stream_writer(
+            open(path, mode)
+        )
+    return open(path, mode)
+
+
+def adaptive_chunk_size(content_length=None) -> int:
+    """Returns the chunk size for streaming a download of the provided length. Small downloads use
+    the minimum size, while large ones use larger chunks to reduce the per-chunk overhead, up to
+    the maximum size. Downloads of unknown length use the minimum size."""
+    try:
+        content_length = int(content_length)
+    except (TypeError, ValueError):
+        return MIN_DOWNLOAD_CHUNK_SIZE
+    return max(MIN_DOWNLOAD_CHUNK_SIZE, min(MAX_DOWNLOAD_CHUNK_SIZE, content_length // 16))
+
+
+def write_response(
+    response,
+    path: str,
+    compression: str = COMPRESSION_NONE,
+    mode="wb",
+    chunk_size=None,
+    max_bytes=None,
+) -> int:
+    """Writes the content of a streamed response to the provided path, compressing it on the fly.
+    The caller is responsible for adding the compression_suffix() to the path.
+
+    : param response: A response from a request which was made with stream=True.
+    : param path: The file to write, or to append to if the mode is 'ab'.
+    : param compression: One of the COMPRESSION_* modes, see resolve_compression().
+    : param chunk_size: The chunk size to read the response with, or None for adaptive_chunk_size().
+    : param max_bytes: The number of bytes after which the rest of the response is dropped, or None.
+    : return: The number of bytes which were downloaded, before compression.
+    """
+    if chunk_size is None:
+        chunk_size = adaptive_chunk_size(response.headers.get("Content-Length"))
+    byte_count = 0
+    with open_compressed(path, compression, mode) as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if max_bytes is not None:
+                chunk = chunk[: max_bytes - byte_count]
+            f.write(chunk)
+            byte_count += len(chunk)
+            if max_bytes is not None and byte_count >= max_bytes:
+                response.close()
+                break
+    return byte_count
@@ -0,0 +1,482 @@
+"""Utilities relating to waiting on conditions over shared cluster state, such that concurrent waits
+don't each poll the same endpoints.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_waiter IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import functools
+import logging
+import threading
+import time
+
+import sdk_cmd
+import sdk_events
+import sdk_plan
+import sdk_tasks
+import sdk_utils
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 1
+DEFAULT_TIMEOUT_SECONDS = 15 * 60
+
+# How long join() waits past a waiter's deadline for an evaluation which is still in progress, e.g.
+# a slow fetch, before giving up on the waiter.
+JOIN_GRACE_SECONDS = 60
+
+
+class WaitTimeoutException(Exception):
+    pass
+
+
+class AdaptiveInterval(object):
+    """A `wait_func` for retrying loops which polls quickly for a short window after the observed
+    state has changed, and then backs off exponentially while nothing is happening.
+
+    Checks should pass a comparable summary of the state they fetched to observe(). The start of
+    the wait counts as a change, since waits usually follow an action which is expected to have an
+    effect soon. Call report() once the wait has finished to log its request count and detection
+    latency, where the detection latency of a change is bounded by the interval which preceded the
+    poll that observed it.
+    """
+
+    def __init__(
+        self,
+        description: str,
+        min_interval_ms=250,
+        max_interval_ms=5000,
+        fast_window_seconds=10,
+        backoff_factor=1.5,
+    ) -> None:
+        self._description = description
+        self._min_interval_ms = min_interval_ms
+        self._max_interval_ms = max_interval_ms
+        self._fast_window_seconds = fast_window_seconds
+        self._backoff_factor = backoff_factor
+        self._start = time.time()
+        self._last_change = self._start
+        self._last_state = None
+        self._interval_ms = min_interval_ms
+        self._requests = 0
+        self._changes = 0
+        self._max_detection_latency_ms = 0
+
+    def observe(self, state=None) -> None:
+        """Records a poll which fetched the provided state."""
+        self._requests += 1
+        if self._requests > 1 and state != self._last_state:
+            self._changes += 1
+            self._last_change = time.time()
+            self._max_detection_latency_ms = max(self._max_detection_latency_ms, self._interval_ms)
+        self._last_state = state
+
+    def __call__(self, attempt_number: int, delay_since_first_attempt_ms: int) -> int:
+        if time.time() - self._last_change < self._fast_window_seconds:
+            self._interval_ms = self._min_interval_ms
+        else:
+            self._interval_ms = min(
+                int(self._interval_ms * self._backoff_factor), self._max_interval_ms
+            )
+        return self._interval_ms
+
+    def report(self) -> dict:
+        """Logs and returns the statistics for this wait. The final poll is treated as a detected
+        change, since it's the one which found the awaited condition."""
+        stats = {
+            "description": self._description,
+            "duration_seconds": time.time() - self._start,
+            "requests": self._requests,
+            "changes": self._changes,
+            "max_detection_latency_ms": max(self._max_detection_latency_ms, self._interval_ms),
+        }
+        log.info(
+            "{}: {} requests over {}, {} state changes, detection latency <= {}ms".format(
+                self._description,
+                stats["requests"],
+                sdk_utils.pretty_duration(stats["duration_seconds"]),
+                stats["changes"],
+                stats["max_detection_latency_ms"],
+            )
+        )
+        return stats
+
+
+class Source(object):
+    """A named piece of cluster state. Sources with the same name are considered identical, and are
+    fetched at most once per tick regardless of how many waiters depend on them.
+
+    When an optional source fails to be fetched, its waiters are evaluated with None for its data.
+    Otherwise its waiters aren't evaluated on that tick."""
+
+    def __init__(self, name: str, fetch, optional=False) -> None:
+        self.name = name
+        self.fetch = fetch
+        self.optional = optional
+
+    def __repr__(self):
+        return "Source[{}{}]".format(self.name, "?" if self.optional else "")
+
+
+def optional_source(source: Source) -> Source:
+    """Wraps a source such that fetch failures produce None rather than blocking the evaluation of
+    its waiters, e.g. for an endpoint which is expected to be unavailable for some time."""
+    return Source(source.name, source.fetch, optional=True)
+
+
+def tasks_source() -> Source:
+    """All frameworks and their tasks, as returned by /mesos/frameworks. While the Mesos event
+    stream is connected, its task table is used instead of querying the master."""
+    return Source(
+        "tasks",
+        lambda: sdk_tasks.get_frameworks(sdk_events.get_mesos_subscriber(), retry=False),
+    )
+
+
+def plan_source(service_name: str, plan_name: str, multiservice_name=None) -> Source:
+    """The content of a service plan, as returned by sdk_plan.get_plan_once(): Plans with errors
+    are returned as the HTTP 417 response."""
+    return Source(
+        "plan:{}:{}:{}".format(service_name, multiservice_name or "", plan_name),
+        lambda: sdk_plan.get_plan_once(service_name, plan_name, multiservice_name),
+    )
+
+
+def app_source(app_id: str) -> Source:
+    """The Marathon app definition and status, or None if the app doesn't exist."""
+
+    def fetch():
+        response = sdk_cmd.cluster_request(
+            "GET",
+            "/marathon/v2/apps/{}".format(app_id.lstrip("/")),
+            retry=False,
+            raise_on_error=False,
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()["app"]
+
+    return Source("app:/{}".format(app_id.lstrip("/")), fetch)
+
+
+def job_source(job_name: str) -> Source:
+    """The Metronome job definition along with its run history."""
+    return Source(
+        "job:{}".format(job_name),
+        lambda: sdk_cmd.service_request(
+            "GET",
+            "metronome",
+            "/v1/jobs/{}".format(job_name),
+            retry=False,
+            params={"embed": "history"},
+        ).json(),
+    )
+
+
+class _Waiter(object):
+    def __init__(
+        self, description: str, sources: list, predicate, timeout_seconds: int, interval, events
+    ) -> None:
+        self.description = description
+        self.sources = sources
+        self.predicate = predicate
+        self.interval = interval
+        self.events = events
+        self.start = time.time()
+        self.deadline = self.start + timeout_seconds
+        # The time of the next evaluation, and whether an event requested an earlier one. Both are
+        # only accessed while holding the engine's lock.
+        self.next_due = self.start
+        self.woken = False
+        self.evaluations = 0
+        self.last_error = None
+        self.result = None
+        self.exception = None
+        self.finish = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def follows(self, subscriber, keys) -> bool:
+        """Returns whether this waiter should be woken by a change to `keys` reported by
+        `subscriber`, where keys of None indicate a connection change."""
+        if self.events is None or self.events.subscriber is not subscriber:
+            return False
+        return keys is None or self.events.key is None or self.events.key in keys
+
+    def get_delay_seconds(self, default_interval_seconds: float) -> float:
+        """Returns the delay until the next evaluation, given the evaluations made so far."""
+        if self.events is not None and self.events.connected():
+            # Events wake the waiter as needed: Only re-check as a safety net.
+            return sdk_events.CONNECTED_POLL_INTERVAL_SECONDS
+        if self.interval is None:
+            return default_interval_seconds
+        if callable(self.interval):
+            elapsed_ms = int((time.time() - self.start) * 1000)
+            return self.interval(self.evaluations, elapsed_ms) / 1000.0
+        return self.interval / 1000.0
+
+    def complete(self, result=None, exception=None) -> None:
+        """Finishes the waiter, unless it has already finished, e.g. as join() gave up on it."""
+        with self._lock:
+            if self.done.is_set():
+                return
+            self.result = result
+            self.exception = exception
+            self.finish = time.time()
+            self.done.set()
+
+    def report(self) -> dict:
+        return {
+            "description": self.description,
+            "sources": [s.name for s in self.sources],
+            "succeeded": self.done.is_set() and self.exception is None,
+            "duration_seconds": (self.finish or time.time()) - self.start,
+            "evaluations": self.evaluations,
+        }
+
+
+class WaitEngine(object):
+    """Evaluates the conditions of any number of concurrent waiters against shared sources.
+
+    A background thread runs while there are waiters. Each waiter is evaluated on its own schedule:
+    at a fixed or adaptive interval, or as soon as a relevant change is reported by an event stream.
+    On every tick, each source which is needed by at least one due waiter is fetched once, and then
+    the predicates of the due waiters are evaluated against the fetched data. Failed fetches are
+    retried on the waiter's next evaluation, while exceptions thrown by predicates are passed on to
+    the waiting caller. If the thread itself fails, all of its waiters fail with the error, and the
+    next waiter starts a new thread.
+    """
+
+    def __init__(self, interval_seconds=DEFAULT_INTERVAL_SECONDS) -> None:
+        self._interval_seconds = interval_seconds
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._thread = None
+        self._subscribers = []
+        self._fetch_counts = {}
+        self._reports = []
+
+    def wait(
+        self,
+        description: str,
+        sources: list,
+        predicate,
+        timeout_seconds: int,
+        interval=None,
+        events=None,
+    ):
+        """Blocks until `predicate` returns a truthy value, which is then returned.
+
+        : param description: A description of the condition, for logging.
+        : param sources: The Source objects whose data should be passed to the predicate.
+        : param predicate: Invoked with the data of each source, in the same order as `sources`.
+        : param timeout_seconds: Duration after which WaitTimeoutException is raised.
+        : param interval: Delay between evaluations in milliseconds, or a non-blocking `wait_func`
+                          such as an AdaptiveInterval. Defaults to the engine's interval.
+        : param events: An sdk_events.EventWait whose subscriber wakes the waiter on relevant
+                        changes. While it's connected, `interval` is only used as a fallback.
+        """
+        return self.join(
+            self.start(description, sources, predicate, timeout_seconds, interval, events)
+        )
+
+    def start(
+        self,
+        description: str,
+        sources: list,
+        predicate,
+        timeout_seconds: int,
+        interval=None,
+        events=None,
+    ):
+        """Registers a waiter without blocking, for callers which wait on several conditions at
+        once. The returned waiter must be passed to join(). See wait() for the arguments."""
+        waiter = _Waiter(description, sources, predicate, timeout_seconds, interval, events)
+        if events is not None and events.subscriber is not None:
+            self._listen(events.subscriber)
+        log.info("Waiting for {} (sources: {})".format(description, [s.name for s in sources]))
+        with self._cond:
+            self._waiters.append(waiter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wait-engine", daemon=True)
+                self._thread.start()
+            # Evaluate the new waiter immediately rather than on the next scheduled tick.
+            self._cond.notify_all()
+        return waiter
+
+    def join(self, waiter):
+        """Blocks until a waiter returned by start() has finished, returning its result or raising
+        its exception."""
+        if not waiter.done.wait(max(0, waiter.deadline - time.time()) + JOIN_GRACE_SECONDS):
+            waiter.complete(
+                exception=WaitTimeoutException(
+                    "Gave up after {} waiting for {}: still evaluating past the deadline".format(
+                        sdk_utils.pretty_duration(time.time() - waiter.start), waiter.description
+                    )
+                )
+            )
+        report = waiter.report()
+        with self._cond:
+            self._reports.append(report)
+        log.info(
+            "Wait for {} {} after {} ({} evaluations)".format(
+                waiter.description,
+                "succeeded" if report["succeeded"] else "failed",
+                sdk_utils.pretty_duration(report["duration_seconds"]),
+                report["evaluations"],
+            )
+        )
+        if waiter.exception is not None:
+            raise waiter.exception
+        return waiter.result
+
+    def get_reports(self) -> list:
+        """Returns the latency reports of all completed waits, in completion order."""
+        with self._cond:
+            return list(self._reports)
+
+    def get_fetch_counts(self) -> dict:
+        """Returns the number of fetches which have been made for each source name."""
+        with self._cond:
+            return dict(self._fetch_counts)
+
+    def _listen(self, subscriber) -> None:
+        with self._cond:
+            if subscriber in self._subscribers:
+                return
+            self._subscribers.append(subscriber)
+        # Not registered while holding our lock: The subscriber invokes the callback with its own
+        # lock held.
+        subscriber.add_listener(functools.partial(self._on_event, subscriber))
+
+    def _on_event(self, subscriber, keys) -> None:
+        with self._cond:
+            woken = False
+            for waiter in self._waiters:
+                if waiter.follows(subscriber, keys):
+                    waiter.woken = True
+                    woken = True
+            if woken:
+                self._cond.notify_all()
+
+    def _run(self) -> None:
+        try:
+            self._loop()
+        except Exception as e:
+            log.exception("Wait engine failed, failing all pending waits")
+            with self._cond:
+                waiters = self._waiters
+                self._waiters = []
+                self._thread = None
+            for waiter in waiters:
+                waiter.complete(exception=e)
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                self._waiters = [w for w in self._waiters if not w.done.is_set()]
+                if not self._waiters:
+                    self._thread = None
+                    return
+                now = time.time()
+                due = [w for w in self._waiters if w.woken or w.next_due <= now]
+                if not due:
+                    self._cond.wait(min(w.next_due for w in self._waiters) - now)
+                    continue
+                for waiter in due:
+                    waiter.woken = False
+            self._tick(due)
+
+    def _tick(self, waiters: list) -> None:
+        # Re-arm any event waits before fetching, so that changes which arrive during the fetch
+        # aren't missed:
+        for waiter in waiters:
+            if waiter.events is not None:
+                waiter.events.mark()
+
+        # Fetch each source which is needed by at least one waiter, exactly once:
+        sources = {}
+        for waiter in waiters:
+            for source in waiter.sources:
+                sources.setdefault(source.name, source)
+        data = {}
+        errors = {}
+        for name, source in sources.items():
+            try:
+                data[name] = source.fetch()
+            except Exception as e:
+                log.debug("Failed to fetch {}: {}".format(name, e))
+                data[name] = None
+                errors[name] = e
+            with self._cond:
+                self._fetch_counts[name] = self._fetch_counts.get(name, 0) + 1
+
+        for waiter in waiters:
+            try:
+                self._evaluate(waiter, data, errors)
+            except Exception as e:
+                log.exception("Failed to evaluate wait for {}".format(waiter.description))
+                waiter.complete(exception=e)
+
+    def _evaluate(self, waiter, data: dict, errors: dict) -> None:
+        """Evaluates a due waiter against the fetched data, and either completes it or schedules its
+        next evaluation."""
+        now = time.time()
+        failed = [s.name for s in waiter.sources if s.name in errors and not s.optional]
+        if failed:
+            waiter.last_error = "{}: {}".format(failed[0], errors[failed[0]])
+        else:
+            waiter.evaluations += 1
+            try:
+                result = waiter.predicate(*[data[s.name] for s in waiter.sources])
+            except Exception as e:
+                waiter.complete(exception=e)
+                return
+            if result:
+                waiter.complete(result=result)
+                return
+        if now >= waiter.deadline:
+            waiter.complete(
+                exception=WaitTimeoutException(
+                    "Timed out after {} waiting for {}{}".format(
+                        sdk_utils.pretty_duration(now - waiter.start),
+                        waiter.description,
+                        (
+                            " (last error: {})".format(waiter.last_error)
+                            if waiter.last_error
+                            else ""
+                        ),
+                    )
+                )
+            )
+            return
+        delay = waiter.get_delay_seconds(self._interval_seconds)
+        with self._cond:
+            waiter.next_due = min(time.time() + delay, waiter.deadline)
+
+_engine = WaitEngine()
+
+
+def get_engine() -> WaitEngine:
+    """Returns the engine shared by all waits in this session."""
+    return _engine
+
+
+def wait_for(
+    description: str, sources: list, predicate, timeout_seconds: int, interval=None, events=None
+):
+    """Waits for a condition using the shared engine. See WaitEngine.wait()."""
+    return _engine.wait(description, sources, predicate, timeout_seconds, interval, events)
+
+
+def running_task_names(frameworks: list, service_name: str) -> list:
+    """Returns the names of the running tasks of an active framework, given tasks_source() data."""
+    return [
+        task["name"]
+        for fwk in frameworks
+        if fwk["name"] == service_name and fwk["active"]
+        for task in fwk["tasks"]
+        if task["state"] == "TASK_RUNNING"
+    ]
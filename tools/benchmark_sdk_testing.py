@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#
+# Microbenchmarks for the helpers in testing/, using synthetic data in place of a cluster.
+#
+# Usage: ./benchmark_sdk_testing.py <benchmark> [options]
+# Run with --help for the list of benchmarks and their options.
+#
+
+import argparse
+import copy
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "testing"))
+
+import sdk_diag  # noqa: E402
+import sdk_plan  # noqa: E402
+import sdk_utils  # noqa: E402
+
+
+def synthetic_plan(phase_count, steps_per_phase, status="PENDING"):
+    return {
+        "status": status,
+        "errors": [],
+        "phases": [
+            {
+                "id": "phase-{}-id".format(p),
+                "name": "phase-{}".format(p),
+                "status": status,
+                "steps": [
+                    {
+                        "id": "step-{}-{}-id".format(p, s),
+                        "name": "pod-{}:[server]".format(p * steps_per_phase + s),
+                        "status": status,
+                        "message": "",
+                    }
+                    for s in range(steps_per_phase)
+                ],
+            }
+            for p in range(phase_count)
+        ],
+    }
+
+
+def report(name, iterations, seconds):
+    print("{:<50} {:>10.3f} ms/op".format(name, 1000 * seconds / iterations))
+
+
+def benchmark_plan(args):
+    steps_per_phase = args.steps // args.phases
+    plan = synthetic_plan(args.phases, steps_per_phase)
+    updated = copy.deepcopy(plan)
+    updated["phases"][-1]["steps"][-1]["status"] = "COMPLETE"
+    lookups = [(phase["name"], step["name"]) for phase in plan["phases"] for step in phase["steps"]]
+    print(
+        "Plan with {} phases of {} steps, {} iterations:".format(
+            args.phases, steps_per_phase, args.iterations
+        )
+    )
+
+    def time_op(name, fn):
+        report(name, args.iterations, timeit.timeit(fn, number=args.iterations))
+
+    # Per-poll costs: Previously each poll rendered the full plan, and located the awaited element
+    # by scanning the raw dicts.
+    time_op("plan_string (previous per-poll log)", lambda: sdk_plan.plan_string("deploy", plan))
+    time_op(
+        "raw get_step(get_phase()) of the last step",
+        lambda: sdk_plan.get_step(sdk_plan.get_phase(plan, lookups[-1][0]), lookups[-1][1]),
+    )
+    time_op("parse Plan", lambda: sdk_plan.Plan("deploy", plan))
+
+    parsed = sdk_plan.Plan("deploy", plan)
+    parsed_updated = sdk_plan.Plan("deploy", updated)
+    time_op("Plan.get_step() of the last step", lambda: parsed.get_step(*lookups[-1]))
+    time_op("Plan equality (one step changed)", lambda: parsed == parsed_updated)
+    time_op("Plan.diff() (one step changed)", lambda: parsed_updated.diff(parsed))
+
+    # Looking up every step, as when checking the status of each step in a plan:
+    time_op(
+        "raw lookup of all {} steps".format(len(lookups)),
+        lambda: [sdk_plan.get_step(sdk_plan.get_phase(plan, p), s) for p, s in lookups],
+    )
+
+    def parse_and_lookup_all():
+        parsed = sdk_plan.Plan("deploy", plan)
+        return [parsed.get_step(p, s) for p, s in lookups]
+
+    time_op("Plan parse + lookup of all {} steps".format(len(lookups)), parse_and_lookup_all)
+
+
+def synthetic_log(size_bytes, seed=0):
+    """Returns log content resembling a chatty service's stdout: timestamped lines from a small set
+    of loggers and messages, with varying ids and durations."""
+    rng = random.Random(seed)
+    levels = ["INFO", "INFO", "INFO", "DEBUG", "WARN"]
+    loggers = ["o.a.c.db.ColumnFamilyStore", "o.a.c.service.StorageService", "o.e.cluster.service"]
+    messages = [
+        "Enqueuing flush of {} ({} serialized bytes)",
+        "Completed compaction of {} sstables in {}ms",
+        "Handshake with peer {} finished after {}ms",
+    ]
+    lines = []
+    size = 0
+    while size < size_bytes:
+        line = "{} {:>5} [{}] {}\n".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1500000000 + len(lines))),
+            rng.choice(levels),
+            rng.choice(loggers),
+            rng.choice(messages).format(rng.randrange(1 << 32), rng.randrange(100000)),
+        )
+        lines.append(line)
+        size += len(line)
+    return "".join(lines).encode("utf-8")[:size_bytes]
+
+
+class _SyntheticResponse(object):
+    """Stands in for a streamed requests response of the provided content."""
+
+    def __init__(self, content):
+        self._content = content
+        self.headers = {"Content-Length": str(len(content))}
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self._content), chunk_size):
+            yield self._content[offset : offset + chunk_size]
+
+
+def benchmark_compression(args):
+    content = synthetic_log(args.megabytes * 1024 * 1024)
+    modes = [sdk_utils.COMPRESSION_NONE, sdk_utils.COMPRESSION_GZIP]
+    if sdk_utils.zstandard is not None:
+        modes.append(sdk_utils.COMPRESSION_ZSTD)
+    else:
+        print("Skipping zstd: the 'zstandard' module isn't installed")
+    print(
+        "Writing {} MB of synthetic logs, best of {} iterations:".format(
+            args.megabytes, args.iterations
+        )
+    )
+    print("{:<30} {:>12} {:>10} {:>12}".format("", "written", "ratio", "throughput"))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for compression in modes:
+            path = os.path.join(temp_dir, "stdout" + sdk_utils.compression_suffix(compression))
+            # Previous fixed 8 KB chunks, vs chunks sized by adaptive_chunk_size():
+            for label, chunk_size in (("8 KB chunks", 8192), ("adaptive chunks", None)):
+                seconds = min(
+                    timeit.repeat(
+                        lambda: sdk_utils.write_response(
+                            _SyntheticResponse(content), path, compression, chunk_size=chunk_size
+                        ),
+                        number=1,
+                        repeat=args.iterations,
+                    )
+                )
+                written = os.path.getsize(path)
+                print(
+                    "{:<30} {:>9.2f} MB {:>9.1f}x {:>7.1f} MB/s".format(
+                        "{}, {}".format(compression, label),
+                        written / (1024 * 1024),
+                        len(content) / written,
+                        args.megabytes / seconds,
+                    )
+                )
+
+
+def synthetic_agent_executor_paths(sandbox_count, seed=0):
+    """Returns a files/debug response for an agent with the provided number of executor sandboxes,
+    listing each sandbox under all of the schemas of DC/OS 1.11, along with the tasks which ran in
+    them. Half of the tasks use the default executor, and half are Marathon tasks."""
+    rng = random.Random(seed)
+
+    def uuid():
+        return "-".join(
+            "".join(rng.choice("0123456789abcdef") for _ in range(length))
+            for length in (8, 4, 4, 4, 12)
+        )
+
+    agent_id = "{}-S1".format(uuid())
+    paths = {"/slave/log": "/var/log/mesos/mesos-agent.log"}
+    tasks = []
+    for i in range(sandbox_count):
+        framework_id = "{}-{:04d}".format(agent_id[:-3], i % 10)
+        task_id = "pod-{}-server__{}".format(i, uuid())
+        if i % 2:
+            executor_id = "pod__{}".format(uuid())
+        else:
+            executor_id = ""
+            task_id = "app-{}.{}".format(i, uuid())
+        run_id = uuid()
+        sandbox = "/var/lib/mesos/slave/slaves/{}/frameworks/{}/executors/{}/runs/{}".format(
+            agent_id, framework_id, executor_id or task_id, run_id
+        )
+        paths[sandbox] = sandbox
+        paths[sandbox.replace(run_id, "latest")] = sandbox
+        paths[sandbox[sandbox.index("/frameworks/") :].replace(run_id, "latest")] = sandbox
+        tasks.append(
+            sdk_diag._TaskEntry({"id": task_id, "executor_id": executor_id, "slave_id": agent_id})
+        )
+    items = list(paths.items())
+    rng.shuffle(items)
+    return dict(items), tasks
+
+
+def previous_find_matching_executor_path(agent_executor_paths, task_entry):
+    """The previous lookup, which compiled three patterns per task and scanned all paths for each."""
+    path_id = task_entry.executor_id if task_entry.executor_id else task_entry.task_id
+    for pattern in (
+        "^/frameworks/.*/executors/{}/runs/latest$",
+        "^/var/lib/mesos/.*/executors/{}/runs/latest$",
+        "^/var/lib/mesos/.*/executors/{}/runs/[a-f0-9-]+$",
+    ):
+        compiled = re.compile(pattern.format(path_id))
+        for browse_path in agent_executor_paths.keys():
+            if compiled.match(browse_path):
+                return browse_path
+    return ""
+
+
+def benchmark_executor_paths(args):
+    agent_executor_paths, tasks = synthetic_agent_executor_paths(args.sandboxes)
+    print(
+        "Agent with {} sandboxes ({} paths), looking up all {} tasks, {} iterations:".format(
+            args.sandboxes, len(agent_executor_paths), len(tasks), args.iterations
+        )
+    )
+    expected = [previous_find_matching_executor_path(agent_executor_paths, t) for t in tasks]
+    index = sdk_diag._ExecutorPathIndex(agent_executor_paths)
+    if [index.find(t) for t in tasks] != expected:
+        print("ERROR: index lookups differ from the previous lookups")
+        return 1
+
+    def time_op(name, fn, iterations):
+        report(name, iterations, timeit.timeit(fn, number=iterations))
+
+    # The previous lookups are O(tasks x paths), so only time them once when there are many tasks:
+    time_op(
+        "previous scan of all tasks",
+        lambda: [previous_find_matching_executor_path(agent_executor_paths, t) for t in tasks],
+        1 if args.sandboxes > 500 else args.iterations,
+    )
+    time_op(
+        "build _ExecutorPathIndex",
+        lambda: sdk_diag._ExecutorPathIndex(agent_executor_paths),
+        args.iterations,
+    )
+    time_op("index lookup of all tasks", lambda: [index.find(t) for t in tasks], args.iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the testing/ helpers")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    plan_parser = subparsers.add_parser("plan", help="Plan parsing, lookups and diffing")
+    plan_parser.add_argument("--phases", type=int, default=10)
+    plan_parser.add_argument("--steps", type=int, default=1000, help="Total steps in the plan")
+    plan_parser.add_argument("--iterations", type=int, default=100)
+    plan_parser.set_defaults(func=benchmark_plan)
+
+    executor_paths_parser = subparsers.add_parser(
+        "executor-paths", help="Executor sandbox lookups in an agent's files/debug response"
+    )
+    executor_paths_parser.add_argument("--sandboxes", type=int, default=2000)
+    executor_paths_parser.add_argument("--iterations", type=int, default=20)
+    executor_paths_parser.set_defaults(func=benchmark_executor_paths)
+
+    compression_parser = subparsers.add_parser(
+        "compression", help="Compression ratio and throughput of downloaded log files"
+    )
+    compression_parser.add_argument("--megabytes", type=int, default=64)
+    compression_parser.add_argument("--iterations", type=int, default=3)
+    compression_parser.set_defaults(func=benchmark_compression)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ import re
 from typing import List
 
 import sdk_cmd
+import sdk_utils
 
 import config
 
@@ -79,8 +80,13 @@ def browse_task_sandbox(agent_id: str, executor_sandbox_path: str, task_id: str)
 
 @config.retry
 def download_agent_path(
-    agent_id: str, agent_file_path: str, output_file_path: str, chunk_size: int = 8192
+    agent_id: str,
+    agent_file_path: str,
+    output_file_path: str,
+    compression: str = sdk_utils.COMPRESSION_NONE,
 ) -> None:
+    """Downloads a file from the agent, compressing it while it's written if a compression is
+    provided. The output path is suffixed accordingly, e.g. 'stdout.gz' for gzip."""
     stream = sdk_cmd.cluster_request(
         "GET",
         "/slave/{}/files/download?path={}".format(agent_id, agent_file_path),
@@ -100,13 +106,17 @@ def download_agent_path(
         # Retry.
         raise Exception(stream)
 
-    with open(output_file_path, "wb") as f:
-        for chunk in stream.iter_content(chunk_size=chunk_size):
-            f.write(chunk)
+    sdk_utils.write_response(
+        stream, output_file_path + sdk_utils.compression_suffix(compression), compression
+    )
 
 
 def download_sandbox_files(
-    agent_id: str, sandbox: List[dict], output_base_path: str, patterns_to_download: List[str] = []
+    agent_id: str,
+    sandbox: List[dict],
+    output_base_path: str,
+    patterns_to_download: List[str] = [],
+    compression: str = sdk_utils.COMPRESSION_NONE,
 ) -> List[dict]:
     if not os.path.exists(output_base_path):
         os.makedirs(output_base_path)
@@ -116,7 +126,10 @@ def download_sandbox_files(
         for pattern in patterns_to_download:
             if re.match(pattern, task_file_basename):
                 download_agent_path(
-                    agent_id, task_file["path"], os.path.join(output_base_path, task_file_basename)
+                    agent_id,
+                    task_file["path"],
+                    os.path.join(output_base_path, task_file_basename),
+                    compression,
                 )
 
 
@@ -126,6 +139,7 @@ def download_task_files(
     task_id: str,
     base_path: str,
     patterns_to_download: List[str] = [],
+    compression: str = sdk_utils.COMPRESSION_NONE,
 ) -> List[dict]:
     executor_sandbox = browse_executor_sandbox(agent_id, executor_sandbox_path)
     pod_task_sandbox = browse_task_sandbox(agent_id, executor_sandbox_path, task_id)
@@ -134,14 +148,16 @@ def download_task_files(
     if pod_task_sandbox:
         output_pod_task_directory = os.path.join(base_path, task_id, "task")
         download_sandbox_files(
-            agent_id, executor_sandbox, output_pod_task_directory, patterns_to_download
+            agent_id, executor_sandbox, output_pod_task_directory, patterns_to_download, compression
         )
 
         output_executor_directory = os.path.join(base_path, task_id, "executor")
         download_sandbox_files(
-            agent_id, pod_task_sandbox, output_executor_directory, patterns_to_download
+            agent_id, pod_task_sandbox, output_executor_directory, patterns_to_download, compression
         )
     # Scheduler task: no parent executor, only download files under its sandbox.
     else:
         output_directory = os.path.join(base_path, task_id)
-        download_sandbox_files(agent_id, executor_sandbox, output_directory, patterns_to_download)
+        download_sandbox_files(
+            agent_id, executor_sandbox, output_directory, patterns_to_download, compression
+        )
@@ -1,11 +1,28 @@
+import collections
+import concurrent.futures
 import json
 import logging
 import os
+import time
+
+import sdk_utils
 
 log = logging.getLogger(__name__)
 
 
+class BundleStep:
+    """A step in the creation of a bundle, which is run once all of the steps it depends on have
+    succeeded."""
+
+    def __init__(self, name, fn, dependencies=None):
+        self.name = name
+        self.fn = fn
+        self.dependencies = dependencies if dependencies is not None else []
+
+
 class Bundle:
+    MANIFEST_FILE_NAME = "bundle_manifest.json"
+
     def write_file(self, file_name, content, serialize_to_json=False):
         file_path = os.path.join(self.output_directory, file_name)
 
@@ -17,5 +34,102 @@ class Bundle:
                 f.write(content)
                 f.write("\n")
 
+    def run_steps(self, steps, max_workers=sdk_utils.DEFAULT_CONCURRENCY):
+        """Runs the provided BundleSteps in a bounded thread pool, starting each step as soon as its
+        dependencies have succeeded. A failed step doesn't stop any other steps, except for those
+        which depend on it, which are skipped. The outcome and timing of each step are written to
+        the bundle manifest.
+
+        Returns the names of the steps which failed or were skipped.
+        """
+        steps_by_name = collections.OrderedDict((step.name, step) for step in steps)
+        for step in steps:
+            unknown = [d for d in step.dependencies if d not in steps_by_name]
+            if unknown:
+                raise ValueError(
+                    "Step '{}' has unknown dependencies: {}".format(step.name, unknown)
+                )
+
+        start = time.time()
+        results = {}
+        pending = collections.OrderedDict(steps_by_name)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            while pending or running:
+                for step in list(pending.values()):
+                    if any(d not in results for d in step.dependencies):
+                        continue
+                    del pending[step.name]
+                    unsuccessful = [
+                        d for d in step.dependencies if results[d]["status"] != "succeeded"
+                    ]
+                    if unsuccessful:
+                        log.warning(
+                            "Skipping step '%s' as its dependencies didn't succeed: %s",
+                            step.name,
+                            ", ".join(unsuccessful),
+                        )
+                        results[step.name] = {
+                            "status": "skipped",
+                            "error": "Dependencies didn't succeed: {}".format(
+                                ", ".join(unsuccessful)
+                            ),
+                        }
+                        break  # rescan, as steps depending on this one may now be skipped too
+                    running[executor.submit(self._run_step, step, start)] = step.name
+                else:
+                    if not running:
+                        # Only possible with circular dependencies:
+                        for name in pending:
+                            results[name] = {"status": "skipped", "error": "Circular dependencies"}
+                        pending.clear()
+                        break
+                    done, _ = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+
+        manifest = {
+            "duration_seconds": time.time() - start,
+            "sum_of_step_durations_seconds": sum(
+                r.get("duration_seconds", 0) for r in results.values()
+            ),
+            "steps": [
+                dict(results[step.name], name=step.name, dependencies=step.dependencies)
+                for step in steps
+            ],
+        }
+        self.write_file(self.MANIFEST_FILE_NAME, manifest, serialize_to_json=True)
+
+        unsuccessful = [step.name for step in steps if results[step.name]["status"] != "succeeded"]
+        log.info(
+            "Ran %d steps in %s (sum of step durations: %s), %d didn't succeed%s",
+            len(steps),
+            sdk_utils.pretty_duration(manifest["duration_seconds"]),
+            sdk_utils.pretty_duration(manifest["sum_of_step_durations_seconds"]),
+            len(unsuccessful),
+            ": {}".format(", ".join(unsuccessful)) if unsuccessful else "",
+        )
+        return unsuccessful
+
+    def _run_step(self, step, start):
+        step_start = time.time()
+        log.info("Starting step '%s'", step.name)
+        try:
+            step.fn()
+            status, error = "succeeded", None
+        except Exception as e:
+            log.exception("Step '%s' failed", step.name)
+            status, error = "failed", str(e)
+        result = {
+            "status": status,
+            "started_seconds": step_start - start,
+            "duration_seconds": time.time() - step_start,
+        }
+        if error is not None:
+            result["error"] = error
+        return result
+
     def create(self):
         raise NotImplementedError
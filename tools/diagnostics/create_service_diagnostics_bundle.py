@@ -15,6 +15,7 @@ import sys
 
 from full_bundle import FullBundle
 import sdk_cmd
+import sdk_utils
 
 log = logging.getLogger(__name__)
 
@@ -133,6 +134,19 @@ def parse_args() -> dict:
         help="The directory where bundles will be written to",
     )
 
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=[
+            sdk_utils.COMPRESSION_NONE,
+            sdk_utils.COMPRESSION_GZIP,
+            sdk_utils.COMPRESSION_ZSTD,
+        ],
+        default=sdk_utils.COMPRESSION_NONE,
+        help="The compression to apply to downloaded task log files (zstd falls back to gzip "
+        + "when the 'zstandard' module is missing)",
+    )
+
     parser.add_argument(
         "--yes",
         action="store_true",
@@ -147,6 +161,7 @@ def preflight_check() -> (int, dict):
     package_name_given = args.package_name
     service_name = args.service_name
     bundles_directory = args.bundles_directory
+    compression = sdk_utils.resolve_compression(args.compression)
     should_prompt_user = not args.yes
 
     (is_authenticated, message) = is_authenticated_to_dcos_cluster()
@@ -202,6 +217,7 @@ def preflight_check() -> (int, dict):
             "package_version": package_version,
             "cluster_name": cluster["name"],
             "bundles_directory": bundles_directory,
+            "compression": compression,
             "dcos_version": cluster["version"],
             "cluster_url": cluster["url"],
             "should_prompt_user": should_prompt_user,
@@ -220,6 +236,7 @@ def main(argv) -> int:
     print("  Service name:    {}".format(args.get("service_name")))
     print("  DC/OS version:   {}".format(args.get("dcos_version")))
     print("  Cluster URL:     {}".format(args.get("cluster_url")))
+    print("  Compression:     {}".format(args.get("compression")))
 
     if args.get("should_prompt_user"):
         answer = input("\nProceed? [Y/n]: ")
@@ -227,7 +244,10 @@ def main(argv) -> int:
             return 0
 
     rc, _ = FullBundle(
-        args.get("package_name"), args.get("service_name"), args.get("bundles_directory")
+        args.get("package_name"),
+        args.get("service_name"),
+        args.get("bundles_directory"),
+        args.get("compression"),
     ).create()
 
     return rc
@@ -7,7 +7,7 @@ import os
 import sdk_cmd
 import sdk_utils
 
-from bundle import Bundle
+from bundle import Bundle, BundleStep
 from service_bundle import ServiceBundle
 import base_tech_bundle as base_tech
 import config
@@ -68,10 +68,13 @@ def directory_date_string() -> str:
 
 
 class FullBundle(Bundle):
-    def __init__(self, package_name, service_name, bundles_directory):
+    def __init__(
+        self, package_name, service_name, bundles_directory, compression=sdk_utils.COMPRESSION_NONE
+    ):
         self.package_name = package_name
         self.service_name = service_name
         self.bundles_directory = bundles_directory
+        self.compression = compression
         self.output_directory = self._create_bundle_directory()
 
     def _configure_logging(self):
@@ -147,24 +150,29 @@ class FullBundle(Bundle):
             if is_service_scheduler_task(self.package_name, self.service_name, t)
         ]
 
-        ServiceBundle(
+        # The service bundle and the base tech bundle are created together, with their steps running
+        # concurrently:
+        steps = ServiceBundle(
             self.package_name,
             self.service_name,
             scheduler_tasks,
             active_service,
             self.output_directory,
-        ).create()
+            self.compression,
+        ).steps()
 
         if base_tech.is_package_supported(self.package_name):
             BaseTechBundle = base_tech.get_bundle_class(self.package_name)
 
-            BaseTechBundle(
+            base_tech_bundle = BaseTechBundle(
                 self.package_name,
                 self.service_name,
                 scheduler_tasks,
                 active_service,
                 self.output_directory,
-            ).create()
+                self.compression,
+            )
+            steps.append(BundleStep("base_tech_bundle", base_tech_bundle.create))
         else:
             log.info(
                 "Don't know how to get base tech diagnostics for package '%s'", self.package_name
@@ -175,6 +183,8 @@ class FullBundle(Bundle):
             )
             log.info("This is ok, we were still able to get DC/OS and service-level diagnostics")
 
+        self.run_steps(steps)
+
         log.info("\nCreated %s", os.path.abspath(self.output_directory))
 
         return 0, self
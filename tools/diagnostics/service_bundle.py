@@ -2,14 +2,17 @@ import functools
 import json
 import logging
 import os
+import requests
 from toolz import groupby
 from typing import List
 
 import sdk_cmd
 import sdk_diag
 import sdk_hosts
+import sdk_plan
+import sdk_utils
 
-from bundle import Bundle
+from bundle import Bundle, BundleStep
 import agent
 import config
 
@@ -18,14 +21,32 @@ log = logging.getLogger(__name__)
 
 class ServiceBundle(Bundle):
     DOWNLOAD_FILES_WITH_PATTERNS = ["^stdout(\.\d+)?$", "^stderr(\.\d+)?$"]
-
-    def __init__(self, package_name, service_name, scheduler_tasks, service, output_directory):
+    # The maximum number of scheduler API requests to make at the same time.
+    SCHEDULER_REQUEST_CONCURRENCY = 8
+    # The Admin Router responses which mean that it couldn't reach the scheduler.
+    ADMIN_ROUTER_UNREACHABLE_STATUS_CODES = (502, 503, 504)
+
+    def __init__(
+        self,
+        package_name,
+        service_name,
+        scheduler_tasks,
+        service,
+        output_directory,
+        compression=sdk_utils.COMPRESSION_NONE,
+    ):
         self.package_name = package_name
         self.service_name = service_name
         self.scheduler_tasks = scheduler_tasks
         self.service = service
         self.framework_id = service.get("id")
         self.output_directory = output_directory
+        # The compression applied to downloaded task log files, see sdk_utils.resolve_compression().
+        self.compression = compression
+        self.session = sdk_cmd.pooled_session(self.SCHEDULER_REQUEST_CONCURRENCY)
+        # Set once the scheduler API couldn't be reached through Admin Router, after which it's only
+        # queried with curl inside the scheduler task.
+        self.scheduler_api_unreachable = False
 
     @config.retry
     def install_cli(self):
@@ -74,32 +95,18 @@ class ServiceBundle(Bundle):
         else:
             self.write_file("service_pod_status.json", stdout)
 
-    @config.retry
-    def create_plan_status_file(self, plan):
-        rc, stdout, stderr = sdk_cmd.svc_cli(
-            self.package_name,
-            self.service_name,
-            "plan status {} --json".format(plan),
-            print_output=False,
-        )
-
-        if rc != 0 or stderr:
-            log.error("Could not get pod status\nstdout: '%s'\nstderr: '%s'", stdout, stderr)
-        else:
-            self.write_file("service_plan_status_{}.json".format(plan), stdout)
-
     @config.retry
     def create_plans_status_files(self):
-        rc, stdout, stderr = sdk_cmd.svc_cli(
-            self.package_name, self.service_name, "plan list", print_output=False
-        )
-
-        if rc != 0 or stderr:
-            log.error("Could not get plan list\nstdout: '%s'\nstderr: '%s'", stdout, stderr)
-        else:
-            plans = json.loads(stdout)
-            for plan in plans:
-                self.create_plan_status_file(plan)
+        snapshot = sdk_plan.get_all_plans(self.service_name)
+        for plan_name, entry in snapshot["plans"].items():
+            if "plan" in entry:
+                self.write_file(
+                    "service_plan_status_{}.json".format(plan_name),
+                    entry["plan"],
+                    serialize_to_json=True,
+                )
+            else:
+                log.error("Could not get plan %s status: %s", plan_name, entry["error"])
 
     def download_log_files(self):
         all_tasks = self.scheduler_tasks + self.tasks()
@@ -110,13 +117,15 @@ class ServiceBundle(Bundle):
 
         agent_executor_paths = {}
         for agent_id in tasks_by_agent_id.keys():
-            agent_executor_paths[agent_id] = agent.debug_agent_files(agent_id)
+            agent_executor_paths[agent_id] = sdk_diag._ExecutorPathIndex(
+                agent.debug_agent_files(agent_id)
+            )
 
         task_executor_sandbox_paths = {}
         for agent_id, tasks in tasks_by_agent_id.items():
             for task in tasks:
-                task_executor_sandbox_paths[task["id"]] = sdk_diag._find_matching_executor_path(
-                    agent_executor_paths[agent_id], sdk_diag._TaskEntry(task)
+                task_executor_sandbox_paths[task["id"]] = agent_executor_paths[agent_id].find(
+                    sdk_diag._TaskEntry(task)
                 )
 
         for task_id, task_executor_sandbox_path in task_executor_sandbox_paths.items():
@@ -129,6 +138,7 @@ class ServiceBundle(Bundle):
                     task_id,
                     os.path.join(self.output_directory, "tasks"),
                     self.DOWNLOAD_FILES_WITH_PATTERNS,
+                    self.compression,
                 )
             else:
                 log.warn(
@@ -137,64 +147,80 @@ class ServiceBundle(Bundle):
                     task_id,
                 )
 
-    @config.retry
-    def create_offers_file(self):
+    def scheduler_get(self, path: str) -> str:
+        """Returns the content of a scheduler API endpoint, e.g. 'v1/debug/offers'.
+
+        The endpoint is fetched through Admin Router. If the scheduler can't be reached that way,
+        e.g. because it's network-isolated, this falls back to running curl inside the scheduler
+        task, for this and all later requests. Only connection errors and Admin Router's 502, 503
+        and 504 responses are taken to mean that the scheduler can't be reached. Any other error,
+        such as a 404 or 500 from the scheduler itself or a timeout, is raised.
+        """
+        if not self.scheduler_api_unreachable:
+            try:
+                response = sdk_cmd.service_request(
+                    "GET",
+                    self.service_name,
+                    path,
+                    retry=False,
+                    raise_on_error=False,
+                    session=self.session,
+                )
+            except requests.exceptions.Timeout:
+                raise
+            except requests.exceptions.ConnectionError as e:
+                error = str(e)
+            else:
+                if response.status_code not in self.ADMIN_ROUTER_UNREACHABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.text
+                error = "HTTP {}".format(response.status_code)
+            log.warning(
+                "Could not reach scheduler endpoint '%s' through Admin Router (%s), "
+                "falling back to curl inside the scheduler task",
+                path,
+                error,
+            )
+            self.scheduler_api_unreachable = True
+
         scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
         scheduler = self.scheduler_tasks[0]
 
         rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"], "curl -s {}/v1/debug/offers".format(scheduler_vip), print_output=False
+            scheduler["id"], "curl -s {}/{}".format(scheduler_vip, path), print_output=False
         )
 
         if rc != 0 or stderr:
-            log.error(
-                "Could not get scheduler offers\nstdout: '%s'\nstderr: '%s'", stdout[:100], stderr
+            raise Exception(
+                "Could not get scheduler endpoint '{}'\nstdout: '{}'\nstderr: '{}'".format(
+                    path, stdout[:100], stderr
+                )
             )
+        return stdout
+
+    @config.retry
+    def offers(self) -> str:
+        return self.scheduler_get("v1/debug/offers")
+
+    def create_offers_file(self):
+        try:
+            offers = self.offers()
+        except Exception as e:
+            log.error("Could not get scheduler offers: %s", e)
         else:
-            self.write_file("service_v1_debug_offers.html", stdout)
+            self.write_file("service_v1_debug_offers.html", offers)
 
     @functools.lru_cache()
     @config.retry
     def configuration_ids(self) -> List[str]:
-        scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
-        scheduler = self.scheduler_tasks[0]
-
-        rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"],
-            "curl -s {}/v1/configurations".format(scheduler_vip),
-            print_output=False,
-        )
-
-        if rc != 0 or stderr:
-            raise Exception(
-                "Could not get scheduler configuration IDs\nstdout: '%s'\nstderr: '%s'",
-                stdout,
-                stderr,
-            )
-        else:
-            return json.loads(stdout)
+        return json.loads(self.scheduler_get("v1/configurations"))
 
+    # The cache is outside of the retries, and only holds configurations which were fetched: one
+    # which still failed after its retries is fetched again on the next call.
     @functools.lru_cache()
     @config.retry
     def configuration(self, configuration_id) -> dict:
-        scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
-        scheduler = self.scheduler_tasks[0]
-
-        rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"],
-            "curl -s {}/v1/configurations/{}".format(scheduler_vip, configuration_id),
-            print_output=False,
-        )
-
-        if rc != 0 or stderr:
-            raise Exception(
-                "Could not get scheduler configuration with ID '{}'\nstdout: '%s'\nstderr: '%s'",
-                configuration_id,
-                stdout,
-                stderr,
-            )
-        else:
-            return json.loads(stdout)
+        return json.loads(self.scheduler_get("v1/configurations/{}".format(configuration_id)))
 
     @config.retry
     def create_configuration_ids_file(self):
@@ -202,21 +228,44 @@ class ServiceBundle(Bundle):
             "service_v1_configuration_ids.json", self.configuration_ids(), serialize_to_json=True
         )
 
-    @config.retry
+    def create_configuration_file_with_id(self, configuration_id):
+        self.write_file(
+            "service_v1_configuration_{}.json".format(configuration_id),
+            self.configuration(configuration_id),
+            serialize_to_json=True,
+        )
+
     def create_configuration_files(self):
-        for configuration_id in self.configuration_ids():
-            self.write_file(
-                "service_v1_configuration_{}.json".format(configuration_id),
-                self.configuration(configuration_id),
-                serialize_to_json=True,
-            )
+        """Writes the file of each configuration. Each configuration is retried on its own, and one
+        which still fails is logged without affecting the files of the others."""
+
+        def create_configuration_file(configuration_id):
+            try:
+                self.create_configuration_file_with_id(configuration_id)
+            except Exception as e:
+                log.error("Could not get configuration %s: %s", configuration_id, e)
+
+        sdk_utils.run_concurrently(
+            "Fetch {} configurations".format(self.service_name),
+            {
+                configuration_id: functools.partial(create_configuration_file, configuration_id)
+                for configuration_id in self.configuration_ids()
+            },
+            self.SCHEDULER_REQUEST_CONCURRENCY,
+        )
+
+    def steps(self) -> List[BundleStep]:
+        """Returns the steps which create this bundle, see Bundle.run_steps()."""
+        return [
+            BundleStep("install_cli", self.install_cli),
+            BundleStep("configuration", self.create_configuration_file, ["install_cli"]),
+            BundleStep("pod_status", self.create_pod_status_file, ["install_cli"]),
+            BundleStep("plans", self.create_plans_status_files),
+            BundleStep("offers", self.create_offers_file),
+            BundleStep("configuration_ids", self.create_configuration_ids_file),
+            BundleStep("configurations", self.create_configuration_files, ["configuration_ids"]),
+            BundleStep("log_files", self.download_log_files),
+        ]
 
     def create(self):
-        self.install_cli()
-        self.create_configuration_file()
-        self.create_pod_status_file()
-        self.create_plans_status_files()
-        self.create_offers_file()
-        self.create_configuration_ids_file()
-        self.create_configuration_files()
-        self.download_log_files()
+        self.run_steps(self.steps())